@@ -1,18 +1,104 @@
 #!/usr/bin/env python3
 
+import argparse
+import errno
+import functools
+import itertools
+import json
+import re
+import shlex
+import shutil
 import subprocess
 import os
+import platform
+import pty
 import sys
+import threading
 import time
+import unicodedata
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
 from rich.prompt import Confirm, Prompt
-from rich.progress import Progress
-from typing import List, Dict
+from rich.progress import BarColumn, Progress, TaskProgressColumn, TextColumn, TimeElapsedColumn
+from typing import List, Dict, Tuple
 
 console = Console()
 
+# Descargas simultáneas dentro de cada `brew fetch` por defecto (--jobs), en
+# los Homebrew que admiten HOMEBREW_DOWNLOAD_CONCURRENCY; las instalaciones
+# van en serie porque brew no admite dos `brew install` a la vez
+DEFAULT_JOBS = 4
+
+# Evita que cada `brew` en paralelo intente actualizar Homebrew por su cuenta
+BREW_ENV = "HOMEBREW_NO_AUTO_UPDATE=1"
+
+# Base de las URLs del tema y los plugins de ZSH; SETUP_MACOS_GIT_BASE permite
+# usar un espejo (o repos bare locales con file:// en los tests)
+GIT_BASE = os.environ.get("SETUP_MACOS_GIT_BASE", "https://github.com")
+
+# Perfil declarativo guardado (apps elegidas) y última instantánea del estado
+# de Homebrew, para que --plan/--apply no pregunten ni consulten brew de nuevo
+PROFILE_PATH = os.path.expanduser("~/.config/setup_macos/profile.json")
+SNAPSHOT_PATH = os.path.expanduser("~/.cache/setup_macos/state.json")
+
+# Salida completa de cada comando, un archivo por comando y una carpeta por ejecución
+LOG_DIR = os.path.join(os.path.expanduser("~/.cache/setup_macos/logs"), time.strftime("%Y%m%d-%H%M%S"))
+
+# Fases de brew (líneas "==> ...") y dónde queda la barra al llegar a cada una.
+# Dentro de la descarga la barra sigue el porcentaje que dibuja curl.
+BREW_PHASES = [
+    (("Downloading", "Fetching"), "descargando", 5),
+    (("Verifying",), "verificando", 70),
+    (("Pouring", "Installing", "Moving", "Linking", "Artifact", "Purging"), "instalando", 75),
+    (("Caveats", "Summary", "Running `brew cleanup"), "terminando", 95),
+]
+
+# Tramo de la barra que recorre el porcentaje de cada descarga
+DOWNLOAD_RANGE = (5, 70)
+
+# Barra de progreso de curl ("######      14.3%"), que brew solo muestra en una terminal
+CURL_PERCENT = re.compile(r"[#=O\-\s]*?(\d{1,3}(?:\.\d+)?)%$")
+
+# Secuencias de escape de la terminal (colores, título) que brew añade en una pseudoterminal
+ANSI_ESCAPE = re.compile(r"\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07]*\x07|[()][A-B0-9])")
+
+# Inicio de la instalación de un paquete en la salida de brew ("==> Pouring
+# wget--1.24.5.arm64_sonoma.bottle.tar.gz", "==> Installing Cask docker");
+# la línea que empieza por 🍺 lo da por terminado
+BREW_PACKAGE_START = re.compile(r"==> (?:Pouring (\S+?)--|Installing Cask (\S+))")
+
+# Líneas finales de salida que se muestran cuando un comando falla
+ERROR_TAIL_LINES = 5
+
+# Pasos y comandos más lentos que se listan al terminar
+SLOWEST_SPANS = 8
+
+# Tema y plugins de Oh My Zsh: (nombre, repo en GIT_BASE, carpeta dentro de $ZSH_CUSTOM)
+ZSH_REPOS = [
+    ("powerlevel10k", "romkatv/powerlevel10k", "themes"),
+    ("zsh-autosuggestions", "zsh-users/zsh-autosuggestions", "plugins"),
+    ("zsh-history-substring-search", "zsh-users/zsh-history-substring-search", "plugins"),
+    ("zsh-syntax-highlighting", "zsh-users/zsh-syntax-highlighting", "plugins"),
+]
+
+# Tema y plugins que se activan en ~/.zshrc
+ZSH_THEME = "powerlevel10k/powerlevel10k"
+ZSH_PLUGINS = [
+    "git", "jump", "zsh-autosuggestions", "zsh-history-substring-search",
+    "jsontools", "zsh-syntax-highlighting", "zsh-interactive-cd",
+]
+
+# Marcadores de los bloques que este script gestiona en ~/.zshrc
+ZSHRC_BLOCK_START = "# >>> setup_macos.py ({name}) >>>"
+ZSHRC_BLOCK_END = "# <<< setup_macos.py ({name}) <<<"
+
+# Línea de ~/.zshrc que carga Oh My Zsh: el tema y los plugins van antes
+OH_MY_ZSH_SOURCE = re.compile(r'^\s*(source|\.)\s+"?\$ZSH/oh-my-zsh\.sh"?\s*$', re.MULTILINE)
+
 # Verificar e instalar pip y la dependencia 'rich'
 def ensure_pip_installed() -> bool:
     """Verifica si pip está instalado; si no, intenta instalarlo."""
@@ -111,18 +197,280 @@ APPS_BY_CATEGORY = {
     ],
 }
 
+class Timeline:
+    """Intervalos de una ejecución (pasos y comandos), para ver dónde se va el tiempo.
+
+    Cada intervalo guarda su inicio, duración e hilo; los comandos además
+    su código de salida y los bytes que escribieron. Al terminar se guarda
+    como JSON y en el formato de trazas de Chrome, que chrome://tracing o
+    https://ui.perfetto.dev muestran como un flamegraph por hilo.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self._origin = time.perf_counter()
+        self.spans = []
+        self._threads = {threading.get_ident(): 1}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, kind: str = "step", **attrs):
+        """Mide el bloque; los atributos que se añadan al dict devuelto se guardan con él."""
+        start = time.perf_counter()
+        span = {"name": name, "kind": kind, **attrs}
+        try:
+            yield span
+        except BaseException as e:
+            span["error"] = type(e).__name__
+            raise
+        finally:
+            span["start"] = round(start - self._origin, 6)
+            span["seconds"] = round(time.perf_counter() - start, 6)
+            with self._lock:
+                span["thread"] = self._threads.setdefault(threading.get_ident(), len(self._threads) + 1)
+                self.spans.append(span)
+
+    def summary(self) -> Dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start"])
+        return {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+            "total_seconds": round(time.perf_counter() - self._origin, 3),
+            "machine": {
+                "platform": platform.platform(),
+                "arch": platform.machine(),
+                "cpus": os.cpu_count(),
+                "python": platform.python_version(),
+            },
+            "spans": spans,
+        }
+
+    def chrome_trace(self) -> Dict:
+        """Eventos "X" (inicio + duración, en microsegundos) del formato de trazas de Chrome."""
+        summary = self.summary()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+             "args": {"name": "principal" if tid == 1 else f"trabajo {tid}"}}
+            for tid in sorted({span["thread"] for span in summary["spans"]} | {1})
+        ]
+        for span in summary["spans"]:
+            events.append({
+                "name": span["name"],
+                "cat": span["kind"],
+                "ph": "X",
+                "ts": int(span["start"] * 1_000_000),
+                "dur": int(span["seconds"] * 1_000_000),
+                "pid": 1,
+                "tid": span["thread"],
+                "args": {key: value for key, value in span.items()
+                         if key not in ("name", "kind", "start", "seconds", "thread")},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": summary["machine"]}
+
+    def write(self, directory: str) -> str:
+        """Escribe timeline.json y trace.json en directory; devuelve la ruta del primero."""
+        path = os.path.join(directory, "timeline.json")
+        write_json_atomic(path, self.summary())
+        write_json_atomic(os.path.join(directory, "trace.json"), self.chrome_trace())
+        return path
+
+    def show_slowest(self, count: int = SLOWEST_SPANS) -> None:
+        """Tabla con los pasos y comandos que más tardaron."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["seconds"], reverse=True)[:count]
+        if not spans:
+            return
+        table = Table(title=f"Lo que más tardó ({time.perf_counter() - self._origin:.1f} s en total)")
+        table.add_column("Paso o comando", style="cyan")
+        table.add_column("Tipo")
+        table.add_column("Segundos", justify="right")
+        table.add_column("Salida", justify="right")
+        for span in spans:
+            output = f"{span['output_bytes'] / 1024:.1f} KB" if "output_bytes" in span else ""
+            kind = {"command": "comando", "package": "paquete"}.get(span["kind"], "paso")
+            table.add_row(span["name"], kind, f"{span['seconds']:.2f}", output)
+        console.print(table)
+
+timeline = Timeline()
+
+def timed(name: str):
+    """Decorador: registra cada llamada a la función como un paso de la línea de tiempo."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timeline.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def capture(command: str) -> subprocess.CompletedProcess:
+    """subprocess.run con la salida capturada, registrado en la línea de tiempo."""
+    with timeline.span(command, kind="command") as span:
+        result = subprocess.run(command, shell=True, capture_output=True, text=True)
+        span["exit_code"] = result.returncode
+        span["output_bytes"] = len(result.stdout.encode()) + len(result.stderr.encode())
+        return result
+
+_log_numbers = itertools.count(1)
+
+def log_path_for(description: str) -> str:
+    """Archivo de log para un comando: número de orden y la descripción sin acentos."""
+    slug = unicodedata.normalize("NFKD", description).encode("ascii", "ignore").decode().lower()
+    slug = re.sub(r"[^a-z0-9]+", "-", slug).strip("-")[:60]
+    os.makedirs(LOG_DIR, exist_ok=True)
+    return os.path.join(LOG_DIR, f"{next(_log_numbers):03d}-{slug}.log")
+
+class BrewPhases:
+    """Sigue las fases de brew ("==> Downloading", "==> Pouring"...) en su salida.
+
+    Durante una descarga sigue además su porcentaje (percent), y el
+    paquete que se está instalando (package), vacío entre paquetes, para
+    medir cuánto tarda cada uno dentro de un lote.
+    """
+
+    def __init__(self) -> None:
+        self.phase = ""
+        self.position = 0
+        self.percent = None
+        self.package = ""
+
+    def feed(self, line: str) -> bool:
+        """Procesa una línea; devuelve True si cambió la fase o el porcentaje."""
+        if line.startswith("🍺"):
+            self.package = ""
+            return False
+        if not line.startswith("==> "):
+            return self._feed_percent(line)
+        started = BREW_PACKAGE_START.match(line)
+        if started:
+            self.package = started.group(1) or started.group(2)
+        for prefixes, phase, position in BREW_PHASES:
+            if line[4:].startswith(prefixes):
+                changed = phase != self.phase or self.percent is not None
+                self.phase = phase
+                self.percent = None
+                # La barra nunca retrocede a una fase anterior
+                self.position = max(self.position, position)
+                return changed
+        return False
+
+    def _feed_percent(self, line: str) -> bool:
+        percent = CURL_PERCENT.fullmatch(line) if self.phase == "descargando" else None
+        if not percent:
+            return False
+        self.percent = min(float(percent.group(1)), 100.0)
+        start, end = DOWNLOAD_RANGE
+        if self.position <= end:
+            # Cada archivo recorre el tramo de la descarga desde el principio
+            self.position = start + (end - start) * self.percent / 100
+        return True
+
+    def label(self) -> str:
+        """Fase actual, con el porcentaje si es una descarga ("descargando 42%")."""
+        return self.phase if self.percent is None else f"{self.phase} {self.percent:.0f}%"
+
+def new_progress() -> Progress:
+    """Barra compartida por todos los comandos que corren a la vez."""
+    return Progress(
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        TaskProgressColumn(),
+        TimeElapsedColumn(),
+        console=console,
+    )
+
+def read_pty(fd: int) -> bytes:
+    """Lee lo que haya en una pseudoterminal; b"" cuando el comando la cierra."""
+    try:
+        return os.read(fd, 65536)
+    except OSError as e:
+        # Linux da EIO al leer cuando ya nadie tiene abierto el otro extremo
+        if e.errno == errno.EIO:
+            return b""
+        raise
+
+def stream_command(command: str, description: str, progress: Progress) -> bool:
+    """Ejecuta un comando leyendo su salida a medida que llega.
+
+    El comando escribe en una pseudoterminal, no en una tubería: brew (y el
+    curl con el que descarga) solo dibujan la barra de descarga en una
+    terminal. La salida completa va a un log en disco (en memoria solo
+    quedan las últimas líneas, para el mensaje de error). Si es brew, la
+    barra avanza con sus fases (descarga, verificación, instalación) y,
+    dentro de cada descarga, con su porcentaje; si no, queda indeterminada
+    hasta que el comando termina. Cada paquete que brew instala queda
+    además como un intervalo propio dentro del del comando.
+    """
+    task = progress.add_task(f"[cyan]{description}...", total=None)
+    log_path = log_path_for(description)
+    phases = BrewPhases()
+    tail = deque(maxlen=ERROR_TAIL_LINES)
+    pending = b""
+    output_bytes = 0
+    master, slave = pty.openpty()
+    try:
+        with timeline.span(description, kind="command", command=command, log=log_path) as span, \
+                open(log_path, "wb") as log, \
+                subprocess.Popen(command, shell=True, stdout=slave, stderr=slave) as process, \
+                ExitStack() as package_span:
+            # Solo el comando debe tener abierto su extremo: así la lectura
+            # termina cuando él (y sus hijos) lo cierran
+            os.close(slave)
+            slave = None
+            log.write(f"$ {command}\n".encode())
+            for chunk in iter(lambda: read_pty(master), b""):
+                log.write(chunk)
+                output_bytes += len(chunk)
+                # Las barras que se redibujan con \r (curl, git) cuentan como líneas
+                *lines, pending = re.split(rb"[\r\n]", pending + chunk)
+                pending = pending[-4096:]
+                changed = False
+                for raw in lines:
+                    line = ANSI_ESCAPE.sub("", raw.decode("utf-8", "replace")).strip()
+                    if line:
+                        tail.append(line)
+                        package = phases.package
+                        changed = phases.feed(line) or changed
+                        if phases.package != package:
+                            package_span.close()
+                            if phases.package:
+                                package_span.enter_context(
+                                    timeline.span(phases.package, kind="package", command=description)
+                                )
+                if changed:
+                    label = f"[cyan]{description} · {phases.label()}..." if phases.phase else f"[cyan]{description}..."
+                    progress.update(task, description=label, total=100, completed=phases.position)
+            returncode = process.wait()
+            span["exit_code"] = returncode
+            span["output_bytes"] = output_bytes
+    finally:
+        os.close(master)
+        if slave is not None:
+            os.close(slave)
+    progress.update(task, description=f"[cyan]{description}", total=100, completed=100)
+    if returncode != 0:
+        details = "\n".join(tail)
+        progress.console.print(f"[red]{description}: falló (código {returncode}). Log: {log_path}[/red]")
+        if details:
+            progress.console.print(details, style="dim", markup=False, highlight=False)
+    return returncode == 0
+
 def run_command(command: str, description: str) -> bool:
-    """Ejecuta un comando y muestra una barra de progreso."""
-    with Progress() as progress:
-        task = progress.add_task(f"[cyan]{description}...", total=100)
-        process = subprocess.run(command, shell=True, capture_output=True, text=True)
-        progress.update(task, advance=100)
-        return process.returncode == 0
+    """Ejecuta un comando y muestra su progreso mientras corre (ver stream_command)."""
+    with new_progress() as progress:
+        return stream_command(command, description, progress)
+
+def run_parallel(commands: List[Tuple[str, str]], jobs: int) -> List[bool]:
+    """Ejecuta varios comandos a la vez (como máximo jobs), todos en la misma vista en vivo."""
+    with new_progress() as progress:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            return list(pool.map(lambda item: stream_command(*item, progress), commands))
 
+@timed("Homebrew")
 def check_brew() -> bool:
     """Verifica e instala Homebrew si no está presente."""
     console.print(Panel("Verificando Homebrew...", style="yellow"))
-    if subprocess.run("which brew", shell=True, capture_output=True).returncode != 0:
+    if capture("which brew").returncode != 0:
         console.print("[yellow]Homebrew no encontrado. Instalando...[/yellow]")
         return run_command(
             '/bin/bash -c "$(curl -fsSL https://raw.githubusercontent.com/Homebrew/install/HEAD/install.sh)"',
@@ -131,16 +479,34 @@ def check_brew() -> bool:
     console.print("[green]Homebrew encontrado.[/green]")
     return True
 
+@timed("Git")
 def check_git() -> bool:
     """Verifica e instala Git si no está presente."""
     console.print(Panel("Verificando Git...", style="yellow"))
-    if subprocess.run("which git", shell=True, capture_output=True).returncode != 0:
+    if capture("which git").returncode != 0:
         console.print("[yellow]Git no encontrado. Instalando...[/yellow]")
         return run_command("brew install git", "Instalando Git")
     console.print("[green]Git encontrado.[/green]")
     return True
 
-def install_oh_my_zsh() -> None:
+def sync_repo_command(url: str, dest: str) -> str:
+    """Comando que clona url en dest o, si ya está clonado, lo pone al día.
+
+    Los clones son superficiales y de una sola rama; al repetir la
+    instalación basta un fetch superficial del último commit, y el reset
+    solo ocurre si ese commit cambió.
+    """
+    if not os.path.isdir(os.path.join(dest, ".git")):
+        return f"git clone --quiet --depth=1 --single-branch {shlex.quote(url)} {shlex.quote(dest)}"
+    git = f"git -C {shlex.quote(dest)}"
+    return (
+        f"{git} fetch --quiet --depth=1 origin HEAD && "
+        f'{{ [ "$({git} rev-parse HEAD)" = "$({git} rev-parse FETCH_HEAD)" ] || '
+        f"{git} reset --quiet --hard FETCH_HEAD; }}"
+    )
+
+@timed("Oh My Zsh")
+def install_oh_my_zsh(jobs: int = DEFAULT_JOBS) -> None:
     """Instala Oh My Zsh y Powerlevel10k con plugins."""
     console.print(Panel("Configurando ZSH y Oh My Zsh...", style="yellow"))
     if os.path.exists(os.path.expanduser("~/.oh-my-zsh")):
@@ -154,76 +520,98 @@ def install_oh_my_zsh() -> None:
             console.print("[red]Error instalando Oh My Zsh.[/red]")
             sys.exit(1)
 
-    # Instalar Powerlevel10k
-    console.print("[yellow]Instalando Powerlevel10k...[/yellow]")
-    run_command(
-        "git clone --depth=1 https://github.com/romkatv/powerlevel10k.git $HOME/.oh-my-zsh/custom/themes/powerlevel10k",
-        "Instalando Powerlevel10k"
-    )
-    run_command(
-        "sed -i '' 's#robbyrussell#powerlevel10k/powerlevel10k#g' ~/.zshrc",
-        "Configurando Powerlevel10k"
-    )
+    # Clonar (o actualizar) Powerlevel10k y los plugins, todos a la vez
+    console.print("[yellow]Instalando Powerlevel10k y plugins de ZSH...[/yellow]")
+    custom = os.environ.get("ZSH_CUSTOM", os.path.expanduser("~/.oh-my-zsh/custom"))
+    names, commands = [], []
+    for name, repo, folder in ZSH_REPOS:
+        dest = os.path.join(custom, folder, name)
+        if os.path.exists(dest) and not os.path.isdir(os.path.join(dest, ".git")):
+            console.print(f"[yellow]{dest} existe y no es un repo de git; se deja como está.[/yellow]")
+            continue
+        names.append(name)
+        commands.append((sync_repo_command(f"{GIT_BASE}/{repo}.git", dest), f"Instalando {name}"))
+    for name, synced in zip(names, run_parallel(commands, jobs)):
+        if not synced:
+            console.print(f"[red]Error instalando {name}.[/red]")
 
-    # Instalar plugins
-    console.print("[yellow]Instalando plugins de ZSH...[/yellow]")
-    plugins = [
-        ("zsh-autosuggestions", "https://github.com/zsh-users/zsh-autosuggestions"),
-        ("zsh-history-substring-search", "https://github.com/zsh-users/zsh-history-substring-search"),
-        ("zsh-syntax-highlighting", "https://github.com/zsh-users/zsh-syntax-highlighting"),
-    ]
-    for plugin, url in plugins:
-        run_command(
-            f"git clone {url} $HOME/.oh-my-zsh/custom/plugins/{plugin}",
-            f"Instalando {plugin}"
-        )
-    run_command(
-        "sed -i '' 's/plugins=(git)/plugins=(git jump zsh-autosuggestions zsh-history-substring-search jsontools zsh-syntax-highlighting zsh-interactive-cd)/g' ~/.zshrc",
-        "Configurando plugins"
-    )
+    # Tema y plugins en ~/.zshrc (en memoria; se escribe al terminar)
+    zshrc().set_oh_my_zsh(ZSH_THEME, ZSH_PLUGINS)
 
-def configure_git_global() -> None:
-    """Configura el nombre y correo electrónico global de Git."""
+@timed("Credenciales de Git")
+def configure_git_global(profile: Dict = None) -> None:
+    """Configura el nombre y correo electrónico global de Git.
+
+    Con un perfil se usan sus valores de [git] sin preguntar nada.
+    """
     console.print(Panel("Configurando credenciales globales de Git...", style="yellow"))
+    git_profile = profile.get("git") if profile is not None else None
+    if profile is not None and not git_profile:
+        console.print("[yellow]El perfil no incluye credenciales de Git. Saltando configuración de Git.[/yellow]")
+        return
 
     # Verificar si ya están configuradas
-    current_user = subprocess.run("git config --global user.name", shell=True, capture_output=True, text=True).stdout.strip()
-    current_email = subprocess.run("git config --global user.email", shell=True, capture_output=True, text=True).stdout.strip()
+    current_user, current_email = git_identity()
 
-    if current_user and current_email:
-        console.print(f"[green]Credenciales de Git ya configuradas: {current_user} <{current_email}>[/green]")
-        if not Confirm.ask("¿Quieres sobrescribir las credenciales existentes?", default=False):
+    if git_profile:
+        user_name = git_profile.get("name", "")
+        user_email = git_profile.get("email", "")
+        if (current_user, current_email) == (user_name, user_email):
+            console.print(f"[green]Credenciales de Git ya configuradas: {current_user} <{current_email}>[/green]")
             return
+    else:
+        if current_user and current_email:
+            console.print(f"[green]Credenciales de Git ya configuradas: {current_user} <{current_email}>[/green]")
+            if not Confirm.ask("¿Quieres sobrescribir las credenciales existentes?", default=False):
+                return
 
-    # Solicitar nuevas credenciales
-    try:
-        user_name = Prompt.ask("Ingresa tu nombre para Git (e.g., Juan Pérez)", default="")
-        user_email = Prompt.ask("Ingresa tu correo electrónico para Git (e.g., juan@example.com)", default="")
-    except EOFError:
-        console.print("[yellow]Entrada interrumpida. Saltando configuración de Git.[/yellow]")
-        return
+        # Solicitar nuevas credenciales
+        try:
+            user_name = Prompt.ask("Ingresa tu nombre para Git (e.g., Juan Pérez)", default="")
+            user_email = Prompt.ask("Ingresa tu correo electrónico para Git (e.g., juan@example.com)", default="")
+        except EOFError:
+            console.print("[yellow]Entrada interrumpida. Saltando configuración de Git.[/yellow]")
+            return
 
     if user_name and user_email:
-        run_command(f'git config --global user.name "{user_name}"', "Configurando nombre de Git")
-        run_command(f'git config --global user.email "{user_email}"', "Configurando correo de Git")
+        run_command(f"git config --global user.name {shlex.quote(user_name)}", "Configurando nombre de Git")
+        run_command(f"git config --global user.email {shlex.quote(user_email)}", "Configurando correo de Git")
         console.print(f"[green]Credenciales de Git configuradas: {user_name} <{user_email}>[/green]")
     else:
         console.print("[yellow]No se proporcionaron credenciales válidas. Saltando configuración de Git.[/yellow]")
 
-def configure_ssh_key() -> None:
-    """Genera una clave SSH segura y la configura para GitHub usando GitHub CLI."""
+@timed("Clave SSH")
+def configure_ssh_key(profile: Dict = None) -> None:
+    """Genera una clave SSH segura y la configura para GitHub usando GitHub CLI.
+
+    Con un perfil se usan sus valores de [ssh] (email, github, regenerate)
+    sin preguntar nada; si gh no está autenticado solo se muestran las
+    instrucciones para añadir la clave a mano.
+    """
     console.print(Panel("Configurando clave SSH para GitHub...", style="yellow"))
+    ssh_profile = profile.get("ssh") if profile is not None else None
+    if profile is not None and not ssh_profile:
+        console.print("[yellow]El perfil no incluye clave SSH. Saltando configuración de clave SSH.[/yellow]")
+        return
+    interactive = ssh_profile is None
+    upload = interactive or ssh_profile.get("github", True)
 
     ssh_key_path = os.path.expanduser("~/.ssh/id_ed25519")
+    regenerate = False
     if os.path.exists(ssh_key_path):
         console.print("[green]Clave SSH ya existe en ~/.ssh/id_ed25519.[/green]")
-        if not Confirm.ask("¿Quieres generar una nueva clave SSH (sobrescribirá la existente)?", default=False):
+        if interactive:
+            regenerate = Confirm.ask("¿Quieres generar una nueva clave SSH (sobrescribirá la existente)?", default=False)
+        else:
+            regenerate = ssh_profile.get("regenerate", False)
+        if not regenerate:
             console.print("[yellow]Usando clave SSH existente.[/yellow]")
-            add_ssh_key_to_github(ssh_key_path)
+            if upload:
+                add_ssh_key_to_github(ssh_key_path, interactive=interactive)
             return
 
     # Verificar si GitHub CLI está instalado
-    if subprocess.run("which gh", shell=True, capture_output=True).returncode != 0:
+    if upload and capture("which gh").returncode != 0:
         console.print("[yellow]GitHub CLI no encontrado. Instalando...[/yellow]")
         if not run_command("brew install gh", "Instalando GitHub CLI"):
             console.print("[red]Error instalando GitHub CLI. Configura la clave manualmente en GitHub.[/red]")
@@ -231,28 +619,46 @@ def configure_ssh_key() -> None:
             return
 
     # Solicitar correo para la clave SSH
-    try:
-        email = Prompt.ask("Ingresa tu correo electrónico para la clave SSH (e.g., juan@example.com)", default="")
-    except EOFError:
-        console.print("[yellow]Entrada interrumpida. Saltando generación de clave SSH.[/yellow]")
-        return
+    if interactive:
+        try:
+            email = Prompt.ask("Ingresa tu correo electrónico para la clave SSH (e.g., juan@example.com)", default="")
+        except EOFError:
+            console.print("[yellow]Entrada interrumpida. Saltando generación de clave SSH.[/yellow]")
+            return
+    else:
+        email = ssh_profile.get("email") or (profile.get("git") or {}).get("email", "")
 
     if not email:
         console.print("[yellow]No se proporcionó un correo válido. Saltando generación de clave SSH.[/yellow]")
         return
 
+    # ssh-keygen preguntaría si sobrescribir: la clave vieja se aparta a .bak
+    # justo antes, se recupera si la nueva no llega a generarse y se borra
+    # si se genera (no se deja una clave privada huérfana en ~/.ssh)
+    key_files = [path for path in (ssh_key_path, f"{ssh_key_path}.pub") if regenerate and os.path.exists(path)]
+    for path in key_files:
+        os.replace(path, f"{path}.bak")
+
     # Generar clave SSH
     console.print("[yellow]Generando clave SSH (ed25519)...[/yellow]")
     if not run_command(
-        f'ssh-keygen -t ed25519 -C "{email}" -f {ssh_key_path} -N ""',
+        f'ssh-keygen -t ed25519 -C {shlex.quote(email)} -f {shlex.quote(ssh_key_path)} -N ""',
         "Generando clave SSH"
     ):
         console.print("[red]Error generando clave SSH.[/red]")
+        for path in key_files:
+            os.replace(f"{path}.bak", path)
+        if key_files:
+            console.print("[yellow]Se restauró la clave SSH anterior.[/yellow]")
         return
+    for path in key_files:
+        os.remove(f"{path}.bak")
+    if key_files:
+        console.print("[dim]Clave anterior sustituida por la nueva.[/dim]")
 
     # Iniciar ssh-agent
     run_command("eval $(ssh-agent -s)", "Iniciando ssh-agent")
-    run_command(f"ssh-add {ssh_key_path}", "Añadiendo clave SSH al agente")
+    run_command(f"ssh-add {shlex.quote(ssh_key_path)}", "Añadiendo clave SSH al agente")
 
     # Configurar ~/.ssh/config
     ssh_config_path = os.path.expanduser("~/.ssh/config")
@@ -271,9 +677,10 @@ Host github.com
     run_command(f"chmod 600 {ssh_config_path}", "Configurando permisos de ~/.ssh/config")
 
     # Añadir clave a GitHub usando GitHub CLI
-    add_ssh_key_to_github(ssh_key_path)
+    if upload:
+        add_ssh_key_to_github(ssh_key_path, interactive=interactive)
 
-def add_ssh_key_to_github(ssh_key_path: str) -> None:
+def add_ssh_key_to_github(ssh_key_path: str, interactive: bool = True) -> None:
     """Añade la clave pública SSH a GitHub usando GitHub CLI."""
     public_key_path = f"{ssh_key_path}.pub"
     if not os.path.exists(public_key_path):
@@ -282,7 +689,12 @@ def add_ssh_key_to_github(ssh_key_path: str) -> None:
 
     # Verificar autenticación en GitHub CLI
     console.print("[yellow]Verificando autenticación en GitHub CLI...[/yellow]")
-    if subprocess.run("gh auth status", shell=True, capture_output=True).returncode != 0:
+    if capture("gh auth status").returncode != 0:
+        if not interactive:
+            # `gh auth login` necesita a alguien delante; sin terminal basta GH_TOKEN
+            console.print("[yellow]GitHub CLI no está autenticado (define GH_TOKEN para hacerlo sin preguntar).[/yellow]")
+            show_ssh_key_instructions(ssh_key_path)
+            return
         console.print("[yellow]Autenticando en GitHub CLI...[/yellow]")
         if not run_command("gh auth login", "Autenticando en GitHub CLI"):
             console.print("[red]Error autenticando en GitHub CLI. Configura la clave manualmente en GitHub.[/red]")
@@ -293,7 +705,7 @@ def add_ssh_key_to_github(ssh_key_path: str) -> None:
     console.print("[yellow]Añadiendo clave SSH a GitHub...[/yellow]")
     title = f"MacBook_{time.strftime('%Y%m%d')}"
     if run_command(
-        f'gh ssh-key add {public_key_path} --title "{title}" --type authentication',
+        f'gh ssh-key add {shlex.quote(public_key_path)} --title "{title}" --type authentication',
         "Añadiendo clave SSH a GitHub"
     ):
         console.print("[green]Clave SSH añadida a GitHub correctamente.[/green]")
@@ -301,9 +713,10 @@ def add_ssh_key_to_github(ssh_key_path: str) -> None:
         console.print("[red]Error añadiendo clave SSH a GitHub. Configura la clave manualmente.[/red]")
         show_ssh_key_instructions(ssh_key_path)
 
-    # Probar conexión con GitHub
+    # Probar conexión con GitHub: sin preguntas (BatchMode) y aceptando la
+    # huella de github.com solo si aún no se conoce
     console.print("[yellow]Probando conexión SSH con GitHub...[/yellow]")
-    result = subprocess.run("ssh -T git@github.com", shell=True, capture_output=True, text=True)
+    result = capture("ssh -o BatchMode=yes -o StrictHostKeyChecking=accept-new -T git@github.com")
     if "successfully authenticated" in result.stderr:
         console.print("[green]Conexión SSH con GitHub verificada correctamente.[/green]")
     else:
@@ -328,6 +741,103 @@ def show_ssh_key_instructions(ssh_key_path: str) -> None:
     else:
         console.print("[red]No se encontró la clave pública SSH.[/red]")
 
+class ZshrcEditor:
+    """Edita ~/.zshrc en memoria con bloques gestionados y lo escribe una sola vez.
+
+    Cada bloque va entre "# >>> setup_macos.py (nombre) >>>" y su marcador
+    de cierre y se reemplaza entero al volver a aplicarlo, así que repetir
+    la instalación no acumula líneas. save() escribe solo si algo cambió,
+    a través de un temporal que se renombra encima del archivo real (si
+    ~/.zshrc es un enlace de un repo de dotfiles, el enlace se conserva).
+    """
+
+    def __init__(self, path: str = None) -> None:
+        self.path = os.path.realpath(path or os.path.expanduser("~/.zshrc"))
+        try:
+            with open(self.path) as f:
+                self.original = f.read()
+        except FileNotFoundError:
+            self.original = ""
+        self.text = self.original
+
+    def _block_pattern(self, name: str) -> re.Pattern:
+        start = re.escape(ZSHRC_BLOCK_START.format(name=name))
+        end = re.escape(ZSHRC_BLOCK_END.format(name=name))
+        return re.compile(rf"^{start}\n(.*?)^{end}\n?", re.MULTILINE | re.DOTALL)
+
+    def block(self, name: str) -> List[str]:
+        """Líneas del bloque name, o [] si no existe."""
+        match = self._block_pattern(name).search(self.text)
+        return match.group(1).splitlines() if match else []
+
+    def set_block(self, name: str, lines: List[str], before: re.Pattern = None) -> None:
+        """Reemplaza el bloque name (o lo crea antes de la línea before, o al final)."""
+        block = "\n".join([ZSHRC_BLOCK_START.format(name=name), *lines, ZSHRC_BLOCK_END.format(name=name)]) + "\n"
+        pattern = self._block_pattern(name)
+        if pattern.search(self.text):
+            self.text = pattern.sub(lambda _: block, self.text, count=1)
+            return
+        anchor = before.search(self.text) if before else None
+        if anchor:
+            self.text = self.text[:anchor.start()] + block + self.text[anchor.start():]
+        else:
+            if self.text and not self.text.endswith("\n"):
+                self.text += "\n"
+            self.text += ("\n" if self.text else "") + block
+
+    def has_path(self, path: str) -> bool:
+        return f'export PATH="{path}:$PATH"' in self.text
+
+    def add_path(self, path: str) -> None:
+        """Añade la ruta al bloque de PATH (una sola vez)."""
+        lines = self.block("PATH")
+        export_line = f'export PATH="{path}:$PATH"'
+        if export_line not in lines:
+            self.set_block("PATH", lines + [export_line])
+
+    def set_oh_my_zsh(self, theme: str, plugins: List[str]) -> None:
+        """Tema y plugins justo antes de cargar Oh My Zsh, para que tengan efecto."""
+        lines = [f'ZSH_THEME="{theme}"', f"plugins=({' '.join(plugins)})"]
+        if OH_MY_ZSH_SOURCE.search(self._block_pattern("Oh My Zsh").sub("", self.text)):
+            self.set_block("Oh My Zsh", lines, before=OH_MY_ZSH_SOURCE)
+        else:
+            # Sin la plantilla de Oh My Zsh: el bloque también lo carga
+            self.set_block("Oh My Zsh", ['export ZSH="$HOME/.oh-my-zsh"', *lines, 'source "$ZSH/oh-my-zsh.sh"'])
+
+    def save(self) -> bool:
+        """Escribe los cambios de una vez; devuelve True si había algo que escribir."""
+        if self.text == self.original:
+            return False
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.text)
+        if os.path.exists(self.path):
+            shutil.copymode(self.path, tmp_path)
+        os.replace(tmp_path, self.path)
+        self.original = self.text
+        return True
+
+_zshrc = None
+
+def zshrc() -> ZshrcEditor:
+    """Editor compartido de ~/.zshrc; se carga la primera vez que se usa.
+
+    Así se lee después de que el instalador de Oh My Zsh haya creado el
+    archivo, y todos los pasos acumulan sus cambios en la misma copia.
+    """
+    global _zshrc
+    if _zshrc is None:
+        _zshrc = ZshrcEditor()
+    return _zshrc
+
+def save_zshrc() -> None:
+    """Escribe ~/.zshrc si algún paso lo cambió."""
+    if _zshrc is None:
+        return
+    with timeline.span("Guardar ~/.zshrc"):
+        if _zshrc.save():
+            console.print(f"[green]{_zshrc.path} actualizado.[/green]")
+
 def add_to_path(app: Dict) -> None:
     """Añade la ruta de un lenguaje al PATH si no está presente."""
     if "path" not in app or "executable" not in app:
@@ -337,33 +847,152 @@ def add_to_path(app: Dict) -> None:
     path_to_add = app["path"]
 
     # Verificar si el ejecutable ya está en el PATH
-    if subprocess.run(f"which {executable}", shell=True, capture_output=True).returncode == 0:
+    if shutil.which(executable):
         console.print(f"[green]{executable} ya está en el PATH.[/green]")
         return
 
-    # Añadir al PATH en ~/.zshrc
-    zshrc_path = os.path.expanduser("~/.zshrc")
-    export_line = f'export PATH="{path_to_add}:$PATH"'
-    
-    with open(zshrc_path, "r") as f:
-        if export_line in f.read():
-            console.print(f"[green]Ruta {path_to_add} ya está en ~/.zshrc.[/green]")
+    # Añadir al bloque de PATH de ~/.zshrc
+    if zshrc().has_path(path_to_add):
+        console.print(f"[green]Ruta {path_to_add} ya está en ~/.zshrc.[/green]")
+        return
+    zshrc().add_path(path_to_add)
+    console.print(f"[green]Ruta para {executable} añadida al PATH.[/green]")
+
+def package_name(app: Dict) -> str:
+    """Nombre del paquete de Homebrew (última palabra del comando)."""
+    return app["command"].split()[-1]
+
+def tap_name(package: str) -> str:
+    """Tap de un paquete con nombre completo (usuario/tap/paquete), o "" si es oficial."""
+    parts = package.split("/")
+    return "/".join(parts[:2]) if len(parts) == 3 else ""
+
+class BrewInventory:
+    """Fórmulas y casks instalados, consultados a brew una sola vez por ejecución.
+
+    Cada llamada a brew tarda un segundo o más en arrancar, así que en vez
+    de un `brew list` por aplicación se carga todo con un único
+    `brew info --json=v2 --installed` y se actualiza en memoria a medida
+    que terminan las instalaciones.
+    """
+
+    def __init__(self) -> None:
+        self.formulae = set()
+        self.casks = set()
+        self.loaded = False
+
+    def load(self) -> None:
+        """(Re)carga el inventario desde brew."""
+        self.formulae.clear()
+        self.casks.clear()
+        result = capture("brew info --json=v2 --installed")
+        try:
+            data = json.loads(result.stdout) if result.returncode == 0 else None
+        except ValueError:
+            data = None
+        if data is not None:
+            # Incluye los alias (python -> python@3.x) para reconocer los nombres del menú
+            for formula in data.get("formulae", []):
+                self.formulae.add(formula["name"])
+                self.formulae.update(formula.get("aliases", []))
+                self.formulae.update(formula.get("oldnames", []))
+            for cask in data.get("casks", []):
+                self.casks.add(cask["token"])
+                self.casks.update(cask.get("old_tokens", []))
+        else:
+            # Versiones antiguas de brew sin --json=v2
+            for flag, names in (("--formula", self.formulae), ("--cask", self.casks)):
+                result = capture(f"brew list {flag} -1")
+                names.update(result.stdout.split())
+        self.loaded = True
+
+    def load_cached(self) -> None:
+        """Como load(), pero reutiliza la última instantánea si Homebrew no ha cambiado.
+
+        La clave son las fechas de modificación de Cellar y Caskroom, que
+        cambian cada vez que se instala o desinstala un paquete.
+        """
+        key = brew_snapshot_key()
+        try:
+            with open(SNAPSHOT_PATH) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            snapshot = {}
+        if key and snapshot.get("key") == key:
+            self.formulae = set(snapshot.get("formulae", []))
+            self.casks = set(snapshot.get("casks", []))
+            self.loaded = True
             return
+        self.load()
+        self.save_snapshot(key)
 
-    console.print(f"[yellow]Añadiendo {path_to_add} al PATH en ~/.zshrc...[/yellow]")
-    with open(zshrc_path, "a") as f:
-        f.write(f"\n# Añadido por setup_macos.py\n{export_line}\n")
-    console.print(f"[green]Ruta para {executable} añadida al PATH.[/green]")
+    def save_snapshot(self, key: List = None) -> None:
+        """Guarda el inventario en memoria con la clave actual de Homebrew."""
+        key = key or brew_snapshot_key()
+        if key and self.loaded:
+            write_json_atomic(SNAPSHOT_PATH, {
+                "key": key,
+                "formulae": sorted(self.formulae),
+                "casks": sorted(self.casks),
+            })
+
+    def has(self, app: Dict) -> bool:
+        if not self.loaded:
+            self.load()
+        # Las fórmulas de taps aparecen sin el prefijo usuario/tap/
+        name = package_name(app).split("/")[-1]
+        if app["cask"]:
+            return name in self.casks
+        # `brew install` sin --cask también instala casks (p. ej. raycast)
+        return name in self.formulae or name in self.casks
+
+    def add(self, app: Dict) -> None:
+        """Marca una aplicación como instalada sin volver a consultar a brew."""
+        name = package_name(app).split("/")[-1]
+        (self.casks if app["cask"] else self.formulae).add(name)
+
+inventory = BrewInventory()
+
+def find_brew() -> str:
+    """Ruta de brew, aunque todavía no esté en el PATH de esta terminal."""
+    return shutil.which("brew") or next(
+        (path for path in ("/opt/homebrew/bin/brew", "/usr/local/bin/brew") if os.path.exists(path)), ""
+    )
+
+def brew_snapshot_key() -> List:
+    """Prefijo de Homebrew y fechas de Cellar/Caskroom, o [] si no hay brew."""
+    brew = find_brew()
+    if not brew:
+        return []
+    prefix = os.path.dirname(os.path.dirname(brew))
+    key = [prefix]
+    for folder in ("Cellar", "Caskroom"):
+        try:
+            key.append(os.stat(os.path.join(prefix, folder)).st_mtime_ns)
+        except OSError:
+            key.append(0)
+    return key
+
+def write_json_atomic(path: str, data) -> None:
+    """Escribe JSON en un temporal y lo renombra, para no dejar nunca un archivo a medias."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
 
 def is_app_installed(app: Dict) -> bool:
     """Verifica si una aplicación ya está instalada con Homebrew."""
-    package_name = app["command"].split()[-1]  # Extrae el nombre del paquete (última palabra del comando)
-    cmd = "brew list --cask" if app["cask"] else "brew list"
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    return package_name in result.stdout.split()
+    return inventory.has(app)
+
+@timed("Selección de apps")
+def select_apps(profile: Dict = None) -> List[Dict]:
+    """Muestra un menú interactivo por categorías para seleccionar aplicaciones.
 
-def select_apps() -> List[Dict]:
-    """Muestra un menú interactivo por categorías para seleccionar aplicaciones."""
+    Con un perfil no pregunta: devuelve las aplicaciones de su lista "apps".
+    """
+    if profile is not None:
+        return profile_apps(profile)
     console.print(Panel("Selecciona las aplicaciones a instalar por categoría:", style="cyan"))
     selected_apps = []
 
@@ -402,11 +1031,21 @@ def select_apps() -> List[Dict]:
 
     return selected_apps
 
-def install_apps(selected_apps: List[Dict]) -> None:
-    """Instala las aplicaciones seleccionadas y muestra un resumen."""
+@timed("Instalación de apps")
+def install_apps(selected_apps: List[Dict], jobs: int = DEFAULT_JOBS) -> bool:
+    """Instala las aplicaciones seleccionadas y muestra un resumen.
+
+    Primero añade los taps necesarios (en serie), luego descarga todas las
+    fórmulas con un solo `brew fetch` y, después, todos los casks con otro
+    (los Homebrew que admiten HOMEBREW_DOWNLOAD_CONCURRENCY descargan hasta
+    jobs archivos a la vez dentro de cada uno; los anteriores, de uno en
+    uno) y por último instala las fórmulas y los casks en un solo
+    `brew install` cada uno, que brew ordena según sus dependencias.
+    Devuelve False si alguna aplicación no se pudo instalar.
+    """
     if not selected_apps:
         console.print("[yellow]No se seleccionaron aplicaciones.[/yellow]")
-        return
+        return True
 
     # Mostrar tabla de aplicaciones seleccionadas
     table = Table(title="Aplicaciones a instalar")
@@ -415,25 +1054,73 @@ def install_apps(selected_apps: List[Dict]) -> None:
         table.add_row(app["name"])
     console.print(table)
 
-    # Instalar aplicaciones seleccionadas
+    # Separar las que ya están instaladas
+    pending = []
     for app in selected_apps:
         if is_app_installed(app):
             console.print(f"[green]{app['name']} ya está instalado.[/green]")
             if "path" in app:
                 add_to_path(app)
-            continue
-        console.print(f"[yellow]Instalando {app['name']}...[/yellow]")
-        if run_command(app["command"], f"Instalando {app['name']}"):
+        else:
+            pending.append(app)
+    if not pending:
+        return True
+
+    # Un solo `brew update` al principio; los comandos siguientes no lo repiten
+    run_command("brew update", "Actualizando Homebrew")
+
+    # Los taps modifican el repositorio local de brew: en serie y antes que nada
+    for tap in sorted({tap_name(package_name(app)) for app in pending} - {""}):
+        run_command(f"{BREW_ENV} brew tap {tap}", f"Añadiendo tap {tap}")
+
+    formulas = [app for app in pending if not app["cask"]]
+    casks = [app for app in pending if app["cask"]]
+    groups = [
+        (group, flag, kind, " ".join(package_name(app) for app in group))
+        for group, flag, kind in ((formulas, "", "fórmulas"), (casks, " --cask", "casks"))
+        if group
+    ]
+
+    # Un `brew fetch` por tipo, uno detrás de otro: a la vez serían hasta
+    # 2×jobs descargas. Si falla, brew vuelve a intentarlo al instalar
+    console.print(f"[yellow]Descargando {len(pending)} aplicaciones...[/yellow]")
+    for group, flag, kind, packages in groups:
+        if not run_command(
+            f"{BREW_ENV} HOMEBREW_DOWNLOAD_CONCURRENCY={jobs} brew fetch {'--cask' if flag else '--deps'} {packages}",
+            f"Descargando {kind}"
+        ):
+            console.print(f"[yellow]No se pudieron descargar por adelantado ({kind}); se intentará al instalar.[/yellow]")
+
+    # Instalaciones por lotes: una para fórmulas y otra para casks
+    failed = []
+    for group, flag, kind, packages in groups:
+        console.print(f"[yellow]Instalando {len(group)} {kind}: {', '.join(app['name'] for app in group)}[/yellow]")
+        if run_command(f"{BREW_ENV} brew install{flag} {packages}", f"Instalando {kind}"):
+            installed = group
+        else:
+            # El lote falló: reintentar una a una para saber cuál; parte del
+            # lote pudo instalarse, así que se recarga el inventario una vez
+            inventory.load()
+            installed = []
+            for app in group:
+                if is_app_installed(app) or run_command(f"{BREW_ENV} {app['command']}", f"Instalando {app['name']}"):
+                    installed.append(app)
+                else:
+                    console.print(f"[red]Error instalando {app['name']}.[/red]")
+                    failed.append(app)
+        for app in installed:
+            inventory.add(app)
+            console.print(f"[green]{app['name']} instalado.[/green]")
             # Añadir al PATH si es un lenguaje
             if "path" in app:
                 add_to_path(app)
-        else:
-            console.print(f"[red]Error instalando {app['name']}.[/red]")
+    return not failed
 
-def hide_dock() -> None:
-    """Oculta el Dock de macOS si el usuario lo desea."""
+@timed("Dock")
+def hide_dock(profile: Dict = None) -> None:
+    """Oculta el Dock de macOS si el usuario (o el perfil, con hide_dock) lo desea."""
     try:
-        if Confirm.ask("¿Ocultar el Dock de macOS?", default=True):
+        if profile.get("hide_dock", False) if profile is not None else Confirm.ask("¿Ocultar el Dock de macOS?", default=True):
             console.print("[yellow]Ocultando el Dock...[/yellow]")
             run_command(
                 "defaults write com.apple.dock autohide -bool true; killall Dock",
@@ -461,7 +1148,235 @@ def restart_terminal() -> None:
     except EOFError:
         console.print("[yellow]Entrada interrumpida. No se reinició la terminal. Por favor, reinicia manualmente.[/yellow]")
 
-def main() -> None:
+def apps_by_name() -> Dict[str, Dict]:
+    """Todas las aplicaciones de APPS_BY_CATEGORY indexadas por nombre."""
+    return {app["name"]: app for apps in APPS_BY_CATEGORY.values() for app in apps}
+
+def read_profile(path: str) -> Dict:
+    """Lee un perfil JSON o TOML (por la extensión) y comprueba su forma.
+
+    Lanza OSError o ValueError si no se puede leer o no es válido.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            # Python < 3.11 (el python3 de macOS): tomli es el mismo parser
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError("los perfiles TOML necesitan Python 3.11+ o `pip install tomli`; usa JSON si no")
+        profile = tomllib.loads(data.decode("utf-8"))
+    else:
+        profile = json.loads(data)
+
+    if not isinstance(profile, dict):
+        raise ValueError("el perfil debe ser un objeto con claves apps, git, ssh...")
+    apps = profile.get("apps", [])
+    if not isinstance(apps, list) or not all(isinstance(name, str) for name in apps):
+        raise ValueError("'apps' debe ser una lista de nombres")
+    for section in ("git", "ssh"):
+        if not isinstance(profile.get(section, {}), dict):
+            raise ValueError(f"'{section}' debe ser una sección con claves")
+    return profile
+
+def load_profile(path: str = PROFILE_PATH) -> Dict:
+    """Lee el perfil guardado de --apply, o {} si no existe."""
+    try:
+        return read_profile(path)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        console.print(f"[yellow]No se pudo leer el perfil {path}: {e}[/yellow]")
+        return {}
+
+def profile_apps(profile: Dict) -> List[Dict]:
+    """Aplicaciones del perfil, en el orden de APPS_BY_CATEGORY."""
+    known = apps_by_name()
+    for name in profile.get("apps", []):
+        if name not in known:
+            console.print(f"[yellow]Aplicación desconocida en el perfil: {name}[/yellow]")
+    wanted = set(profile.get("apps", []))
+    return [app for name, app in known.items() if name in wanted]
+
+def git_identity() -> Tuple[str, str]:
+    """Nombre y correo globales de Git en una sola llamada."""
+    result = capture("git config --global --get-regexp '^user\\.(name|email)$'") if shutil.which("git") else None
+    values = {}
+    for line in (result.stdout.splitlines() if result else []):
+        key, _, value = line.partition(" ")
+        values[key] = value.strip()
+    return values.get("user.name", ""), values.get("user.email", "")
+
+def dock_hidden() -> bool:
+    """El Dock ya se oculta solo (autohide activado)."""
+    if not shutil.which("defaults"):
+        return False
+    return capture("defaults read com.apple.dock autohide").stdout.strip() == "1"
+
+@timed("Sondeo del estado")
+def probe_state(apps: List[Dict]) -> Dict:
+    """Recoge el estado de la máquina de una pasada.
+
+    Solo Git, el Dock y el inventario de Homebrew necesitan subprocesos, y
+    corren a la vez; el resto son comprobaciones de archivos.
+    """
+    brew = find_brew()
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        identity = pool.submit(git_identity)
+        dock = pool.submit(dock_hidden)
+        loading = pool.submit(inventory.load_cached) if brew and apps else None
+        zshrc_path = os.path.expanduser("~/.zshrc")
+        zshrc_text = ""
+        if os.path.exists(zshrc_path):
+            with open(zshrc_path) as f:
+                zshrc_text = f.read()
+        custom = os.environ.get("ZSH_CUSTOM", os.path.expanduser("~/.oh-my-zsh/custom"))
+        if loading:
+            loading.result()
+        return {
+            "brew": brew,
+            "git": shutil.which("git") or "",
+            "git_identity": identity.result(),
+            "oh_my_zsh": os.path.isdir(os.path.expanduser("~/.oh-my-zsh")),
+            "zsh_repos": all(os.path.isdir(os.path.join(custom, folder, name, ".git")) for name, _, folder in ZSH_REPOS),
+            "zshrc": zshrc_text,
+            "ssh_key": os.path.exists(os.path.expanduser("~/.ssh/id_ed25519")),
+            "dock_hidden": dock.result(),
+        }
+
+def app_ready(app: Dict, state: Dict) -> bool:
+    """La aplicación está instalada y, si es un lenguaje, su ruta ya está en el PATH."""
+    if not state["brew"] or not is_app_installed(app):
+        return False
+    if "path" not in app or "executable" not in app:
+        return True
+    return f'export PATH="{app["path"]}:$PATH"' in state["zshrc"] or bool(shutil.which(app["executable"]))
+
+def build_plan(state: Dict, apps: List[Dict], profile: Dict = None) -> List[Dict]:
+    """Compara el estado con el perfil: un paso por cosa a configurar, marcado si ya está hecho.
+
+    Con un perfil (--profile), Git y SSH sin sección en él no aplican, y el
+    paso del Dock solo aplica si pide hide_dock; sin perfil esos pasos
+    preguntan al aplicarse y el Dock no se toca.
+    """
+    zshrc_text = state["zshrc"]
+    git_profile = (profile or {}).get("git")
+    git_done = all(state["git_identity"]) and (
+        not git_profile or state["git_identity"] == (git_profile.get("name", ""), git_profile.get("email", ""))
+    )
+    if profile is not None and not git_profile:
+        git_step = {"name": "Credenciales de Git", "done": True, "skipped": True}
+    else:
+        git_step = {"name": "Credenciales de Git", "done": git_done}
+    if profile is not None and not profile.get("ssh"):
+        ssh_step = {"name": "Clave SSH", "done": True, "skipped": True}
+    else:
+        ssh_step = {"name": "Clave SSH", "done": state["ssh_key"]}
+    if profile is not None and profile.get("hide_dock", False):
+        dock_step = {"name": "Dock", "done": state["dock_hidden"]}
+    else:
+        dock_step = {"name": "Dock", "done": True, "skipped": True}
+    return [
+        {"name": "Homebrew", "done": bool(state["brew"])},
+        {"name": "Git", "done": bool(state["git"])},
+        {"name": "Oh My Zsh + Powerlevel10k", "done": (
+            state["oh_my_zsh"] and state["zsh_repos"]
+            and "powerlevel10k/powerlevel10k" in zshrc_text and "zsh-autosuggestions" in zshrc_text
+        )},
+        git_step,
+        ssh_step,
+        dock_step,
+    ] + [{"name": app["name"], "done": app_ready(app, state), "app": app} for app in apps]
+
+def show_plan(plan: List[Dict]) -> None:
+    """Muestra el plan como tabla."""
+    table = Table(title="Plan")
+    table.add_column("Paso", style="cyan")
+    table.add_column("Estado")
+    for step in plan:
+        if step.get("skipped"):
+            status = "[dim]no aplica[/dim]"
+        else:
+            status = "[green]hecho[/green]" if step["done"] else "[yellow]pendiente[/yellow]"
+        table.add_row(step["name"], status)
+    console.print(table)
+
+def apply_plan(plan: List[Dict], jobs: int, profile: Dict = None) -> None:
+    """Ejecuta solo los pasos pendientes del plan, en orden."""
+    pending = {step["name"] for step in plan if not step["done"]}
+    if ("Homebrew" in pending and not check_brew()) or ("Git" in pending and not check_git()):
+        console.print("[red]Error en la configuración inicial.[/red]")
+        sys.exit(1)
+    if "Oh My Zsh + Powerlevel10k" in pending:
+        install_oh_my_zsh(jobs=jobs)
+    if "Credenciales de Git" in pending:
+        configure_git_global(profile)
+    if "Clave SSH" in pending:
+        configure_ssh_key(profile)
+    if "Dock" in pending:
+        hide_dock(profile)
+    apps = [step["app"] for step in plan if "app" in step and not step["done"]]
+    if apps:
+        installed = install_apps(apps, jobs=jobs)
+        # Lo recién instalado ya está en el inventario en memoria: la próxima
+        # ejecución no necesita volver a preguntar a brew
+        inventory.save_snapshot()
+        if not installed:
+            console.print("[red]Algunas aplicaciones no se pudieron instalar.[/red]")
+            sys.exit(1)
+
+def run_plan(args: argparse.Namespace, profile: Dict = None) -> None:
+    """Modo --plan/--apply: sondea, compara con el perfil y aplica solo lo que falta.
+
+    Sin --profile se usa el perfil guardado; solo tiene apps, así que los
+    pasos de Git y SSH preguntan como en el modo normal.
+    """
+    headless = profile is not None
+    if not headless:
+        profile = load_profile()
+    if "apps" not in profile and args.apply and not headless:
+        # Primera vez: se eligen las apps una sola vez y se guardan en el perfil
+        profile["apps"] = [app["name"] for app in select_apps()]
+        write_json_atomic(PROFILE_PATH, profile)
+        console.print(f"[green]Perfil guardado en {PROFILE_PATH}.[/green]")
+    elif "apps" not in profile and not headless:
+        console.print(f"[yellow]Sin perfil en {PROFILE_PATH}: las apps se elegirán con --apply.[/yellow]")
+
+    started = time.monotonic()
+    apps = profile_apps(profile)
+    plan = build_plan(probe_state(apps), apps, profile if headless else None)
+    show_plan(plan)
+    console.print(f"[cyan]Estado sondeado en {time.monotonic() - started:.2f} s.[/cyan]")
+
+    if all(step["done"] for step in plan):
+        console.print("[green]Todo está configurado; no hay nada que hacer.[/green]")
+    elif args.apply:
+        apply_plan(plan, jobs=max(1, args.jobs), profile=profile if headless else None)
+        console.print(Panel("¡Plan aplicado! Reinicia la terminal para aplicar los cambios.", style="bold green"))
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Configura un Mac nuevo para desarrollo.")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS,
+                        help=f"descargas simultáneas dentro de cada brew fetch y clones de Oh My Zsh a la vez "
+                             f"(por defecto {DEFAULT_JOBS}); los Homebrew sin HOMEBREW_DOWNLOAD_CONCURRENCY "
+                             "descargan de uno en uno")
+    parser.add_argument("--timeline", default=LOG_DIR,
+                        help=f"carpeta donde guardar timeline.json y trace.json (por defecto {LOG_DIR})")
+    parser.add_argument("--profile", default=None,
+                        help="perfil TOML o JSON con apps, [git] y [ssh]: configura sin preguntar nada")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--plan", action="store_true",
+                      help="muestra qué falta por configurar, sin cambiar nada")
+    mode.add_argument("--apply", action="store_true",
+                      help=f"configura solo lo que falta según el perfil ({PROFILE_PATH})")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+
     # Verificar e instalar 'rich'
     if not ensure_rich_installed():
         console.print("[red]No se pudo instalar 'rich'. Saliendo...[/red]")
@@ -469,17 +1384,52 @@ def main() -> None:
 
     console.print(Panel("Script de Configuración para macOS", style="bold green", expand=False))
 
+    # ~/.zshrc y la línea de tiempo se guardan también si la instalación se corta a medias
+    try:
+        run_setup(args)
+    finally:
+        save_zshrc()
+        report_timeline(args.timeline)
+
+def report_timeline(directory: str) -> None:
+    """Muestra lo que más tardó y guarda la línea de tiempo de la ejecución."""
+    timeline.show_slowest()
+    try:
+        path = timeline.write(os.path.expanduser(directory))
+    except OSError as e:
+        console.print(f"[yellow]No se pudo guardar la línea de tiempo: {e}[/yellow]")
+        return
+    console.print(f"[cyan]Línea de tiempo en {path} (trace.json se abre en https://ui.perfetto.dev).[/cyan]")
+
+def run_setup(args: argparse.Namespace) -> None:
+    """Todos los pasos de la configuración, en orden."""
+    profile = None
+    if args.profile:
+        try:
+            profile = read_profile(os.path.expanduser(args.profile))
+        except (OSError, ValueError) as e:
+            console.print(f"[red]No se pudo leer el perfil {args.profile}: {e}[/red]")
+            sys.exit(1)
+        # El instalador de Homebrew no pide confirmación con NONINTERACTIVE
+        os.environ["NONINTERACTIVE"] = "1"
+
+    if args.plan or args.apply:
+        run_plan(args, profile)
+        return
+
     # Verificar Homebrew y Git
     if not check_brew() or not check_git():
         console.print("[red]Error en la configuración inicial.[/red]")
         sys.exit(1)
 
     # Configurar ZSH y Oh My Zsh
-    install_oh_my_zsh()
+    install_oh_my_zsh(jobs=max(1, args.jobs))
 
     # Configurar credenciales de Git
     try:
-        if Confirm.ask("¿Configurar credenciales globales de Git?", default=True):
+        if profile is not None:
+            configure_git_global(profile)
+        elif Confirm.ask("¿Configurar credenciales globales de Git?", default=True):
             configure_git_global()
         else:
             console.print("[yellow]Saltando configuración de credenciales de Git.[/yellow]")
@@ -488,7 +1438,9 @@ def main() -> None:
 
     # Configurar clave SSH para GitHub
     try:
-        if Confirm.ask("¿Configurar una clave SSH para GitHub?", default=True):
+        if profile is not None:
+            configure_ssh_key(profile)
+        elif Confirm.ask("¿Configurar una clave SSH para GitHub?", default=True):
             configure_ssh_key()
         else:
             console.print("[yellow]Saltando configuración de clave SSH.[/yellow]")
@@ -496,11 +1448,18 @@ def main() -> None:
         console.print("[yellow]Entrada interrumpida. Saltando configuración de clave SSH.[/yellow]")
 
     # Seleccionar e instalar aplicaciones
-    selected_apps = select_apps()
-    install_apps(selected_apps)
+    selected_apps = select_apps(profile)
+    apps_installed = install_apps(selected_apps, jobs=max(1, args.jobs))
 
     # Ocultar Dock
-    hide_dock()
+    hide_dock(profile)
+
+    # Escribir ~/.zshrc antes de ofrecer abrir una terminal nueva que lo lea
+    save_zshrc()
+
+    if not apps_installed:
+        console.print(Panel("Algunas aplicaciones no se pudieron instalar; revisa los logs.", style="bold red"))
+        sys.exit(1)
 
     # Resumen final
     console.print(Panel(
@@ -508,8 +1467,9 @@ def main() -> None:
         style="bold green"
     ))
 
-    # Preguntar si reiniciar la terminal
-    restart_terminal()
+    # Preguntar si reiniciar la terminal (sin perfil: nadie está delante para responder)
+    if profile is None:
+        restart_terminal()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,446 @@
+#!/usr/bin/env bash
+#
+# Test AISLADO de setup_macos.py (la versión en Python).
+#
+# Clones de Oh My Zsh: el tema y los plugins se clonan a la vez, superficiales
+# (--depth=1) y de una sola rama; al repetir la instalación se actualizan con
+# un fetch superficial en lugar de volver a clonar. Se usan repos bare locales
+# (SETUP_MACOS_GIT_BASE=file://...) para no depender de la red.
+#
+# Plan/apply: con un brew falso en el PATH, --plan muestra lo pendiente sin
+# tocar nada, --apply instala solo eso y una segunda ejecución no llama a brew.
+# Con --profile, Git y SSH sin sección no aplican y hide_dock añade el paso
+# del Dock.
+#
+# ~/.zshrc: tema, plugins y rutas van en bloques gestionados que se
+# reemplazan enteros, así que repetir la instalación no duplica líneas.
+#
+# Perfil (--profile): con un TOML de apps, [git] y [ssh] todo corre sin
+# preguntas, con la entrada cerrada, y deja la línea de tiempo (--timeline).
+#
+# Clave SSH: al regenerarla, la clave vieja solo se aparta justo antes de
+# ssh-keygen, vuelve a su sitio si no se llega a generar la nueva y se borra
+# si se genera; la prueba con GitHub no pregunta nada.
+#
+# Progreso: brew corre en una pseudoterminal y su salida (enlatada en un brew
+# falso) mueve la barra por fases y por el porcentaje de curl, queda entera en un log por comando y cada paquete de un lote tiene
+# su propio intervalo en la línea de tiempo.
+#
+# Descargas: un solo brew fetch para las fórmulas y otro para los casks, uno
+# detrás de otro; si la descarga falla se instala igual, y si falla la
+# instalación el exit es 1.
+#
+# Inventario: la instantánea de lo instalado se descarta cuando cambian
+# Cellar o Caskroom, y sin --json=v2 se recurre a brew list.
+#
+# Uso:  bash apps/tests/test_setup_macos_py.sh
+# Exit: 0 si todo pasa.
+
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+APPS_DIR="$SCRIPT_DIR/.."
+
+GREEN=$'\033[0;32m'; RED=$'\033[0;31m'; CYAN=$'\033[1;36m'; YELLOW=$'\033[1;33m'; NC=$'\033[0m'
+passed=0; failed=0
+ok() { if [ "$1" -eq 0 ]; then printf "%s✓ %s%s\n" "$GREEN" "$2" "$NC"; ((passed++)); else printf "%s✗ %s%s\n" "$RED" "$2" "$NC"; ((failed++)); fi; }
+
+if ! python3 -c "import rich" 2>/dev/null; then
+    printf "%sSe necesita el módulo 'rich' (pip install rich); test omitido.%s\n" "$YELLOW" "$NC"
+    exit 0
+fi
+
+WORK="$(mktemp -d /tmp/setuppy.XXXXXX)"
+export HOME="$WORK/home"
+trap 'rm -rf "$WORK"' EXIT
+mkdir -p "$HOME/.oh-my-zsh/custom"
+printf 'ZSH_THEME="robbyrussell"\nplugins=(git)\n' > "$HOME/.zshrc"
+
+export GIT_AUTHOR_NAME=test GIT_AUTHOR_EMAIL=test@example.com
+export GIT_COMMITTER_NAME=test GIT_COMMITTER_EMAIL=test@example.com
+
+# Repos bare con dos commits cada uno, en la misma ruta que en GitHub
+REPOS="romkatv/powerlevel10k zsh-users/zsh-autosuggestions zsh-users/zsh-history-substring-search zsh-users/zsh-syntax-highlighting"
+for repo in $REPOS; do
+    git init -q --bare "$WORK/remote/$repo.git"
+    git clone -q "$WORK/remote/$repo.git" "$WORK/src/$repo" 2>/dev/null
+    for n in 1 2; do
+        echo "$n" > "$WORK/src/$repo/file"
+        git -C "$WORK/src/$repo" add file
+        git -C "$WORK/src/$repo" commit -q -m "commit $n"
+    done
+    git -C "$WORK/src/$repo" push -q origin HEAD 2>/dev/null
+done
+export SETUP_MACOS_GIT_BASE="file://$WORK/remote"
+
+run_install() {
+    (cd "$APPS_DIR" && python3 -c "import setup_macos as s; s.install_oh_my_zsh(jobs=4)") >/dev/null 2>&1
+}
+
+printf "%s=== Test: clones de tema y plugins (setup_macos.py) ===%s\n\n" "$CYAN" "$NC"
+
+run_install
+P10K="$HOME/.oh-my-zsh/custom/themes/powerlevel10k"
+PLUGINS="$HOME/.oh-my-zsh/custom/plugins"
+
+[ -f "$P10K/file" ]; ok $? "Powerlevel10k clonado en themes/"
+all=0
+for p in zsh-autosuggestions zsh-history-substring-search zsh-syntax-highlighting; do
+    [ -f "$PLUGINS/$p/file" ] || all=1
+done
+[ "$all" = "0" ]; ok $? "los tres plugins clonados en plugins/"
+
+[ "$(git -C "$P10K" rev-list --count HEAD)" = "1" ]; ok $? "clone superficial (--depth=1): un solo commit"
+[ "$(git -C "$PLUGINS/zsh-autosuggestions" rev-list --count HEAD)" = "1" ]; ok $? "plugins también superficiales"
+[ "$(git -C "$P10K" branch -r | wc -l)" -le 2 ]; ok $? "una sola rama remota (--single-branch)"
+
+# Nuevo commit en el remoto: repetir la instalación debe actualizar, no fallar
+echo 3 > "$WORK/src/romkatv/powerlevel10k/file"
+git -C "$WORK/src/romkatv/powerlevel10k" commit -q -am "commit 3"
+git -C "$WORK/src/romkatv/powerlevel10k" push -q origin HEAD 2>/dev/null
+touch "$PLUGINS/zsh-autosuggestions/.marker"
+
+run_install
+[ "$(cat "$P10K/file")" = "3" ]; ok $? "la segunda ejecución trae el commit nuevo"
+[ "$(git -C "$P10K" rev-parse HEAD)" = "$(git -C "$WORK/remote/romkatv/powerlevel10k.git" rev-parse HEAD)" ]; ok $? "HEAD coincide con el remoto"
+[ -f "$PLUGINS/zsh-autosuggestions/.marker" ]; ok $? "los repos ya clonados no se vuelven a clonar"
+
+# Un directorio que no es repo de git se deja intacto
+rm -rf "$PLUGINS/zsh-syntax-highlighting"; mkdir -p "$PLUGINS/zsh-syntax-highlighting"
+echo mine > "$PLUGINS/zsh-syntax-highlighting/local"
+run_install
+[ -f "$PLUGINS/zsh-syntax-highlighting/local" ] && [ ! -d "$PLUGINS/zsh-syntax-highlighting/.git" ]; ok $? "no toca carpetas que no son repos de git"
+
+# --- Plan/apply con un brew falso en el PATH ---
+printf "\n%s=== Test: --plan / --apply con perfil guardado ===%s\n\n" "$CYAN" "$NC"
+
+# brew falso: registra cada llamada; info devuelve lo "instalado" e install
+# lo apunta y toca Cellar, como el brew real. FAIL_FETCH / FAIL_INSTALL
+# hacen fallar esos subcomandos; SLOW_FETCH alarga fetch y apunta su final.
+BREW="$WORK/brew"
+mkdir -p "$BREW/bin" "$BREW/Cellar"
+cat > "$BREW/bin/brew" <<STUB
+#!/usr/bin/env bash
+echo "\$*" >> "$BREW/calls"
+[ "\$1" = fetch ] && [ -n "\$SLOW_FETCH" ] && { sleep 0.3; echo "end fetch" >> "$BREW/calls"; }
+[ "\$1" = fetch ] && [ -n "\$FAIL_FETCH" ] && exit 1
+[ "\$1" = install ] && [ -n "\$FAIL_INSTALL" ] && exit 1
+case "\$1" in
+    info) printf '{"formulae":[%s],"casks":[]}\n' "\$(sed 's/.*/{"name":"&"}/' "$BREW/installed" 2>/dev/null | paste -sd,)" ;;
+    install) shift; for p in "\$@"; do echo "\${p##*/}" >> "$BREW/installed"; mkdir -p "$BREW/Cellar/\${p##*/}"; done ;;
+esac
+exit 0
+STUB
+chmod +x "$BREW/bin/brew"
+
+# Máquina ya configurada salvo las apps del perfil
+rm -rf "$PLUGINS/zsh-syntax-highlighting"; run_install
+git config --global user.name test; git config --global user.email test@example.com
+mkdir -p "$HOME/.ssh"; touch "$HOME/.ssh/id_ed25519"
+printf 'ZSH_THEME="powerlevel10k/powerlevel10k"\nplugins=(git zsh-autosuggestions)\n' > "$HOME/.zshrc"
+mkdir -p "$HOME/.config/setup_macos"
+echo '{"apps": ["pnpm", "fzf"]}' > "$HOME/.config/setup_macos/profile.json"
+
+run_mode() {
+    (cd "$APPS_DIR" && PATH="$BREW/bin:$PATH" python3 -c "import setup_macos as s; s.main(['$1'])" 2>&1 </dev/null)
+}
+
+out=$(run_mode --plan)
+echo "$out" | grep -q 'pnpm.*pendiente'; ok $? "--plan marca pnpm como pendiente"
+echo "$out" | grep -q 'Credenciales de Git.*hecho'; ok $? "--plan reconoce las credenciales de Git ya configuradas"
+! grep -q '^install' "$BREW/calls"; ok $? "--plan no instala nada"
+
+run_mode --apply >/dev/null
+grep -q '^install pnpm fzf' "$BREW/calls"; ok $? "--apply instala solo las apps pendientes, en un lote"
+
+: > "$BREW/calls"
+out=$(run_mode --apply)
+echo "$out" | grep -q 'no hay nada que hacer'; ok $? "segunda ejecución: no hay nada que hacer"
+[ ! -s "$BREW/calls" ]; ok $? "segunda ejecución: ni una llamada a brew (instantánea en caché)"
+
+# --- ~/.zshrc: bloques gestionados, idempotentes y escritos una vez ---
+printf "\n%s=== Test: edición de ~/.zshrc ===%s\n\n" "$CYAN" "$NC"
+
+# ~/.zshrc como enlace a un repo de dotfiles, con la plantilla de Oh My Zsh
+mkdir -p "$WORK/dotfiles"
+printf 'export ZSH="$HOME/.oh-my-zsh"\nZSH_THEME="robbyrussell"\nplugins=(git)\nsource $ZSH/oh-my-zsh.sh\nalias ll="ls -l"\n' > "$WORK/dotfiles/zshrc"
+ln -sf "$WORK/dotfiles/zshrc" "$HOME/.zshrc"
+
+edit_zshrc() {
+    (cd "$APPS_DIR" && python3 -c "
+import setup_macos as s
+s.zshrc().set_oh_my_zsh(s.ZSH_THEME, s.ZSH_PLUGINS)
+s.add_to_path({'name': 'A', 'path': '/opt/a/bin', 'executable': 'no-existe-a'})
+s.add_to_path({'name': 'B', 'path': '/opt/b/bin', 'executable': 'no-existe-b'})
+s.save_zshrc()") >/dev/null 2>&1
+}
+
+edit_zshrc
+RC="$WORK/dotfiles/zshrc"
+[ -L "$HOME/.zshrc" ]; ok $? "~/.zshrc sigue siendo un enlace (se escribe el archivo real)"
+theme_line=$(grep -n 'ZSH_THEME="powerlevel10k/powerlevel10k"' "$RC" | cut -d: -f1)
+source_line=$(grep -n '^source $ZSH/oh-my-zsh.sh' "$RC" | cut -d: -f1)
+[ -n "$theme_line" ] && [ "$theme_line" -lt "$source_line" ]; ok $? "tema y plugins antes de cargar Oh My Zsh"
+grep -q '^plugins=(git jump zsh-autosuggestions' "$RC"; ok $? "plugins activados"
+[ "$(grep -c 'export PATH="/opt/a/bin:$PATH"' "$RC")" = "1" ] && grep -q 'export PATH="/opt/b/bin:$PATH"' "$RC"; ok $? "las rutas van en el bloque de PATH"
+grep -q '^alias ll="ls -l"' "$RC"; ok $? "conserva el resto del archivo"
+
+cp "$RC" "$WORK/zshrc.first"
+edit_zshrc
+cmp -s "$RC" "$WORK/zshrc.first"; ok $? "una segunda ejecución no cambia nada (sin líneas duplicadas)"
+[ "$(grep -c '>>> setup_macos.py' "$RC")" = "2" ]; ok $? "exactamente dos bloques gestionados"
+
+# Sin la plantilla de Oh My Zsh el bloque también lo carga, y sigue siendo estable
+rm -f "$HOME/.zshrc"; echo 'alias ll="ls -l"' > "$HOME/.zshrc"
+edit_zshrc; cp "$HOME/.zshrc" "$WORK/zshrc.first"; edit_zshrc
+grep -q '^source "$ZSH/oh-my-zsh.sh"' "$HOME/.zshrc" && cmp -s "$HOME/.zshrc" "$WORK/zshrc.first"; ok $? "sin plantilla: el bloque carga Oh My Zsh y no cambia al repetir"
+
+# Se restaura un ~/.zshrc normal para lo que sigue
+rm -f "$HOME/.zshrc"; printf 'ZSH_THEME="powerlevel10k/powerlevel10k"\nplugins=(git zsh-autosuggestions)\n' > "$HOME/.zshrc"
+
+# --- Perfil TOML: todo sin preguntas ---
+printf "\n%s=== Test: --profile (sin preguntas) ===%s\n\n" "$CYAN" "$NC"
+
+git config --global --unset user.name; git config --global --unset user.email
+cat > "$WORK/profile.toml" <<'TOML'
+apps = ["Yarn", "Docker"]
+hide_dock = false
+
+[git]
+name = "Ana Pérez"
+email = "ana@example.com"
+
+[ssh]
+github = false
+TOML
+: > "$BREW/calls"
+
+out=$(cd "$APPS_DIR" && PATH="$BREW/bin:$PATH" timeout 60 python3 setup_macos.py --profile "$WORK/profile.toml" --timeline "$WORK/timeline" 2>&1 </dev/null)
+status=$?
+[ "$status" = "0" ]; ok $? "termina sin quedarse esperando respuestas (exit $status)"
+! echo "$out" | grep -qE '¿|Ingresa'; ok $? "no muestra ninguna pregunta"
+[ "$(git config --global user.name)" = "Ana Pérez" ] && [ "$(git config --global user.email)" = "ana@example.com" ]; ok $? "credenciales de Git tomadas del perfil"
+grep -q '^install yarn' "$BREW/calls" && grep -q '^install --cask docker' "$BREW/calls"; ok $? "instala las apps del perfil (fórmulas y casks)"
+! grep -q '^install.*pnpm' "$BREW/calls"; ok $? "no reinstala lo que ya estaba"
+
+# Línea de tiempo: pasos y comandos con duración, código de salida y bytes
+python3 - "$WORK/timeline" <<'PY'
+import json, sys
+timeline = json.load(open(f"{sys.argv[1]}/timeline.json"))
+names = {span["name"] for span in timeline["spans"]}
+assert {"Homebrew", "Oh My Zsh", "Instalación de apps"} <= names, names
+commands = [span for span in timeline["spans"] if span["kind"] == "command"]
+assert commands and all("exit_code" in span and "output_bytes" in span for span in commands)
+trace = json.load(open(f"{sys.argv[1]}/trace.json"))
+assert any(event["ph"] == "X" and event["name"] == "Instalación de apps" for event in trace["traceEvents"])
+PY
+ok $? "escribe timeline.json y trace.json con pasos y comandos"
+echo "$out" | grep -q 'Lo que más tardó'; ok $? "muestra los pasos más lentos al terminar"
+
+# Perfil sin [git] ni [ssh] en una máquina sin clave: esos pasos no aplican.
+# defaults falso: guarda autohide en un archivo, como el de macOS.
+DOCK="$WORK/dock"
+mkdir -p "$DOCK/bin"
+cat > "$DOCK/bin/defaults" <<STUB
+#!/usr/bin/env bash
+case "\$1" in
+    write) echo 1 > "$DOCK/autohide" ;;
+    read) cat "$DOCK/autohide" 2>/dev/null || exit 1 ;;
+esac
+STUB
+printf '#!/usr/bin/env bash\nexit 0\n' > "$DOCK/bin/killall"
+chmod +x "$DOCK/bin/defaults" "$DOCK/bin/killall"
+mv "$HOME/.ssh/id_ed25519" "$WORK/id_ed25519.saved"
+echo '{"apps": ["pnpm"], "hide_dock": true}' > "$WORK/dock.json"
+run_profile() {
+    (cd "$APPS_DIR" && PATH="$DOCK/bin:$BREW/bin:$PATH" python3 -c "import setup_macos as s; s.main(['--profile', '$WORK/dock.json', '$1'])" 2>&1 </dev/null)
+}
+
+out=$(run_profile --plan)
+echo "$out" | grep -q 'Clave SSH.*no aplica' && echo "$out" | grep -q 'Credenciales de Git.*no aplica'; ok $? "--profile sin [git] ni [ssh]: esos pasos no aplican"
+echo "$out" | grep -q 'Dock.*pendiente'; ok $? "--profile con hide_dock: el Dock queda pendiente"
+run_profile --apply >/dev/null
+[ "$(cat "$DOCK/autohide" 2>/dev/null)" = "1" ]; ok $? "--apply oculta el Dock"
+out=$(run_profile --apply)
+echo "$out" | grep -q 'Todo está configurado'; ok $? "segunda ejecución con ese perfil: todo está configurado"
+mv "$WORK/id_ed25519.saved" "$HOME/.ssh/id_ed25519"
+
+# --- Clave SSH: regenerar nunca deja la máquina sin clave ---
+printf "\n%s=== Test: regenerar la clave SSH ===%s\n\n" "$CYAN" "$NC"
+
+echo old-key > "$HOME/.ssh/id_ed25519"; echo old-pub > "$HOME/.ssh/id_ed25519.pub"
+ssh_key() {
+    (cd "$APPS_DIR" && PATH="$WORK/sshbin:$PATH" python3 -c "
+import setup_macos as s
+s.configure_ssh_key($1)") >/dev/null 2>&1 </dev/null
+}
+
+ssh_key '{"ssh": {"regenerate": True, "github": False}}'
+[ "$(cat "$HOME/.ssh/id_ed25519")" = "old-key" ] && [ "$(cat "$HOME/.ssh/id_ed25519.pub")" = "old-pub" ]; ok $? "sin correo: la clave existente sigue ahí"
+
+# ssh-keygen que falla a medias: se recupera la clave anterior
+mkdir -p "$WORK/sshbin"
+printf '#!/usr/bin/env bash\necho partial > "$HOME/.ssh/id_ed25519"\nexit 1\n' > "$WORK/sshbin/ssh-keygen"
+chmod +x "$WORK/sshbin/ssh-keygen"
+ssh_key '{"ssh": {"regenerate": True, "github": False, "email": "ana@example.com"}}'
+[ "$(cat "$HOME/.ssh/id_ed25519")" = "old-key" ] && [ "$(cat "$HOME/.ssh/id_ed25519.pub")" = "old-pub" ]; ok $? "si ssh-keygen falla se restaura la clave anterior"
+[ ! -e "$HOME/.ssh/id_ed25519.bak" ]; ok $? "no quedan copias .bak tras restaurar"
+
+# ssh-keygen que funciona, con un HOME con espacios: la clave vieja se borra
+printf '#!/usr/bin/env bash\nwhile [ $# -gt 0 ]; do [ "$1" = -f ] && key=$2; shift; done\necho new-key > "$key"; echo new-pub > "$key.pub"\n' > "$WORK/sshbin/ssh-keygen"
+printf '#!/usr/bin/env bash\nexit 0\n' > "$WORK/sshbin/ssh-add"
+chmod +x "$WORK/sshbin/ssh-keygen" "$WORK/sshbin/ssh-add"
+SPACED="$WORK/mi casa"
+mkdir -p "$SPACED/.ssh"; echo old-key > "$SPACED/.ssh/id_ed25519"; echo old-pub > "$SPACED/.ssh/id_ed25519.pub"
+HOME="$SPACED" ssh_key '{"ssh": {"regenerate": True, "github": False, "email": "ana@example.com"}}'
+[ "$(cat "$SPACED/.ssh/id_ed25519")" = "new-key" ] && [ "$(cat "$SPACED/.ssh/id_ed25519.pub")" = "new-pub" ]; ok $? "genera la clave nueva aunque la ruta tenga espacios"
+! ls "$SPACED/.ssh" | grep -q '\.bak$'; ok $? "la clave anterior no queda como .bak"
+
+# La prueba de conexión no se queda esperando a que se acepte la huella
+printf '#!/usr/bin/env bash\nexit 0\n' > "$WORK/sshbin/gh"
+printf '#!/usr/bin/env bash\necho "$*" > "%s/ssh.args"\necho "Hi ana! You'"'"'ve successfully authenticated" >&2\nexit 1\n' "$WORK" > "$WORK/sshbin/ssh"
+chmod +x "$WORK/sshbin/gh" "$WORK/sshbin/ssh"
+(cd "$APPS_DIR" && PATH="$WORK/sshbin:$PATH" python3 -c "
+import os, setup_macos as s
+s.add_ssh_key_to_github(os.path.expanduser('~/.ssh/id_ed25519'), interactive=False)") >/dev/null 2>&1 </dev/null
+grep -q -- '-o BatchMode=yes -o StrictHostKeyChecking=accept-new -T git@github.com' "$WORK/ssh.args"; ok $? "ssh -T va en BatchMode y acepta la huella solo si es nueva"
+
+# --- Progreso por fases: salida real de brew enlatada ---
+printf "\n%s=== Test: fases de brew y log por comando ===%s\n\n" "$CYAN" "$NC"
+
+mkdir -p "$WORK/canned/bin"
+cat > "$WORK/canned/bin/brew" <<'STUB'
+#!/usr/bin/env bash
+if [ "$2" = lote ]; then
+    echo "==> Pouring wget--1.24.5.arm64_sonoma.bottle.tar.gz"; sleep 0.1
+    echo "🍺  /opt/homebrew/Cellar/wget/1.24.5: 91 files, 4.5MB"
+    echo "==> Installing Cask docker"; echo "==> Moving App 'Docker.app' to '/Applications/Docker.app'"; sleep 0.6
+    echo "🍺  docker was successfully installed!"
+    exit 0
+fi
+echo "==> Downloading https://ghcr.io/v2/homebrew/core/wget/manifests/1.24.5"
+echo "==> Fetching wget"
+echo "==> Downloading https://ghcr.io/v2/homebrew/core/wget/blobs/sha256:4e1f"
+# Como curl, la barra de descarga solo se dibuja en una terminal
+[ -t 1 ] && printf '#####          7.1%%\r##########     14.3%%\r############### 100.0%%\n'
+# En una terminal brew colorea sus líneas
+printf '\033[34m==>\033[0m \033[1mPouring wget--1.24.5.arm64_sonoma.bottle.tar.gz\033[0m\n'
+echo "🍺  /opt/homebrew/Cellar/wget/1.24.5: 91 files, 4.5MB"
+echo "==> Running \`brew cleanup wget\`..."
+[ "$2" != "roto" ]
+STUB
+chmod +x "$WORK/canned/bin/brew"
+
+stream() {
+    (cd "$APPS_DIR" && PATH="$WORK/canned/bin:$PATH" python3 - "$1" <<'PY' 2>/dev/null
+import sys
+import setup_macos as s
+seen, positions = [], []
+feed = s.BrewPhases.feed
+def record(self, line):
+    changed = feed(self, line)
+    if changed and self.phase not in seen[-1:]:
+        seen.append(self.phase)
+    if changed:
+        positions.append(round(self.position, 1))
+    return changed
+s.BrewPhases.feed = record
+with s.new_progress() as progress:
+    ok = s.stream_command(f"brew install {sys.argv[1]}", f"Instalando {sys.argv[1]}", progress)
+print(ok, " ".join(seen))
+print(*positions)
+PY
+)
+}
+
+out=$(stream wget)
+echo "$out" | grep -q '^True descargando instalando terminando$'; ok $? "fases en orden: descargando → instalando → terminando"
+echo "$out" | grep -q '^5 9.6 14.3 70.0 75 95$'; ok $? "la barra sigue el porcentaje de curl durante la descarga (brew ve una terminal)"
+LOG=$(ls "$HOME"/.cache/setup_macos/logs/*/*-instalando-wget.log 2>/dev/null | tail -1)
+[ -n "$LOG" ] && grep -q '^\$ brew install wget' "$LOG" && grep -q '🍺' "$LOG" && grep -q '100.0%' "$LOG"; ok $? "log por comando con la orden y toda su salida"
+stream roto | grep -q '^False'; ok $? "un brew que falla devuelve error"
+
+# Un lote: cada paquete es un intervalo propio dentro del comando
+(cd "$APPS_DIR" && PATH="$WORK/canned/bin:$PATH" python3 - <<'PY' >/dev/null 2>&1
+import setup_macos as s
+with s.new_progress() as progress:
+    s.stream_command("brew install lote", "Instalando casks", progress)
+packages = {span["name"]: span for span in s.timeline.spans if span["kind"] == "package"}
+assert set(packages) == {"wget", "docker"}, packages
+assert all(span["command"] == "Instalando casks" for span in packages.values())
+assert packages["docker"]["seconds"] > 0.5 > packages["wget"]["seconds"], packages
+PY
+); ok $? "cada paquete de un lote queda como intervalo propio en la línea de tiempo"
+
+# --- Descargas: un solo brew fetch por tipo, nunca uno por app ---
+printf "\n%s=== Test: brew fetch por lotes ===%s\n\n" "$CYAN" "$NC"
+
+apply_profile() {
+    printf 'apps = [%s]\n\n[git]\nname = "Ana Pérez"\nemail = "ana@example.com"\n' "$1" > "$WORK/apps.toml"
+    : > "$BREW/calls"
+    (cd "$APPS_DIR" && PATH="$BREW/bin:$PATH" timeout 60 python3 setup_macos.py --profile "$WORK/apps.toml" --apply >/dev/null 2>&1 </dev/null)
+}
+
+SLOW_FETCH=1 FAIL_FETCH=1 apply_profile '"kubectl", "Minikube", "Telegram", "Slack"'
+status=$?
+[ "$(grep -c '^fetch' "$BREW/calls")" = "2" ] && grep -q '^fetch --deps kubectl minikube$' "$BREW/calls" \
+    && grep -q '^fetch --cask telegram slack$' "$BREW/calls"; ok $? "un brew fetch para las fórmulas y otro para los casks"
+[ "$(grep -o '^\(end \)\?fetch' "$BREW/calls" | paste -sd,)" = "fetch,end fetch,fetch,end fetch" ]; ok $? "los dos brew fetch van uno detrás de otro"
+[ "$(grep -c '^install kubectl minikube$' "$BREW/calls")" = "1" ] && [ "$(grep -c '^install --cask telegram slack$' "$BREW/calls")" = "1" ] \
+    && [ "$(grep -c '^install' "$BREW/calls")" = "2" ]; ok $? "un solo brew install por tipo"
+[ "$status" = "0" ]; ok $? "si falla la descarga se instala igual y termina bien (exit $status)"
+
+FAIL_INSTALL=1 apply_profile '"Go", "Ruby"'
+status=$?
+[ "$status" = "1" ]; ok $? "si falla la instalación termina con error (exit $status)"
+
+# --- Inventario: la instantánea caduca con Cellar/Caskroom; brew list de respaldo ---
+printf "\n%s=== Test: instantánea del inventario de Homebrew ===%s\n\n" "$CYAN" "$NC"
+
+# brew falso con su propio prefijo: info lee fórmulas y casks de dos
+# archivos y falla si existe no-json (como un brew sin --json=v2)
+INV="$WORK/inv"
+mkdir -p "$INV/bin" "$INV/Cellar" "$INV/Caskroom"
+echo wget > "$INV/formulae"; : > "$INV/casks"
+cat > "$INV/bin/brew" <<STUB
+#!/usr/bin/env bash
+echo "\$*" >> "$INV/calls"
+case "\$1 \$2" in
+    "info --json=v2")
+        [ -e "$INV/no-json" ] && exit 1
+        printf '{"formulae":[%s],"casks":[%s]}\n' \
+            "\$(sed 's/.*/{"name":"&"}/' "$INV/formulae" | paste -sd,)" \
+            "\$(sed 's/.*/{"token":"&"}/' "$INV/casks" | paste -sd,)" ;;
+    "list --formula") cat "$INV/formulae" ;;
+    "list --cask") cat "$INV/casks" ;;
+esac
+STUB
+chmod +x "$INV/bin/brew"
+
+inventory() {
+    : > "$INV/calls"
+    (cd "$APPS_DIR" && PATH="$INV/bin:$PATH" python3 -c "
+import setup_macos as s
+s.inventory.load_cached()
+print(','.join(sorted(s.inventory.formulae)), ','.join(sorted(s.inventory.casks)))" 2>/dev/null)
+}
+
+[ "$(inventory)" = "wget " ] && grep -q '^info --json=v2' "$INV/calls"; ok $? "primera carga: un brew info --json=v2"
+[ "$(inventory)" = "wget " ] && [ ! -s "$INV/calls" ]; ok $? "sin cambios en Cellar/Caskroom: sale de la instantánea sin llamar a brew"
+
+echo jq >> "$INV/formulae"; mkdir "$INV/Cellar/jq"
+[ "$(inventory)" = "jq,wget " ] && grep -q '^info' "$INV/calls"; ok $? "una fórmula nueva en Cellar invalida la instantánea"
+
+echo firefox > "$INV/casks"; mkdir "$INV/Caskroom/firefox"
+[ "$(inventory)" = "jq,wget firefox" ] && grep -q '^info' "$INV/calls"; ok $? "un cask nuevo en Caskroom invalida la instantánea"
+
+touch "$INV/no-json"; echo fd >> "$INV/formulae"; mkdir "$INV/Cellar/fd"
+[ "$(inventory)" = "fd,jq,wget firefox" ] && grep -q '^list --formula -1' "$INV/calls" && grep -q '^list --cask -1' "$INV/calls"
+ok $? "si brew info --json=v2 falla se usa brew list"
+
+echo '{"apps": "pnpm"}' > "$WORK/bad.json"
+(cd "$APPS_DIR" && python3 setup_macos.py --profile "$WORK/bad.json" >/dev/null 2>&1 </dev/null)
+[ "$?" = "1" ]; ok $? "un perfil mal formado termina con error"
+
+printf "\n%s--- Resultado ---%s\n" "$CYAN" "$NC"
+printf "%sPasaron: %s%s\n" "$GREEN" "$passed" "$NC"
+printf "%sFallaron: %s%s\n" "$RED" "$failed" "$NC"
+[ "$failed" -eq 0 ] && { printf "%sTodo correcto.%s\n" "$GREEN" "$NC"; exit 0; } || { printf "%sHay fallos.%s\n" "$RED" "$NC"; exit 1; }
@@ -0,0 +1,39 @@
+"""Write-then-rename helpers shared by the Square sync modules.
+
+Every file the sync leaves under its final name (images, manifest, metrics)
+goes through a hidden temp file next to it that is renamed into place, so a
+crash never leaves a truncated file that a later run or a scraper would
+take as complete.
+"""
+
+import os
+import threading
+from pathlib import Path
+
+
+def temp_path(path):
+    """Hidden per-process temp name next to path, for write-then-rename."""
+    path = Path(path)
+    return path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+
+
+def write_atomic_bytes(path, data):
+    """Write data to a temp file and rename it over path.
+
+    A crash mid-write leaves only a stray temp file, never a truncated image
+    under its final name that a later run would take as complete.
+    """
+    tmp_path = temp_path(path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def remove_temp_files(directory, pattern='.*.tmp'):
+    """Delete temp files a crashed run left behind in directory."""
+    for path in Path(directory).glob(pattern):
+        path.unlink(missing_ok=True)
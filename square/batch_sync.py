@@ -0,0 +1,241 @@
+"""Sync the catalog images of several Square merchants in one run.
+
+Every merchant gets its own subdirectory of the output directory (with its
+own manifest and store) and its own AsyncImageSync, and they all run at once
+on one event loop. They share the encoder processes, the memory budget, a
+global limit of simultaneous downloads handed out round-robin between
+merchants, and optionally a bandwidth cap, so a nightly job takes about as
+long as the largest merchant instead of the sum of all of them.
+
+    python square/batch_sync.py --merchants merchants.json --workers 64
+
+merchants.json lists each merchant's name and its token, either inline or
+through an environment variable (also read from .env):
+
+    {"merchants": [
+        {"name": "centro", "token_env": "SQUARE_TOKEN_CENTRO"},
+        {"name": "norte", "token": "EAAA..."}
+    ]}
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+from rate_limit import FairScheduler, TokenBucket
+from square_sync import (
+    DEFAULT_ENCODERS,
+    HTTP_TIMEOUT,
+    DEFAULT_MEMORY_BUDGET_MB,
+    WEBP_QUALITY,
+    MemoryBudget,
+    SquareAPIError,
+    SyncConfig,
+    env_int,
+    parse_formats,
+    parse_sizes,
+    safe_filename,
+)
+from square_sync_async import DEFAULT_ASYNC_WORKERS, AsyncImageSync, SharedResources
+
+# Simultaneous downloads across all merchants when none are configured
+DEFAULT_BATCH_WORKERS = DEFAULT_ASYNC_WORKERS * 2
+
+
+@dataclass
+class Merchant:
+    """A merchant to sync: a name for logs and its subdirectory, and its access token."""
+
+    name: str
+    token: str
+
+
+def merchant_directory(name):
+    """Subdirectory of a merchant inside the output directory.
+
+    Raises ValueError when the name sanitizes to nothing usable, which would
+    otherwise put the merchant's files straight into the base directory.
+    """
+    directory = safe_filename(name.strip())
+    if not directory.strip('.'):
+        raise ValueError(f"el nombre de comercio {name!r} no sirve como nombre de carpeta")
+    return directory
+
+
+def load_merchants(path):
+    """Read merchants from a JSON file: a list, or an object with a ``merchants`` list."""
+    data = json.loads(Path(path).read_text(encoding='utf-8'))
+    entries = data.get('merchants', []) if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        raise ValueError(f"se esperaba una lista de comercios en {path}")
+    merchants = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ValueError(f"cada comercio de {path} debe ser un objeto con name y token: {entry!r}")
+        name = entry.get('name')
+        token = entry.get('token') or os.getenv(entry.get('token_env', ''), '')
+        if not name or not isinstance(name, str):
+            raise ValueError(f"comercio sin nombre en {path}")
+        if not token:
+            raise ValueError(f"el comercio '{name}' no tiene token (token o token_env)")
+        merchant_directory(name)
+        merchants.append(Merchant(name, token))
+    return merchants
+
+
+def parse_merchant(value):
+    """Parse ``--merchant NAME=TOKEN``."""
+    name, sep, token = value.partition('=')
+    if not sep or not name.strip() or not token.strip():
+        raise argparse.ArgumentTypeError(f"se esperaba NOMBRE=TOKEN: {value!r}")
+    try:
+        merchant_directory(name)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return Merchant(name.strip(), token.strip())
+
+
+async def sync_merchants(merchants, base_config, workers, bandwidth=None, log=None):
+    """Sync every merchant concurrently into base_config.output_dir/<name>.
+
+    Returns {name: SyncResult or the exception that stopped that merchant};
+    one merchant failing does not stop the others. Raises ValueError before
+    starting if a name has no usable directory or two names share one.
+    """
+    directories = [merchant_directory(merchant.name) for merchant in merchants]
+    if len(set(directories)) != len(directories):
+        raise ValueError("hay comercios con el mismo nombre")
+    log = log or (lambda name, message, color="black": None)
+    encoder = ProcessPoolExecutor(max_workers=base_config.encoders, mp_context=multiprocessing.get_context('spawn'))
+    shared = SharedResources(
+        encoder=encoder,
+        memory_budget=MemoryBudget(base_config.memory_budget_mb * 1024 * 1024),
+        scheduler=FairScheduler(workers),
+        bandwidth=TokenBucket(bandwidth)
+    )
+
+    async def run(merchant, directory):
+        config = replace(
+            base_config,
+            token=merchant.token,
+            output_dir=Path(base_config.output_dir) / directory,
+            metrics_path=None,
+            prometheus_path=None
+        )
+        async for event in AsyncImageSync(config, shared=shared, name=merchant.name).events():
+            if event.kind == 'log':
+                log(merchant.name, event.message, event.color)
+            elif event.kind == 'done':
+                return event.result
+
+    try:
+        results = await asyncio.gather(
+            *(run(merchant, directory) for merchant, directory in zip(merchants, directories)), return_exceptions=True
+        )
+    finally:
+        await asyncio.to_thread(encoder.shutdown, True, cancel_futures=True)
+    return {merchant.name: result for merchant, result in zip(merchants, results)}
+
+
+def parse_args(argv=None):
+    default_output = Path(__file__).resolve().parent.parent / 'product_images'
+    parser = argparse.ArgumentParser(description="Sincroniza las imágenes de varios comercios de Square a la vez.")
+    parser.add_argument('--merchants', type=Path, default=None,
+                        help="archivo JSON con los comercios (nombre y token o token_env)")
+    parser.add_argument('--merchant', type=parse_merchant, action='append', default=[],
+                        help="comercio adicional como NOMBRE=TOKEN (se puede repetir)")
+    parser.add_argument('--output', type=Path, default=default_output,
+                        help=f"directorio base; cada comercio usa un subdirectorio (por defecto {default_output})")
+    parser.add_argument('--workers', type=int, default=env_int('SQUARE_DOWNLOAD_WORKERS', DEFAULT_BATCH_WORKERS),
+                        help="descargas simultáneas entre todos los comercios, repartidas por turnos")
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help="MB/s máximos entre todos los comercios (por defecto sin límite)")
+    parser.add_argument('--connect-timeout', type=float, default=HTTP_TIMEOUT[0],
+                        help=f"segundos para conectar con el CDN antes de reintentar (por defecto {HTTP_TIMEOUT[0]})")
+    parser.add_argument('--read-timeout', type=float, default=HTTP_TIMEOUT[1],
+                        help=f"segundos sin recibir datos antes de reintentar una descarga (por defecto {HTTP_TIMEOUT[1]})")
+    parser.add_argument('--encoders', type=int, default=env_int('SQUARE_ENCODE_WORKERS', DEFAULT_ENCODERS),
+                        help="procesos de conversión compartidos")
+    parser.add_argument('--quality', type=int, default=WEBP_QUALITY, help="calidad de codificación (0-100)")
+    parser.add_argument('--max-size', type=int, default=None, help="lado máximo en píxeles")
+    parser.add_argument('--sizes', type=parse_sizes, default=(None,), help="anchos a generar (ej. 200,600,original)")
+    parser.add_argument('--formats', type=parse_formats, default=('webp',), help="formatos de salida (ej. webp,avif)")
+    parser.add_argument('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help=f"MB de descargas en memoria entre todos los comercios (por defecto {DEFAULT_MEMORY_BUDGET_MB})")
+    parser.add_argument('--quiet', action='store_true', help="solo muestra errores y el resumen final")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Tokens referenced through token_env may live in the .env file
+    env_file = Path(__file__).resolve().parent.parent / '.env'
+    if env_file.exists():
+        from dotenv import load_dotenv
+        load_dotenv(env_file)
+
+    try:
+        merchants = (load_merchants(args.merchants) if args.merchants else []) + args.merchant
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    names = [merchant_directory(merchant.name) for merchant in merchants]
+    if not merchants:
+        print("Error: no hay comercios (usa --merchants o --merchant)", file=sys.stderr)
+        return 2
+    if len(set(names)) != len(names):
+        print("Error: hay comercios con el mismo nombre", file=sys.stderr)
+        return 2
+
+    def log(name, message, color="black"):
+        if args.quiet and color != "red":
+            return
+        print(f"[{name}] {message}", file=sys.stderr if color == "red" else sys.stdout, flush=True)
+
+    config = SyncConfig(
+        token='',
+        output_dir=args.output,
+        workers=max(1, args.workers),
+        encoders=max(1, args.encoders),
+        quality=args.quality,
+        max_size=args.max_size,
+        sizes=args.sizes,
+        formats=args.formats,
+        memory_budget_mb=max(1, args.memory_budget),
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout
+    )
+    bandwidth = args.bandwidth * 1024 * 1024 if args.bandwidth else None
+    try:
+        results = asyncio.run(sync_merchants(merchants, config, config.workers, bandwidth, log=log))
+    except KeyboardInterrupt:
+        print("Sincronización cancelada", file=sys.stderr)
+        return 130
+
+    failed = False
+    for name, result in results.items():
+        if isinstance(result, SquareAPIError):
+            print(f"[{name}] {result}", file=sys.stderr)
+            failed = True
+        elif isinstance(result, BaseException):
+            print(f"[{name}] Error: {result}", file=sys.stderr)
+            failed = True
+        else:
+            print(
+                f"[{name}] {result.processed_items}/{result.total_items} productos, "
+                f"{result.saved_images} imágenes guardadas, {result.unchanged_images} sin cambios, "
+                f"{result.failed_images} errores"
+            )
+            failed = failed or bool(result.failed_images)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
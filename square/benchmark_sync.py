@@ -0,0 +1,378 @@
+"""Offline benchmark for the Square image sync.
+
+Starts a local stand-in for the Square Catalog API and the image CDN in a
+separate process, serves a synthetic catalog from it and runs the real sync
+engine (square_sync.py) against it end to end. Nothing touches production
+Square.
+
+    python square/benchmark_sync.py --items 1500 --cdn-latency-ms 80 --error-rate 0.02 --runs 2
+
+Each run reports items/sec, MB/sec, p50/p99 image fetch latency, peak RSS
+and CPU utilization. With --runs 2 or more, later runs reuse the output
+directory and measure the incremental (nothing changed) path. --engine async
+benchmarks the asyncio engine instead of the threaded one.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from square_sync import DEFAULT_ENCODERS, DEFAULT_WORKERS, SyncConfig, parse_formats, parse_sizes, sync_images
+from square_sync_async import sync_images_async
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers (0 when empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def synthetic_jpeg(width, height, seed):
+    """Gradients plus grain, so decode/encode cost and file size resemble a product photo."""
+    from PIL import Image
+
+    rng = random.Random(seed)
+    bands = [
+        Image.linear_gradient('L').rotate(rng.choice((0, 90, 180, 270))).resize((width, height)),
+        Image.radial_gradient('L').resize((width, height)),
+        Image.linear_gradient('L').rotate(rng.choice((0, 90, 180, 270))).resize((width, height)),
+    ]
+    grain = Image.effect_noise((width, height), 30).convert('RGB')
+    buffer = io.BytesIO()
+    Image.blend(Image.merge('RGB', bands), grain, 0.2).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class MockCatalog:
+    """Synthetic catalog: items, their image IDs and the image bytes served by the CDN."""
+
+    def __init__(self, options):
+        self.options = options
+        self.items = []
+        self.images = []
+        image_number = 0
+        for i in range(options.items):
+            image_ids = []
+            for _ in range(options.images_per_item):
+                image_ids.append(f'IMG{image_number:07d}')
+                image_number += 1
+            self.items.append({
+                'type': 'ITEM',
+                'id': f'ITEM{i:07d}',
+                'version': 1,
+                'updated_at': '2024-01-01T00:00:00.000Z',
+                'item_data': {'name': f'Producto {i}', 'product_type': 'FOOD_AND_BEV', 'image_ids': image_ids}
+            })
+        self.images = [f'IMG{n:07d}' for n in range(image_number)]
+        self.image_set = set(self.images)
+        self.base_jpeg = synthetic_jpeg(options.image_width, options.image_height, options.seed)
+
+    def image_object(self, image_id, base_url):
+        return {
+            'type': 'IMAGE',
+            'id': image_id,
+            'version': 1,
+            'image_data': {'url': f'{base_url}/img/{image_id}.jpg'}
+        }
+
+    def image_bytes(self, image_id):
+        # JPEG decoders ignore data after the end-of-image marker, so a unique
+        # trailer makes every image distinct for hashing without re-encoding.
+        # Duplicated images share the trailer of the first image in their group.
+        number = int(image_id[3:])
+        if self.options.duplicate_ratio > 0:
+            group = max(1, round(1 / self.options.duplicate_ratio))
+            number -= number % group
+        return self.base_jpeg + f'\n{number}'.encode()
+
+
+def make_server(options, catalog=None, catalogs=None):
+    """Mock Square API + CDN bound to a free localhost port; not started yet.
+
+    catalogs optionally maps access tokens to their own MockCatalog, to
+    stand in for several merchants; other tokens get catalog.
+    """
+    catalog = catalog or MockCatalog(options)
+    catalogs = catalogs or {}
+    rng = random.Random(options.seed)
+    stats_lock = threading.Lock()
+    # api_bodies records every API call ({path, body}) so tests can check what was asked for
+    stats = {'image_requests': 0, 'image_errors': 0, 'image_throttled': 0, 'bytes_served': 0, 'api_requests': 0,
+             'latencies': [], 'api_bodies': []}
+    in_flight = [0]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, payload, status=200):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def base_url(self):
+            return f'http://127.0.0.1:{self.server.server_port}'
+
+        def merchant_catalog(self):
+            token = self.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+            return catalogs.get(token, catalog)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            merchant = self.merchant_catalog()
+            with stats_lock:
+                stats['api_requests'] += 1
+                stats['api_bodies'].append({'path': self.path, 'body': body})
+            time.sleep(options.api_latency_ms / 1000)
+            cursor = int(body.get('cursor') or 0)
+            limit = int(body.get('limit') or 100)
+            if self.path.startswith('/v2/catalog/search-catalog-items'):
+                page = merchant.items[cursor:cursor + limit]
+                response = {'items': page}
+                total = len(merchant.items)
+            elif self.path.startswith('/v2/catalog/batch-retrieve'):
+                response = {'objects': [
+                    merchant.image_object(image_id, self.base_url())
+                    for image_id in body.get('object_ids', []) if image_id in merchant.image_set
+                ]}
+                return self.send_json(response)
+            else:
+                return self.send_json({'errors': [{'category': 'INVALID_REQUEST_ERROR', 'code': 'NOT_FOUND'}]}, 404)
+            if cursor + limit < total:
+                response['cursor'] = str(cursor + limit)
+            self.send_json(response)
+
+        def do_GET(self):
+            if self.path == '/__stats':
+                with stats_lock:
+                    return self.send_json(stats)
+            if self.path == '/__reset':
+                with stats_lock:
+                    stats.update(image_requests=0, image_errors=0, image_throttled=0, bytes_served=0, api_requests=0,
+                                 latencies=[], api_bodies=[])
+                return self.send_json({})
+            if not self.path.startswith('/img/'):
+                return self.send_json({}, 404)
+
+            started = time.perf_counter()
+            image_id = self.path.rsplit('/', 1)[-1].split('.')[0]
+            with stats_lock:
+                in_flight[0] += 1
+                throttled = options.cdn_capacity and in_flight[0] > options.cdn_capacity
+                if throttled:
+                    stats['image_throttled'] += 1
+            try:
+                if throttled:
+                    # Over capacity: answer right away, like a CDN shedding load
+                    self.send_response(429)
+                    self.send_header('Retry-After', '1')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_image(image_id, started)
+            finally:
+                with stats_lock:
+                    in_flight[0] -= 1
+
+        def send_image(self, image_id, started):
+            time.sleep(options.cdn_latency_ms / 1000)
+            with stats_lock:
+                stats['image_requests'] += 1
+                failed = rng.random() < options.error_rate
+                if failed:
+                    stats['image_errors'] += 1
+            if failed:
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            etag = f'"{image_id}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            data = catalog.image_bytes(image_id)
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(data)
+            with stats_lock:
+                stats['bytes_served'] += len(data)
+                stats['latencies'].append(time.perf_counter() - started)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(options, port_queue):
+    """Run the mock Square API + CDN until the parent terminates this process."""
+    server = make_server(options)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def fetch_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+
+def peak_rss_mb(who):
+    """Peak resident set size in MB (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def cpu_seconds():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return self_usage.ru_utime + self_usage.ru_stime + children.ru_utime + children.ru_stime
+
+
+def run_once(options, base_url, output_dir):
+    fetch_json(f'{base_url}/__reset')
+    config = SyncConfig(
+        token='benchmark',
+        output_dir=output_dir,
+        workers=options.workers,
+        encoders=options.encoders,
+        quality=options.quality,
+        sizes=options.sizes,
+        formats=options.formats,
+        adaptive=options.adaptive,
+        base_url=base_url
+    )
+    errors = []
+
+    def log(message, color="black"):
+        if color == "red":
+            errors.append(message)
+
+    cpu_before = cpu_seconds()
+    started = time.perf_counter()
+    if options.engine == 'async':
+        result = asyncio.run(sync_images_async(config, log=log))
+    else:
+        result = sync_images(config, log=log)
+    elapsed = time.perf_counter() - started
+    cpu_used = cpu_seconds() - cpu_before
+    stats = fetch_json(f'{base_url}/__stats')
+
+    megabytes = stats['bytes_served'] / (1024 * 1024)
+    return {
+        'seconds': round(elapsed, 3),
+        'items': result.processed_items,
+        'items_per_sec': round(result.processed_items / elapsed, 1),
+        'megabytes': round(megabytes, 2),
+        'mb_per_sec': round(megabytes / elapsed, 2),
+        'image_requests': stats['image_requests'],
+        'injected_errors': stats['image_errors'],
+        'throttled_requests': stats['image_throttled'],
+        'final_concurrency_limit': result.metrics['gauges'].get('image_concurrency_limit'),
+        'saved_images': result.saved_images,
+        'unchanged_images': result.unchanged_images,
+        'deduplicated_images': result.deduplicated_images,
+        'failed_images': result.failed_images,
+        'fetch_p50_ms': round(percentile(stats['latencies'], 0.50) * 1000, 1),
+        'fetch_p99_ms': round(percentile(stats['latencies'], 0.99) * 1000, 1),
+        'image_p50_ms': round(result.metrics['stages'].get('image', {}).get('p50', 0) * 1000, 1),
+        'image_p99_ms': round(result.metrics['stages'].get('image', {}).get('p99', 0) * 1000, 1),
+        'stages': result.metrics['stages'],
+        'peak_rss_mb': round(peak_rss_mb(resource.RUSAGE_SELF), 1),
+        'peak_encoder_rss_mb': round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        'cpu_utilization': round(cpu_used / (elapsed * (os.cpu_count() or 1)), 3),
+        'errors': errors[:10]
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de la sincronización de imágenes contra un Square + CDN local.")
+    parser.add_argument('--items', type=int, default=500, help="productos en el catálogo sintético")
+    parser.add_argument('--images-per-item', type=int, default=1)
+    parser.add_argument('--image-width', type=int, default=1600)
+    parser.add_argument('--image-height', type=int, default=1200)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.0,
+                        help="fracción de imágenes con contenido repetido (0-1)")
+    parser.add_argument('--api-latency-ms', type=float, default=50, help="latencia de cada llamada al catálogo")
+    parser.add_argument('--cdn-latency-ms', type=float, default=80, help="latencia de cada imagen del CDN")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fracción de imágenes que responden 503")
+    parser.add_argument('--cdn-capacity', type=int, default=0,
+                        help="imágenes simultáneas que acepta el CDN; por encima responde 429 (0 = sin límite)")
+    parser.add_argument('--engine', choices=('threads', 'async'), default='threads')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--no-adaptive', dest='adaptive', action='store_false')
+    parser.add_argument('--encoders', type=int, default=DEFAULT_ENCODERS)
+    parser.add_argument('--quality', type=int, default=85)
+    parser.add_argument('--sizes', type=parse_sizes, default=(None,))
+    parser.add_argument('--formats', type=parse_formats, default=('webp',))
+    parser.add_argument('--runs', type=int, default=1, help="ejecuciones sobre el mismo directorio de salida")
+    parser.add_argument('--output', type=Path, default=None, help="directorio de salida (por defecto uno temporal)")
+    parser.add_argument('--json', type=Path, default=None, help="guarda los resultados en este archivo JSON")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    output_dir = options.output or Path(tempfile.mkdtemp(prefix='square-bench-'))
+
+    context = multiprocessing.get_context('spawn')
+    port_queue = context.Queue()
+    server = context.Process(target=serve, args=(options, port_queue), daemon=True)
+    server.start()
+    base_url = f'http://127.0.0.1:{port_queue.get(timeout=60)}'
+
+    results = []
+    try:
+        for run in range(1, options.runs + 1):
+            stats = run_once(options, base_url, output_dir)
+            results.append(stats)
+            print(
+                f"run {run}: {stats['seconds']}s  {stats['items_per_sec']} items/s  {stats['mb_per_sec']} MB/s  "
+                f"fetch p50 {stats['fetch_p50_ms']} ms  p99 {stats['fetch_p99_ms']} ms  "
+                f"image p50 {stats['image_p50_ms']} ms  p99 {stats['image_p99_ms']} ms  "
+                f"rss {stats['peak_rss_mb']} MB (encoders {stats['peak_encoder_rss_mb']} MB)  "
+                f"cpu {stats['cpu_utilization'] * 100:.0f}%  "
+                f"saved {stats['saved_images']} unchanged {stats['unchanged_images']} "
+                f"dedup {stats['deduplicated_images']} failed {stats['failed_images']}  "
+                f"429s {stats['throttled_requests']} limit {stats['final_concurrency_limit']}"
+            )
+    finally:
+        server.terminate()
+        server.join()
+        if options.output is None:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    if options.json:
+        options.json.write_text(json.dumps({'options': {
+            key: value for key, value in vars(options).items() if key not in ('json', 'output')
+        }, 'runs': results}, indent=2, default=str))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+"""Fixtures shared by the tests: benchmark_sync's mock Square + CDN, served in-process."""
+
+import threading
+
+import pytest
+
+from benchmark_sync import MockCatalog, make_server, parse_args
+
+
+@pytest.fixture
+def make_catalog():
+    """Build a small, fast MockCatalog with the given number of items."""
+    def build(items):
+        return MockCatalog(parse_args([
+            '--items', str(items), '--image-width', '64', '--image-height', '48',
+            '--api-latency-ms', '0', '--cdn-latency-ms', '0'
+        ]))
+
+    return build
+
+
+@pytest.fixture
+def serve():
+    """Start mock servers on free ports; returns their base URL and stops them afterwards."""
+    servers = []
+
+    def start(catalog, catalogs=None):
+        server = make_server(catalog.options, catalog, catalogs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
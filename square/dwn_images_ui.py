@@ -1,13 +1,95 @@
+import asyncio
 import os
 from dotenv import load_dotenv
 from pathlib import Path
-import requests
-from square.client import Client
-from PIL import Image
-import io
-import re
 import flet as ft
 import threading
+from collections import deque
+from square_sync import (
+    DEFAULT_ENCODERS,
+    SquareAPIError,
+    SyncConfig,
+    env_int,
+)
+from square_sync_async import DEFAULT_ASYNC_WORKERS, sync_images_async
+
+# UI refresh rate for log and progress updates, how many log lines stay
+# visible, and the file (inside the images directory) that keeps the full log
+UI_REFRESH_HZ = 10
+MAX_VISIBLE_LOG_LINES = 500
+LOG_FILE_NAME = '.sync.log'
+
+
+class BufferedLogView:
+    """Batches log lines and progress and flushes them to the page at a fixed rate.
+
+    Worker threads only append to an in-memory buffer; a single flusher thread
+    pushes the pending lines to the ListView at UI_REFRESH_HZ, so a sync costs a
+    bounded number of page updates regardless of the catalog size. The view
+    keeps the last max_lines entries while the full log goes to log_path.
+    """
+
+    def __init__(self, page, log_view, progress_bar, max_lines=MAX_VISIBLE_LOG_LINES, refresh_hz=UI_REFRESH_HZ):
+        self.page = page
+        self.log_view = log_view
+        self.progress_bar = progress_bar
+        self.max_lines = max_lines
+        self.interval = 1 / refresh_hz
+        self._lock = threading.Lock()
+        self._pending = deque(maxlen=max_lines)
+        self._progress = None
+        self._log_file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, log_path):
+        self.log_view.controls.clear()
+        self._log_file = open(log_path, 'w', encoding='utf-8')
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ui-flush", daemon=True)
+        self._thread.start()
+
+    def log(self, message, color="black"):
+        with self._lock:
+            self._pending.append((message, color))
+            if self._log_file is not None:
+                self._log_file.write(message + '\n')
+
+    def progress(self, value):
+        with self._lock:
+            self._progress = value
+
+    def flush(self):
+        with self._lock:
+            lines = list(self._pending)
+            self._pending.clear()
+            progress, self._progress = self._progress, None
+            if self._log_file is not None:
+                self._log_file.flush()
+        if not lines and progress is None:
+            return
+        controls = self.log_view.controls
+        controls.extend(ft.Text(message, color=color) for message, color in lines)
+        del controls[:-self.max_lines]
+        if progress is not None:
+            self.progress_bar.value = progress
+        self.page.update()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._lock:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
 
 def main(page: ft.Page):
     # Get the current directory of the script
@@ -40,6 +122,13 @@ def main(page: ft.Page):
         width=600
     )
     
+    workers_input = ft.TextField(
+        label="Descargas simultáneas",
+        value=str(env_int('SQUARE_DOWNLOAD_WORKERS', DEFAULT_ASYNC_WORKERS)),
+        keyboard_type=ft.KeyboardType.NUMBER,
+        width=200
+    )
+    
     progress_bar = ft.ProgressBar(width=600, visible=False)
     status_text = ft.Text("Estado: Listo para descargar", size=16)
     
@@ -51,17 +140,20 @@ def main(page: ft.Page):
         width=600
     )
     
+    log_buffer = BufferedLogView(page, download_logs, progress_bar)
+    
     def add_log_entry(message, color="black"):
-        download_logs.controls.append(ft.Text(message, color=color))
-        page.update()
+        log_buffer.log(message, color)
     
     def update_progress(value, max_value):
-        progress_bar.value = value / max_value
-        page.update()
+        log_buffer.progress(value / max_value)
+    
+    # Event loop and task of the sync in progress, so the cancel button can stop it
+    running = {}
     
     def download_images():
         # Reset UI
-        download_logs.controls.clear()
+        log_buffer.start(images_dir / LOG_FILE_NAME)
         progress_bar.visible = True
         progress_bar.value = 0
         status_text.value = "Estado: Conectando con Square..."
@@ -71,134 +163,82 @@ def main(page: ft.Page):
         square_token = token_input.value
         
         if not square_token:
+            log_buffer.stop()
             status_text.value = "Estado: Error - Token no proporcionado"
             progress_bar.visible = False
             page.update()
             return
         
         try:
-            # Create Square client
-            client = Client(
-                access_token=square_token,
-                environment='production'
-            )
+            workers = max(1, int(workers_input.value))
+        except (TypeError, ValueError):
+            workers = DEFAULT_ASYNC_WORKERS
+        
+        config = SyncConfig(
+            token=square_token,
+            output_dir=images_dir,
+            workers=workers,
+            encoders=env_int('SQUARE_ENCODE_WORKERS', DEFAULT_ENCODERS)
+        )
+        status_text.value = f"Estado: Descargando productos con {workers} descargas simultáneas..."
+        download_button.disabled = True
+        cancel_button.disabled = False
+        page.update()
+        
+        async def run_sync():
+            running['loop'] = asyncio.get_running_loop()
+            running['task'] = asyncio.current_task()
+            return await sync_images_async(config, log=add_log_entry, progress=update_progress)
+        
+        try:
+            result = asyncio.run(run_sync())
             
-            # First fetch - get all food and beverage items
-            add_log_entry("Buscando productos de comida y bebida...")
-            items_result = client.catalog.search_catalog_items(
-                body={
-                    "product_types": [
-                        "FOOD_AND_BEV"
-                    ]
-                }
-            )
+            status_text.value = f"Estado: ¡Completado! Se procesaron {result.total_items} productos."
+            add_log_entry("\nArchivos creados en:", "green")
+            add_log_entry(str(images_dir), "green")
             
-            # Second fetch - get all images
-            add_log_entry("Buscando todas las imágenes...")
-            images_result = client.catalog.search_catalog_objects(
-                body={
-                    "object_types": [
-                        "IMAGE"
-                    ],
-                    "include_deleted_objects": False,
-                    "include_related_objects": False,
-                    "include_category_path_to_root": False
-                }
-            )
+            # List created files
+            for file_name in result.files:
+                add_log_entry(f"- {file_name}", "blue")
             
-            if items_result.is_success() and images_result.is_success():
-                # Create a dictionary of image_id to image_url
-                image_map = {
-                    img['id']: img['image_data']['url']
-                    for img in images_result.body['objects']
-                }
-                
-                items = items_result.body['items']
-                total_items = len(items)
-                processed_items = 0
-                
-                add_log_entry(f"Encontrados {total_items} productos para procesar")
-                status_text.value = f"Estado: Descargando {total_items} productos..."
-                
-                # Process each item
-                for item in items:
-                    # Get the item name and image IDs
-                    item_name = item['item_data']['name']
-                    image_ids = item['item_data'].get('image_ids', [])
-                    
-                    if not image_ids:
-                        add_log_entry(f"El producto '{item_name}' no tiene imágenes asociadas", "orange")
-                    
-                    # Process each image ID for this item
-                    for img_id in image_ids:
-                        if img_id in image_map:
-                            # Get the image URL
-                            image_url = image_map[img_id]
-                            
-                            try:
-                                # Download the image
-                                add_log_entry(f"Descargando imagen para '{item_name}'...", "blue")
-                                response = requests.get(image_url)
-                                response.raise_for_status()  # Raise an exception for bad status codes
-                                
-                                # Open the image with Pillow
-                                img = Image.open(io.BytesIO(response.content))
-                                
-                                # Create safe filename
-                                safe_name = re.sub(r'[<>:"/\\|?*\'&,!@#$%^()+={}[\]~`]+', '', item_name)
-                                safe_name = re.sub(r'\s+', '_', safe_name)
-                                webp_filename = images_dir / f'{safe_name}.webp'
-                                
-                                # Convert and save as WebP
-                                img.save(str(webp_filename), 'WEBP', quality=85)
-                                add_log_entry(f"✅ Imagen guardada como: {webp_filename.name}", "green")
-                                
-                            except requests.RequestException as e:
-                                add_log_entry(f"❌ Error al descargar imagen para '{item_name}': {e}", "red")
-                            except Exception as e:
-                                add_log_entry(f"❌ Error al procesar imagen para '{item_name}': {e}", "red")
-                        else:
-                            add_log_entry(f"⚠️ ID de imagen {img_id} no encontrado para '{item_name}'", "orange")
-                    
-                    processed_items += 1
-                    update_progress(processed_items, total_items)
-                
-                status_text.value = f"Estado: ¡Completado! Se procesaron {total_items} productos."
-                add_log_entry("\nArchivos creados en:", "green")
-                add_log_entry(str(images_dir), "green")
-                
-                # List created files
-                file_count = 0
-                for file in images_dir.glob('*.webp'):
-                    add_log_entry(f"- {file.name}", "blue")
-                    file_count += 1
-                
-                add_log_entry(f"\nTotal de archivos creados: {file_count}", "green")
-                
-            else:
-                if items_result.is_error():
-                    error_msg = "Error obteniendo productos: " + str(items_result.errors)
-                    add_log_entry(error_msg, "red")
-                    status_text.value = "Estado: Error obteniendo productos"
-                
-                if images_result.is_error():
-                    error_msg = "Error obteniendo imágenes: " + str(images_result.errors)
-                    add_log_entry(error_msg, "red")
-                    status_text.value = "Estado: Error obteniendo imágenes"
+            add_log_entry(f"\nTotal de archivos creados: {len(result.files)}", "green")
+            add_log_entry(f"Imágenes sin cambios desde la última sincronización: {result.unchanged_images}", "green")
+            add_log_entry(f"Registro completo en: {images_dir / LOG_FILE_NAME}", "green")
+        
+        except asyncio.CancelledError:
+            add_log_entry("Descarga cancelada; las imágenes ya guardadas se conservan", "orange")
+            status_text.value = "Estado: Cancelado"
+        
+        except SquareAPIError as e:
+            add_log_entry(f"Error obteniendo {e.resource}: {e.errors}", "red")
+            status_text.value = f"Estado: Error obteniendo {e.resource}"
         
         except Exception as e:
             error_msg = f"Error general: {e}"
             add_log_entry(error_msg, "red")
             status_text.value = "Estado: Error en el proceso"
         
-        # Reset progress bar
+        finally:
+            running.clear()
+            log_buffer.stop()
+        
+        # Reset progress bar and buttons
         progress_bar.visible = False
+        download_button.disabled = False
+        cancel_button.disabled = True
         page.update()
     
     def start_download(_):
         # Run the download function in a separate thread to avoid blocking the UI
         threading.Thread(target=download_images).start()
     
+    def cancel_download(_):
+        loop, task = running.get('loop'), running.get('task')
+        if task is not None:
+            status_text.value = "Estado: Cancelando..."
+            page.update()
+            loop.call_soon_threadsafe(task.cancel)
+    
     # Corregido para evitar el uso de MaterialState que causaba el error
     download_button = ft.ElevatedButton(
         "Descargar Imágenes", 
@@ -209,6 +249,14 @@ def main(page: ft.Page):
         height=50
     )
     
+    cancel_button = ft.OutlinedButton(
+        "Cancelar",
+        on_click=cancel_download,
+        disabled=True,
+        width=200,
+        height=50
+    )
+    
     # Add all components to the page
     page.add(
         ft.Column([
@@ -216,8 +264,10 @@ def main(page: ft.Page):
             ft.Text("Ingresa tu token de acceso y haz clic en 'Descargar Imágenes'", size=16),
             ft.Container(height=20),
             token_input,
+            ft.Container(height=10),
+            workers_input,
             ft.Container(height=20),
-            download_button,
+            ft.Row([download_button, cancel_button], alignment=ft.MainAxisAlignment.CENTER),
             ft.Container(height=20),
             status_text,
             ft.Container(height=10),
@@ -0,0 +1,210 @@
+"""Client-side rate limiting and adaptive concurrency for the Square sync.
+
+TokenBucket caps how many requests per second go to an endpoint. The AIMD
+controller adjusts how many requests may be in flight: it adds one slot per
+window of healthy responses and halves the limit when the server throttles
+(429/503) or latency climbs well above its usual level, so throughput
+settles near what the service allows without tuning per merchant.
+AdaptiveLimiter applies both to worker threads, AsyncAdaptiveLimiter to
+coroutines.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+# Multiplicative decrease applied to the concurrency limit when congested
+DECREASE_FACTOR = 0.5
+
+# Latency (short-term average) above this multiple of the long-term average
+# counts as congestion
+LATENCY_TOLERANCE = 2.0
+
+# Smoothing of the short and long-term latency averages
+FAST_SMOOTHING = 0.3
+SLOW_SMOOTHING = 0.02
+
+
+class TokenBucket:
+    """Allows rate requests (or bytes) per second on average, with bursts of up to burst.
+
+    reserve() takes tokens and returns how long the caller must wait before
+    using them, so the same bucket serves threads (wait) and coroutines
+    (wait_async). A rate of None or 0 disables the limit.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def wait(self, tokens=1):
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+
+    async def wait_async(self, tokens=1):
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class AIMDController:
+    """Additive-increase / multiplicative-decrease concurrency limit."""
+
+    def __init__(self, initial, minimum=1, maximum=None, decrease=DECREASE_FACTOR, tolerance=LATENCY_TOLERANCE):
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self._limit = float(min(max(initial, minimum), self.maximum))
+        self._fast = None
+        self._slow = None
+        self._last_decrease = 0.0
+        self.decreases = 0
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def record(self, latency=None, throttled=False):
+        """Feed back one response; returns True if the limit went down."""
+        with self._lock:
+            congested = throttled
+            if latency is not None:
+                if self._slow is None:
+                    self._fast = self._slow = latency
+                else:
+                    self._fast += FAST_SMOOTHING * (latency - self._fast)
+                    self._slow += SLOW_SMOOTHING * (latency - self._slow)
+                congested = congested or self._fast > self._slow * self.tolerance
+            if not congested:
+                # About one extra slot per limit's worth of healthy responses
+                self._limit = min(self.maximum, self._limit + 1 / self._limit)
+                return False
+            # Back off at most once per round trip, so one burst of 429s
+            # does not collapse the limit to the minimum
+            now = time.monotonic()
+            if now - self._last_decrease < (self._fast or 1.0):
+                return False
+            self._last_decrease = now
+            self._limit = max(self.minimum, self._limit * self.decrease)
+            self.decreases += 1
+            return True
+
+
+class AdaptiveLimiter:
+    """Blocks worker threads while the AIMD limit is used up, then paces them with the bucket."""
+
+    def __init__(self, controller, bucket=None):
+        self.controller = controller
+        self.bucket = bucket
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < self.controller.limit)
+            self.in_flight += 1
+        if self.bucket is not None:
+            self.bucket.wait()
+
+    def release(self, latency=None, throttled=False):
+        self.controller.record(latency, throttled)
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify(max(1, self.controller.limit - self.in_flight))
+
+
+class AsyncAdaptiveLimiter:
+    """AdaptiveLimiter for coroutines on a single event loop."""
+
+    def __init__(self, controller, bucket=None):
+        self.controller = controller
+        self.bucket = bucket
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.controller.limit)
+            self.in_flight += 1
+        if self.bucket is not None:
+            try:
+                await self.bucket.wait_async()
+            except asyncio.CancelledError:
+                await self._free_slot()
+                raise
+
+    async def release(self, latency=None, throttled=False):
+        self.controller.record(latency, throttled)
+        await self._free_slot()
+
+    async def _free_slot(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify(max(1, self.controller.limit - self.in_flight))
+
+
+class FairScheduler:
+    """Concurrency limit shared by several clients and handed out round-robin.
+
+    When every slot is taken, waiters queue per client and each freed slot
+    goes to the next client in turn, so a merchant with a huge catalog
+    cannot starve the others. Coroutines on a single event loop only.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._waiters = {}
+        self._turns = deque()
+
+    async def acquire(self, client):
+        if self.in_flight < self.limit and not self._turns:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self._waiters.setdefault(client, deque())
+        if not queue:
+            self._turns.append(client)
+        queue.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just before the cancellation
+                self.release()
+            else:
+                queue.remove(waiter)
+                if not queue:
+                    del self._waiters[client]
+                    self._turns.remove(client)
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        while self.in_flight < self.limit and self._turns:
+            client = self._turns.popleft()
+            queue = self._waiters[client]
+            waiter = queue.popleft()
+            if queue:
+                self._turns.append(client)
+            else:
+                del self._waiters[client]
+            self.in_flight += 1
+            waiter.set_result(None)
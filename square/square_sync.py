@@ -0,0 +1,1309 @@
+"""Square catalog image sync engine.
+
+Downloads every image referenced by the Square catalog and saves it as WebP.
+The module has no UI dependencies: the Flet app (dwn_images_ui.py) drives it
+through ``sync_images()``, and it can run headless from cron:
+
+    python square/square_sync.py --output product_images --workers 16
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from square.client import Client
+from urllib3.util.retry import Retry
+
+from atomic_files import remove_temp_files, temp_path, write_atomic_bytes
+from rate_limit import AdaptiveLimiter, AIMDController, TokenBucket
+from sync_metrics import Metrics
+
+try:
+    # Older Pillow builds only write AVIF through this optional plugin
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# Default number of concurrent downloads (SQUARE_DOWNLOAD_WORKERS overrides it)
+DEFAULT_WORKERS = 8
+
+# Default number of WebP encoder processes (SQUARE_ENCODE_WORKERS overrides it)
+DEFAULT_ENCODERS = os.cpu_count() or 1
+
+# Encoder quality used for every converted image
+WEBP_QUALITY = 85
+
+# Output formats the converter knows about (extension -> Pillow format name)
+OUTPUT_FORMATS = {'webp': 'WEBP', 'avif': 'AVIF', 'jpg': 'JPEG', 'png': 'PNG'}
+
+# HTTP settings for image downloads: default (connect, read) timeouts in
+# seconds, retry attempts and the base of the exponential backoff between them
+HTTP_TIMEOUT = (5, 60)
+HTTP_RETRIES = 5
+HTTP_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Longest wait between retries, whatever Retry-After asks for
+MAX_RETRY_DELAY = 120
+
+# Responses that mean the server wants fewer requests, and the default pace
+# of catalog calls (requests per second); image fetches are unpaced unless
+# configured, and adapt their concurrency to these responses instead
+THROTTLE_STATUSES = (429, 503)
+DEFAULT_API_RATE = 10
+
+# Streaming downloads: chunk size and default budget (in MB) for image bytes
+# held in memory across all in-flight downloads; larger images spill to disk
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DEFAULT_MEMORY_BUDGET_MB = 256
+
+# Page size of the item search and IDs per image batch-retrieve call (the
+# maximum each endpoint accepts)
+ITEMS_PAGE_SIZE = 100
+IMAGES_BATCH_SIZE = 1000
+
+# Product types synced when none are configured
+DEFAULT_PRODUCT_TYPES = ('FOOD_AND_BEV',)
+
+# Name of the sync manifest stored inside the images directory, of the
+# journal of images completed since it was last saved, of the directory that
+# holds downloads spilled to disk and of the content-addressed store of
+# encoded images, and the per-run metrics summary
+MANIFEST_NAME = '.manifest.json'
+JOURNAL_NAME = '.sync-journal.jsonl'
+INCOMING_DIR_NAME = '.incoming'
+STORE_DIR_NAME = '.store'
+METRICS_NAME = '.metrics.json'
+
+
+class SquareAPIError(Exception):
+    """A Square catalog call returned errors."""
+
+    def __init__(self, resource, errors):
+        super().__init__(f"Error obteniendo {resource}: {errors}")
+        self.resource = resource
+        self.errors = errors
+
+
+class SyncConfigError(ValueError):
+    """Settings that cannot work, found before anything is downloaded."""
+
+
+@dataclass
+class SyncConfig:
+    """Settings for one sync run."""
+
+    token: str
+    output_dir: Path
+    workers: int = DEFAULT_WORKERS
+    encoders: int = DEFAULT_ENCODERS
+    quality: int = WEBP_QUALITY
+    max_size: int = None
+    # Variants written per image: widths in pixels (None keeps the original
+    # size, capped by max_size) times output formats
+    sizes: tuple = (None,)
+    formats: tuple = ('webp',)
+    memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB
+    # Catalog filters: product types, category and location IDs go into the
+    # item search (empty means no filter); updated_since (an aware datetime)
+    # skips items not modified since then, which the search cannot express
+    product_types: tuple = DEFAULT_PRODUCT_TYPES
+    category_ids: tuple = ()
+    location_ids: tuple = ()
+    updated_since: datetime = None
+    environment: str = 'production'
+    # Alternative Square API root (e.g. a local stand-in for benchmarks)
+    base_url: str = None
+    # Requests per second for catalog calls and image fetches (None: no cap).
+    # With adaptive, workers is the ceiling of a concurrency limit that backs
+    # off on throttling and grows back while responses are healthy.
+    api_rate: float = DEFAULT_API_RATE
+    image_rate: float = None
+    adaptive: bool = True
+    # Where to export metrics: JSON summary (defaults to METRICS_NAME inside
+    # output_dir) and an optional Prometheus textfile
+    metrics_path: Path = None
+    prometheus_path: Path = None
+    # Image downloads: connections kept in the HTTP pool (None: one per
+    # worker) and connect/read timeouts in seconds
+    pool_size: int = None
+    connect_timeout: float = HTTP_TIMEOUT[0]
+    read_timeout: float = HTTP_TIMEOUT[1]
+
+
+@dataclass
+class SyncResult:
+    """Counters reported at the end of a sync run."""
+
+    total_items: int = 0
+    processed_items: int = 0
+    saved_images: int = 0
+    unchanged_images: int = 0
+    deduplicated_images: int = 0
+    failed_images: int = 0
+    files: list = field(default_factory=list)
+    metrics: dict = field(default_factory=dict)
+
+
+def env_int(name, default):
+    """Read a positive integer from the environment, falling back to default."""
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except ValueError:
+        return default
+
+
+def safe_filename(item_name):
+    """Turn a product name into a filesystem-safe file name."""
+    safe_name = re.sub(r'[<>:"/\\|?*\'&,!@#$%^()+={}[\]~`]+', '', item_name)
+    return re.sub(r'\s+', '_', safe_name)
+
+
+def create_client(config):
+    """Square API client for the configured environment or custom base URL."""
+    if config.base_url:
+        return Client(access_token=config.token, environment='custom', custom_url=config.base_url)
+    return Client(access_token=config.token, environment=config.environment)
+
+
+class CappedRetry(Retry):
+    """urllib3 Retry that waits at most MAX_RETRY_DELAY on a Retry-After header.
+
+    A CDN asking for an hour's pause would otherwise park a download thread
+    (and its pool connection) for that hour.
+    """
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, MAX_RETRY_DELAY)
+
+
+def create_session(pool_size=DEFAULT_WORKERS, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF):
+    """Create a connection-pooled session shared by all download threads.
+
+    Connections (and their TLS sessions) to the image CDN are kept alive and
+    reused. Connection errors and 429/5xx responses are retried with
+    exponential backoff plus jitter, honouring Retry-After (up to
+    MAX_RETRY_DELAY) when present.
+    """
+    retry = CappedRetry(
+        total=retries,
+        backoff_factor=backoff,
+        backoff_jitter=backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class MemoryBudget:
+    """Byte budget shared by every download that buffers its image in memory."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, size):
+        with self._lock:
+            if self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self.used -= size
+
+
+@dataclass
+class SpooledImage:
+    """Downloaded image bytes, either held in memory or spilled to a temp file."""
+
+    data: bytearray = None
+    path: str = None
+    reserved: int = 0
+    digest: str = None
+    size: int = 0
+
+    @property
+    def source(self):
+        return self.data if self.data is not None else self.path
+
+    def discard(self, budget):
+        budget.release(self.reserved)
+        self.reserved = 0
+        self.data = None
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+
+class Spooler:
+    """Accumulates a download into a SpooledImage without exceeding the memory budget.
+
+    Bytes stay in memory while the shared budget allows it; once it does not
+    (or the expected size already says it will not), the body continues into
+    a temp file in tmp_dir, so peak memory no longer depends on the largest
+    image in the catalog. The SHA-256 of the body is computed on the way.
+    """
+
+    def __init__(self, budget, tmp_dir, expected=0):
+        self.budget = budget
+        self.tmp_dir = tmp_dir
+        self.spooled = SpooledImage(data=bytearray())
+        self._sha256 = hashlib.sha256()
+        self._spill = None
+        if expected:
+            if budget.try_acquire(expected):
+                self.spooled.reserved = expected
+            else:
+                self._spill_to_disk()
+
+    def _spill_to_disk(self):
+        spooled = self.spooled
+        self._spill = tempfile.NamedTemporaryFile(dir=self.tmp_dir, suffix='.part', delete=False)
+        spooled.path = self._spill.name
+        self._spill.write(spooled.data)
+        spooled.data = None
+        self.budget.release(spooled.reserved)
+        spooled.reserved = 0
+
+    def write(self, chunk):
+        spooled = self.spooled
+        self._sha256.update(chunk)
+        spooled.size += len(chunk)
+        if self._spill is None:
+            missing = len(spooled.data) + len(chunk) - spooled.reserved
+            if missing <= 0 or self.budget.try_acquire(missing):
+                spooled.reserved += max(missing, 0)
+                spooled.data += chunk
+                return
+            self._spill_to_disk()
+        self._spill.write(chunk)
+
+    def finish(self):
+        if self._spill is not None:
+            self._spill.close()
+        self.spooled.digest = self._sha256.hexdigest()
+        return self.spooled
+
+    def abort(self):
+        if self._spill is not None:
+            self._spill.close()
+        self.spooled.discard(self.budget)
+
+
+def spool_download(response, budget, tmp_dir):
+    """Stream a requests response body into a SpooledImage (see Spooler)."""
+    spooler = None
+    try:
+        spooler = Spooler(budget, tmp_dir, int(response.headers.get('Content-Length') or 0))
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            spooler.write(chunk)
+    except BaseException:
+        if spooler is not None:
+            spooler.abort()
+        raise
+    finally:
+        response.close()
+    return spooler.finish()
+
+
+def supported_formats():
+    """Output formats this Pillow build can write."""
+    Image.init()
+    return [ext for ext, name in OUTPUT_FORMATS.items() if name in Image.SAVE]
+
+
+def variant_filename(base_name, width, fmt):
+    """File name of one output variant: ``name.webp`` or ``name_600w.avif``."""
+    suffix = '' if width is None else f'_{width}w'
+    return f'{base_name}{suffix}.{fmt}'
+
+
+def flatten_for_jpeg(img):
+    """Return img in a mode JPEG can store, with transparency laid over white."""
+    if img.mode in ('RGB', 'L', 'CMYK'):
+        return img
+    if img.mode == 'P' and 'transparency' in img.info:
+        img = img.convert('RGBA')
+    if img.mode in ('RGBA', 'LA', 'PA'):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    return img.convert('RGB')
+
+
+def encode_variants(source, variants, quality=WEBP_QUALITY, max_size=None):
+    """Decode a downloaded image (bytes or a temp file path) once and write every variant.
+
+    variants is a list of (output_path, width, fmt) tuples; width None keeps
+    the original size, capped to fit max_size x max_size. JPEG decoding goes
+    through draft() at the largest size actually needed, so Pillow decodes at
+    a reduced scale instead of materialising the full-resolution original.
+    Smaller widths are resized from that single decode and never upscaled.
+
+    Returns the seconds spent decoding, resizing, encoding and writing, so
+    the parent can record them per stage.
+
+    Runs inside the encoder process pool, so it must stay a picklable
+    module-level function.
+    """
+    timings = {'decode': 0.0, 'resize': 0.0, 'encode': 0.0, 'write': 0.0}
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    started = time.perf_counter()
+    with Image.open(source) as img:
+        widths = [width or max_size for _, width, _ in variants]
+        if all(widths):
+            target = max(widths)
+            img.draft('RGB', (target, -(-target * img.height // img.width)))
+        img.load()
+        timings['decode'] = time.perf_counter() - started
+        started = time.perf_counter()
+        if max_size:
+            img.thumbnail((max_size, max_size), Image.LANCZOS)
+        resized = {}
+        for output_path, width, fmt in variants:
+            if width is None or width >= img.width:
+                out = img
+            else:
+                if width not in resized:
+                    height = max(1, round(img.height * width / img.width))
+                    resized[width] = img.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+                out = resized[width]
+            timings['resize'] += time.perf_counter() - started
+            started = time.perf_counter()
+            if fmt == 'jpg':
+                out = flatten_for_jpeg(out)
+            encoded = io.BytesIO()
+            out.save(encoded, OUTPUT_FORMATS[fmt], quality=quality)
+            timings['encode'] += time.perf_counter() - started
+            started = time.perf_counter()
+            write_atomic_bytes(output_path, encoded.getbuffer())
+            timings['write'] += time.perf_counter() - started
+            started = time.perf_counter()
+    return timings
+
+
+def retry_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number attempt (0-based).
+
+    Exponential backoff with jitter, like the urllib3 policy of
+    create_session(), unless the server sent a Retry-After in seconds or as
+    an HTTP date.
+    """
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0), MAX_RETRY_DELAY)
+    return min(HTTP_BACKOFF * 2 ** attempt + random.uniform(0, HTTP_BACKOFF), MAX_RETRY_DELAY)
+
+
+def parse_timestamp(value):
+    """Parse an RFC 3339 timestamp or a date; naive values are taken as UTC."""
+    parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def call_catalog(call, body, resource, metrics=None, bucket=None, stage='catalog_search'):
+    """Make one catalog call and return its body.
+
+    Calls are paced by bucket, and a throttled call is retried after a
+    backoff instead of failing the sync.
+    """
+    for attempt in range(HTTP_RETRIES + 1):
+        if bucket is not None:
+            bucket.wait()
+        started = time.perf_counter()
+        result = call(body=body)
+        if metrics is not None:
+            metrics.observe(stage, time.perf_counter() - started)
+            metrics.inc('catalog_calls')
+        if not result.is_error():
+            return result.body
+        if result.status_code not in THROTTLE_STATUSES or attempt == HTTP_RETRIES:
+            break
+        if metrics is not None:
+            metrics.inc('throttled_responses')
+        time.sleep(retry_delay(attempt, (result.headers or {}).get('Retry-After')))
+    raise SquareAPIError(resource, result.errors)
+
+
+def paginate(search, body, resource, metrics=None, bucket=None):
+    """Yield every page of a cursor-paginated catalog search, one call at a time."""
+    cursor = None
+    while True:
+        page = call_catalog(search, dict(body, cursor=cursor) if cursor else body, resource, metrics, bucket)
+        yield page
+        cursor = page.get('cursor')
+        if not cursor:
+            return
+
+
+def link_file(source, target):
+    """Point target at source with a hardlink (a copy where links are not supported).
+
+    The link is created under a temporary name and renamed over target, so an
+    existing file is replaced in one step.
+    """
+    target = Path(target)
+    if target.exists() and os.path.samefile(source, target):
+        return
+    tmp_path = temp_path(target)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+class ContentStore:
+    """Encoded variants addressed by the SHA-256 of their source bytes.
+
+    Images that several items share under different image IDs are encoded
+    once; the per-item files in the images directory are hardlinks into the
+    store. Each quality/max_size combination gets its own subdirectory so a
+    settings change never reuses stale encodes.
+    """
+
+    def __init__(self, root, variants, quality, max_size=None):
+        self.profile = f'q{quality}' + (f'-max{max_size}' if max_size else '')
+        self.root = Path(root) / self.profile
+        self.variants = variants
+
+    def paths(self, digest):
+        directory = self.root / digest[:2]
+        return [directory / variant_filename(digest, width, fmt) for width, fmt in self.variants]
+
+    def has(self, digest):
+        return bool(digest) and all(path.exists() for path in self.paths(digest))
+
+    def prepare(self, digest):
+        (self.root / digest[:2]).mkdir(parents=True, exist_ok=True)
+        return self.paths(digest)
+
+    def link(self, digest, output_paths):
+        for source, target in zip(self.paths(digest), output_paths):
+            link_file(source, target)
+
+    def remove_temp_files(self):
+        if self.root.exists():
+            for directory in self.root.iterdir():
+                remove_temp_files(directory)
+
+
+class Manifest:
+    """JSON index of synced images keyed by Square image ID.
+
+    Each image entry records the source URL, catalog version, the ETag and
+    Last-Modified validators returned by the CDN and the SHA-256 of the source
+    bytes, so later runs only fetch images that are new or changed. The
+    manifest also remembers which item/image owns each output name, which keeps
+    names stable across runs when several items sanitize to the same name.
+
+    Between saves every change is appended to a JSON-lines journal as soon as
+    it happens. Loading replays the journal over the manifest, so a run that
+    was killed resumes with everything it had finished; save() folds the
+    journal back into the manifest.
+    """
+
+    def __init__(self, path, journal_path=None):
+        self.path = Path(path)
+        self.journal_path = Path(journal_path) if journal_path else None
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._names = {}
+        self._journal = None
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding='utf-8'))
+                self._entries = data.get('images', {})
+                self._names = data.get('names', {})
+            except (OSError, ValueError):
+                # A corrupt manifest only costs a full re-download
+                self._entries, self._names = {}, {}
+        self._owners = {owner: name for name, owner in self._names.items()}
+        # Images recovered from the journal of an interrupted run
+        self.resumed = self._replay() if self.journal_path else 0
+
+    def _replay(self):
+        resumed = 0
+        try:
+            with open(self.journal_path, encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        # Torn last line of a run that died mid-write
+                        break
+                    if 'image' in change:
+                        self._entries[change['image']] = change['entry']
+                        resumed += 1
+                    elif 'name' in change:
+                        self._assign_name(change['name'], change['owner'])
+        except FileNotFoundError:
+            pass
+        return resumed
+
+    def _append(self, change):
+        # Callers hold the lock. Each line is flushed right away, so it
+        # survives the process dying a moment later.
+        if self.journal_path is None:
+            return
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._journal.write(json.dumps(change, sort_keys=True) + '\n')
+        self._journal.flush()
+
+    def get(self, image_id):
+        with self._lock:
+            return self._entries.get(image_id)
+
+    def record(self, image_id, **entry):
+        with self._lock:
+            self._entries[image_id] = entry
+            self._append({'image': image_id, 'entry': entry})
+
+    def _assign_name(self, name, owner):
+        previous = self._owners.get(owner)
+        if previous is not None and previous != name:
+            self._names.pop(previous, None)
+        self._names[name] = owner
+        self._owners[owner] = name
+
+    def claim_name(self, wanted, owner):
+        """Reserve an output base name for owner (``item_id/image_id``).
+
+        An owner keeps the name it got in earlier runs. A name already owned by
+        someone else gets the first free ``-2``, ``-3``... suffix; since names
+        are claimed in catalog order, the outcome is deterministic.
+        """
+        with self._lock:
+            previous = self._owners.get(owner)
+            if previous is not None:
+                if re.fullmatch(re.escape(wanted) + r'(-\d+)?', previous):
+                    return previous
+                del self._names[previous]
+                del self._owners[owner]
+            candidate, n = wanted, 1
+            while self._names.get(candidate, owner) != owner:
+                n += 1
+                candidate = f'{wanted}-{n}'
+            self._assign_name(candidate, owner)
+            self._append({'name': candidate, 'owner': owner})
+            return candidate
+
+    def known_digest(self, image_id, image):
+        """SHA-256 of the source recorded for this exact catalog version, if any."""
+        entry = self.get(image_id)
+        if entry and entry.get('version') == image['version'] and entry.get('url') == image['url']:
+            return entry.get('sha256')
+        return None
+
+    def is_current(self, image_id, image, output_paths, profile):
+        """True if the image is unchanged in the catalog and its outputs exist.
+
+        The entry must also carry the store profile (quality and max size) the
+        outputs were encoded with, so changing those settings re-encodes.
+        """
+        entry = self.get(image_id)
+        return bool(
+            entry
+            and entry.get('version') == image['version']
+            and entry.get('url') == image['url']
+            and entry.get('profile') == profile
+            and all(path.exists() for path in output_paths)
+        )
+
+    def conditional_headers(self, image_id):
+        """Validators for a conditional GET of a previously synced image."""
+        entry = self.get(image_id) or {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def save(self):
+        """Write the manifest atomically and drop the journal it now contains."""
+        with self._lock:
+            data = json.dumps({'images': self._entries, 'names': self._names}, indent=2, sort_keys=True)
+            write_atomic_bytes(self.path, data.encode('utf-8'))
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if self.journal_path is not None:
+                self.journal_path.unlink(missing_ok=True)
+
+
+class ImageSync:
+    """One sync run: catalog pagination, threaded downloads and pooled encodes.
+
+    ``log(message, color)`` and ``progress(done, total)`` are called from
+    worker threads; callers that drive a UI must make them thread-safe.
+    """
+
+    def __init__(self, config, log=None, progress=None):
+        self.config = config
+        self.images_dir = Path(config.output_dir)
+        self.log = log or (lambda message, color="black": None)
+        self.progress = progress or (lambda done, total: None)
+        self.result = SyncResult()
+        self._lock = threading.Lock()
+        self.manifest = None
+        self.session = None
+        self.image_map = {}
+        self._inflight = {}
+        self.metrics = Metrics()
+        self.api_bucket = TokenBucket(config.api_rate)
+        available = supported_formats()
+        self.formats = [fmt for fmt in config.formats if fmt in available]
+        for fmt in config.formats:
+            if fmt not in available:
+                self.log(f"⚠️ Formato '{fmt}' no disponible en esta instalación de Pillow; se omite", "orange")
+        if not self.formats:
+            raise SyncConfigError(f"Ninguno de los formatos {list(config.formats)} está disponible")
+        if config.pool_size is not None and config.pool_size < 1:
+            raise SyncConfigError(f"El tamaño del pool de conexiones debe ser al menos 1: {config.pool_size}")
+        if config.connect_timeout <= 0 or config.read_timeout <= 0:
+            raise SyncConfigError(
+                f"Los timeouts deben ser positivos: conexión {config.connect_timeout}, lectura {config.read_timeout}"
+            )
+        self.pool_size = config.pool_size or config.workers
+        self.timeout = (config.connect_timeout, config.read_timeout)
+
+    def run(self):
+        self._start()
+        # One pooled HTTP session for every image download
+        self.session = create_session(pool_size=self.pool_size)
+        self.image_limiter = AdaptiveLimiter(self.image_limits, TokenBucket(self.config.image_rate))
+        try:
+            client = create_client(self.config)
+            self._process_items(client)
+            return self._finish()
+        finally:
+            self.session.close()
+            self._close()
+
+    def _start(self):
+        self.images_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest = Manifest(self.images_dir / MANIFEST_NAME, self.images_dir / JOURNAL_NAME)
+        if self.manifest.resumed:
+            self.log(f"Reanudando la sincronización interrumpida: {self.manifest.resumed} imágenes ya completadas")
+        self.incoming_dir = self.images_dir / INCOMING_DIR_NAME
+        self.incoming_dir.mkdir(exist_ok=True)
+        # Leftovers of a run that was killed: spilled downloads and temp files
+        # that never got renamed into place
+        remove_temp_files(self.incoming_dir, '*.part')
+        remove_temp_files(self.images_dir)
+        self.memory_budget = MemoryBudget(self.config.memory_budget_mb * 1024 * 1024)
+        self.store = ContentStore(
+            self.images_dir / STORE_DIR_NAME,
+            [(width, fmt) for width in self.config.sizes for fmt in self.formats],
+            self.config.quality,
+            self.config.max_size
+        )
+        self.store.remove_temp_files()
+        self.image_limits = self._image_limits()
+
+    def _image_limits(self):
+        """AIMD controller for image fetches: starts at half of workers and may reach all of them."""
+        workers = self.config.workers
+        if not self.config.adaptive:
+            return AIMDController(workers, minimum=workers, maximum=workers)
+        return AIMDController(max(1, workers // 2), maximum=workers)
+
+    def _finish(self):
+        self.result.files = sorted(
+            file.name for fmt in self.formats for file in self.images_dir.glob(f'*.{fmt}')
+        )
+        return self.result
+
+    def _close(self):
+        # Keep whatever was synced, even after an error
+        self.manifest.save()
+        self._export_metrics()
+
+    def _export_metrics(self):
+        """Attach the run's metrics to the result and write them to disk."""
+        for counter in ('total_items', 'processed_items', 'saved_images', 'unchanged_images',
+                        'deduplicated_images', 'failed_images'):
+            self.metrics.inc(counter, getattr(self.result, counter))
+        self.metrics.set('image_concurrency_limit', self.image_limits.limit)
+        self.metrics.inc('concurrency_decreases', self.image_limits.decreases)
+        self.result.metrics = self.metrics.summary()
+        try:
+            self.metrics.write_json(self.config.metrics_path or self.images_dir / METRICS_NAME)
+            if self.config.prometheus_path:
+                self.metrics.write_prometheus(self.config.prometheus_path)
+        except OSError as e:
+            self.log(f"⚠️ No se pudieron guardar las métricas: {e}", "orange")
+
+    def _items_query(self):
+        """Item search body with every configured filter the endpoint supports."""
+        query = {"limit": ITEMS_PAGE_SIZE}
+        if self.config.product_types:
+            query["product_types"] = list(self.config.product_types)
+        if self.config.category_ids:
+            query["category_ids"] = list(self.config.category_ids)
+        if self.config.location_ids:
+            query["enabled_location_ids"] = list(self.config.location_ids)
+        return query
+
+    def _describe_filters(self):
+        parts = [', '.join(self.config.product_types) if self.config.product_types else "todos los tipos"]
+        if self.config.category_ids:
+            parts.append(f"{len(self.config.category_ids)} categorías")
+        if self.config.location_ids:
+            parts.append(f"{len(self.config.location_ids)} ubicaciones")
+        if self.config.updated_since:
+            parts.append(f"modificados desde {self.config.updated_since.isoformat()}")
+        return '; '.join(parts)
+
+    def _lookup_images(self, client, items):
+        """Fetch URL and version of the images these items reference and are not known yet.
+
+        Only referenced images are retrieved (in batches), instead of listing
+        every image object in the account.
+        """
+        wanted = list(dict.fromkeys(
+            img_id for item in items for img_id in item['item_data'].get('image_ids', [])
+            if img_id not in self.image_map
+        ))
+        for start in range(0, len(wanted), IMAGES_BATCH_SIZE):
+            page = call_catalog(
+                client.catalog.batch_retrieve_catalog_objects,
+                {"object_ids": wanted[start:start + IMAGES_BATCH_SIZE], "include_related_objects": False},
+                "imágenes",
+                self.metrics,
+                self.api_bucket,
+                stage='catalog_images'
+            )
+            self._add_images(page)
+
+    def _add_images(self, images_page):
+        self.image_map.update(
+            (img['id'], {'url': img['image_data']['url'], 'version': img.get('version')})
+            for img in images_page.get('objects', [])
+            if img.get('type') == 'IMAGE'
+        )
+
+    def _process_items(self, client):
+        # Stream the matching items page by page into the pool, looking up
+        # just the images each page references, so downloads start with the
+        # first page. The semaphores bound how
+        # many items and encodes are queued at once so memory does not grow with
+        # the catalog. Downloads run on threads and WebP encoding on a separate
+        # process pool so it scales with cores; spawn avoids forking a process
+        # that already runs other threads.
+        workers, encoders = self.config.workers, self.config.encoders
+        self.log(f"Buscando productos ({self._describe_filters()})...")
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._encode_slots = threading.BoundedSemaphore(encoders * 2)
+        with ProcessPoolExecutor(max_workers=encoders, mp_context=multiprocessing.get_context('spawn')) as encoder, \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix="square-dl") as executor:
+            self._encoder = encoder
+            for items_page in paginate(
+                client.catalog.search_catalog_items, self._items_query(), "productos", self.metrics, self.api_bucket
+            ):
+                items = self._add_items(items_page)
+                self._lookup_images(client, items)
+                for item in items:
+                    # Names are claimed here, in catalog order, so collisions
+                    # resolve the same way no matter which download finishes first
+                    names = self._claim_names(item)
+                    self._slots.acquire()
+                    executor.submit(self._process_item, item, names).add_done_callback(self._item_done)
+
+    def _add_items(self, items_page):
+        items = items_page.get('items', [])
+        since = self.config.updated_since
+        if since is not None:
+            # Items without updated_at are kept, to be safe
+            fresh = [item for item in items if not item.get('updated_at') or parse_timestamp(item['updated_at']) >= since]
+            if len(fresh) < len(items):
+                self.log(f"Omitidos {len(items) - len(fresh)} productos sin cambios desde {since.isoformat()}")
+            items = fresh
+        with self._lock:
+            self.result.total_items += len(items)
+        self.log(f"Encontrados {len(items)} productos más para procesar ({self.result.total_items} en total)")
+        return items
+
+    def _claim_names(self, item):
+        """Output base name for each image of an item: ``name``, ``name_2``..."""
+        base_name = safe_filename(item['item_data']['name'])
+        image_ids = item['item_data'].get('image_ids', [])
+        return [
+            self.manifest.claim_name(base_name if index == 0 else f'{base_name}_{index + 1}', f"{item['id']}/{img_id}")
+            for index, img_id in enumerate(image_ids)
+        ]
+
+    def _process_item(self, item, names):
+        # Get the item name and image IDs
+        item_name = item['item_data']['name']
+        image_ids = item['item_data'].get('image_ids', [])
+
+        encodes = []
+
+        if not image_ids:
+            self.log(f"El producto '{item_name}' no tiene imágenes asociadas", "orange")
+
+        # Process each image ID for this item
+        for img_id, base_name in zip(image_ids, names):
+            if img_id not in self.image_map:
+                self.log(f"⚠️ ID de imagen {img_id} no encontrado para '{item_name}'", "orange")
+                continue
+
+            # Get the image URL and catalog version
+            image = self.image_map[img_id]
+            image_url = image['url']
+
+            # Output file names, one per size and format
+            output_paths = self._output_paths(base_name)
+
+            try:
+                if self._reuse(img_id, image, output_paths):
+                    continue
+
+                # Download the image, revalidating against the CDN when the
+                # store still has the encodes of the previous copy
+                entry, headers = self._revalidation(img_id)
+                previous_digest = entry.get('sha256')
+                self.log(f"Descargando imagen para '{item_name}'...", "blue")
+                started = time.perf_counter()
+                response, spooled = self._fetch(image_url, headers)
+
+                if spooled is None:
+                    self.metrics.inc('cdn_not_modified')
+                    self._link(img_id, image, previous_digest, output_paths, entry, 'unchanged_images')
+                    continue
+
+                self.metrics.inc('bytes_downloaded', spooled.size)
+                validators = {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified')
+                }
+                encode, owner = self._encode_once(spooled)
+                if not owner:
+                    spooled.discard(self.memory_budget)
+                if encode is None:
+                    self._link(img_id, image, spooled.digest, output_paths, validators, 'deduplicated_images')
+                    self.metrics.observe('image', time.perf_counter() - started)
+                    continue
+                encode.add_done_callback(self._encode_done_callback(
+                    img_id, item_name, image, spooled.digest, output_paths, validators, owner, started
+                ))
+                encodes.append(encode)
+
+            except requests.RequestException as e:
+                self._count('failed_images')
+                self.log(f"❌ Error al descargar imagen para '{item_name}': {e}", "red")
+            except Exception as e:
+                self._count('failed_images')
+                self.log(f"❌ Error al procesar imagen para '{item_name}': {e}", "red")
+
+        return encodes
+
+    def _fetch(self, url, headers):
+        """GET an image within the adaptive concurrency limit.
+
+        Returns the response and its body spooled within the memory budget,
+        or None for a 304. The time to the response headers and whether the
+        server throttled along the way feed the AIMD controller. The wait for
+        a slot is recorded as queue_wait, separately from cdn_fetch.
+        """
+        queued = time.perf_counter()
+        self.image_limiter.acquire()
+        started = time.perf_counter()
+        self.metrics.observe('queue_wait', started - queued)
+        latency, throttled = None, False
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+            latency = time.perf_counter() - started
+            # urllib3 retries 429/503 on its own; its history tells whether it had to
+            retries = getattr(response.raw, 'retries', None)
+            throttled = response.status_code in THROTTLE_STATUSES or any(
+                attempt.status in THROTTLE_STATUSES for attempt in (retries.history if retries else ())
+            )
+            if response.status_code == 304 or response.status_code >= 400:
+                response.close()
+            response.raise_for_status()  # Raise an exception for bad status codes
+            if response.status_code == 304:
+                return response, None
+            # Stream the body within the memory budget, hashing it on the way
+            return response, spool_download(response, self.memory_budget, self.incoming_dir)
+        except requests.Timeout:
+            throttled = True
+            raise
+        finally:
+            self.metrics.observe('cdn_fetch', time.perf_counter() - started)
+            if throttled:
+                self.metrics.inc('throttled_responses')
+            self.image_limiter.release(latency, throttled)
+
+    def _output_paths(self, base_name):
+        return [self.images_dir / variant_filename(base_name, width, fmt) for width, fmt in self.store.variants]
+
+    def _reuse(self, img_id, image, output_paths):
+        """Handle images that need no download; returns True when nothing is left to do."""
+        # Skip images that did not change since the last sync
+        if self.manifest.is_current(img_id, image, output_paths, self.store.profile):
+            self._count('unchanged_images')
+            return True
+        # Same image already encoded for another item or a previous name
+        digest = self.manifest.known_digest(img_id, image)
+        if self.store.has(digest):
+            self._link(img_id, image, digest, output_paths, self.manifest.get(img_id), 'deduplicated_images')
+            return True
+        return False
+
+    def _revalidation(self, img_id):
+        """Manifest entry of an image and the conditional headers worth sending for it."""
+        entry = self.manifest.get(img_id) or {}
+        headers = self.manifest.conditional_headers(img_id) if self.store.has(entry.get('sha256')) else {}
+        return entry, headers
+
+    def _encode_jobs(self, digest):
+        """(path, width, format) of every store file an encode of digest writes."""
+        return [(str(path), width, fmt) for path, (width, fmt) in zip(self.store.prepare(digest), self.store.variants)]
+
+    def _encode_once(self, spooled):
+        """Encode a download into the store unless its content is already there.
+
+        Returns (future, owner). The future is None when the store already
+        holds every variant; owner is False when another download of the same
+        bytes is already being encoded and the caller should share its future.
+        """
+        digest = spooled.digest
+        with self._lock:
+            shared = self._inflight.get(digest)
+            if shared is not None:
+                return shared, False
+            if self.store.has(digest):
+                return None, False
+            shared = Future()
+            self._inflight[digest] = shared
+
+        # Hand the image to the encoder pool and move on to the next download;
+        # the bounded slots apply backpressure when the encoders fall behind
+        self._encode_slots.acquire()
+        try:
+            encode = self._encoder.submit(
+                encode_variants,
+                spooled.source,
+                self._encode_jobs(digest),
+                self.config.quality,
+                self.config.max_size
+            )
+        except BaseException as e:
+            self._encode_slots.release()
+            spooled.discard(self.memory_budget)
+            with self._lock:
+                del self._inflight[digest]
+            shared.set_exception(e)
+            raise
+
+        def encode_done(future):
+            self._encode_slots.release()
+            spooled.discard(self.memory_budget)
+            with self._lock:
+                del self._inflight[digest]
+            if future.exception() is not None:
+                self.metrics.inc('encode_errors')
+                shared.set_exception(future.exception())
+            else:
+                for stage, seconds in future.result().items():
+                    self.metrics.observe(stage, seconds)
+                shared.set_result(future.result())
+
+        encode.add_done_callback(encode_done)
+        return shared, True
+
+    def _link(self, img_id, image, digest, output_paths, validators, counter):
+        """Point the item's output files at the stored encodes and record the image."""
+        with self.metrics.time('link'):
+            self.store.link(digest, output_paths)
+        self.manifest.record(
+            img_id,
+            url=image['url'],
+            version=image['version'],
+            etag=validators.get('etag'),
+            last_modified=validators.get('last_modified'),
+            sha256=digest,
+            profile=self.store.profile
+        )
+        self._count(counter)
+        names = ', '.join(path.name for path in output_paths)
+        if counter == 'saved_images':
+            self.log(f"✅ Imagen guardada como: {names}", "green")
+        elif counter == 'deduplicated_images':
+            self.log(f"♻️ Imagen ya convertida, enlazada como: {names}", "green")
+
+    def _encode_done_callback(self, img_id, item_name, image, digest, output_paths, validators, owner, started):
+        def encode_done(future):
+            if future.exception() is not None:
+                self._count('failed_images')
+                self.log(f"❌ Error al procesar imagen para '{item_name}': {future.exception()}", "red")
+                return
+            try:
+                self._link(
+                    img_id, image, digest, output_paths, validators,
+                    'saved_images' if owner else 'deduplicated_images'
+                )
+                # Download start to files in place, including the encoder queue
+                self.metrics.observe('image', time.perf_counter() - started)
+            except OSError as e:
+                self._count('failed_images')
+                self.log(f"❌ Error al guardar imagen para '{item_name}': {e}", "red")
+        return encode_done
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self.result, counter, getattr(self.result, counter) + 1)
+
+    def _finish_item(self):
+        with self._lock:
+            self.result.processed_items += 1
+            self.progress(self.result.processed_items, self.result.total_items)
+
+    def _item_done(self, future):
+        self._slots.release()
+        if future.exception() is not None:
+            self.log(f"❌ Error inesperado: {future.exception()}", "red")
+            self._finish_item()
+            return
+
+        # An item is done once its downloads and all of its encodes have finished
+        encodes = future.result()
+        if not encodes:
+            self._finish_item()
+            return
+        pending = [len(encodes)]
+
+        def encode_finished(_):
+            with self._lock:
+                pending[0] -= 1
+                last = pending[0] == 0
+            if last:
+                self._finish_item()
+
+        for encode in encodes:
+            encode.add_done_callback(encode_finished)
+
+
+def sync_images(config, log=None, progress=None):
+    """Sync every catalog image into ``config.output_dir`` and return a SyncResult.
+
+    Raises SquareAPIError if a catalog search fails.
+    """
+    return ImageSync(config, log=log, progress=progress).run()
+
+
+def parse_sizes(value):
+    """Parse ``200,600,original`` into (200, 600, None)."""
+    sizes = []
+    for part in value.split(','):
+        part = part.strip().lower()
+        if part in ('original', 'full'):
+            sizes.append(None)
+        elif part.isdigit() and int(part) > 0:
+            sizes.append(int(part))
+        else:
+            raise argparse.ArgumentTypeError(f"tamaño inválido: {part!r}")
+    return tuple(sizes)
+
+
+def parse_formats(value):
+    """Parse ``webp,avif`` into ('webp', 'avif')."""
+    formats = tuple(part.strip().lower() for part in value.split(',') if part.strip())
+    unknown = [fmt for fmt in formats if fmt not in OUTPUT_FORMATS]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(f"formato desconocido: {', '.join(unknown) or value!r}")
+    return formats
+
+
+def parse_list(value):
+    """Parse ``A,B`` into ('A', 'B'); ``all`` means no filter."""
+    parts = tuple(part.strip() for part in value.split(',') if part.strip())
+    return () if parts in ((), ('all',)) else parts
+
+
+def parse_since(value):
+    try:
+        return parse_timestamp(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"fecha inválida: {value!r}")
+
+
+def parse_args(argv=None):
+    default_output = Path(__file__).resolve().parent.parent / 'product_images'
+    parser = argparse.ArgumentParser(description="Descarga las imágenes del catálogo de Square y las convierte a WebP.")
+    parser.add_argument('--token', default=None,
+                        help="token de acceso de Square (por defecto SQUARE_ACCESS_TOKEN del entorno o de .env)")
+    parser.add_argument('--output', type=Path, default=default_output,
+                        help=f"directorio de salida (por defecto {default_output})")
+    parser.add_argument('--engine', choices=('threads', 'async'), default='threads',
+                        help="motor de descargas: hilos (por defecto) o asyncio con aiohttp")
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f"descargas simultáneas (por defecto SQUARE_DOWNLOAD_WORKERS o {DEFAULT_WORKERS}; "
+                             "con --engine async admite cientos)")
+    parser.add_argument('--product-types', type=parse_list, default=DEFAULT_PRODUCT_TYPES,
+                        help=f"tipos de producto separados por comas, o 'all' (por defecto {','.join(DEFAULT_PRODUCT_TYPES)})")
+    parser.add_argument('--categories', type=parse_list, default=(),
+                        help="solo productos de estas categorías (IDs de Square separados por comas)")
+    parser.add_argument('--locations', type=parse_list, default=(),
+                        help="solo productos habilitados en estas ubicaciones (IDs separados por comas)")
+    parser.add_argument('--updated-since', type=parse_since, default=None,
+                        help="solo productos modificados desde esta fecha (ej. 2024-06-01 o 2024-06-01T08:00:00Z)")
+    parser.add_argument('--api-rate', type=float, default=DEFAULT_API_RATE,
+                        help=f"llamadas por segundo al catálogo de Square (por defecto {DEFAULT_API_RATE})")
+    parser.add_argument('--image-rate', type=float, default=None,
+                        help="imágenes por segundo pedidas al CDN (por defecto sin límite)")
+    parser.add_argument('--pool-size', type=int, default=None,
+                        help="conexiones HTTP abiertas al CDN (por defecto una por cada descarga de --workers)")
+    parser.add_argument('--connect-timeout', type=float, default=HTTP_TIMEOUT[0],
+                        help=f"segundos para conectar con el CDN antes de reintentar (por defecto {HTTP_TIMEOUT[0]})")
+    parser.add_argument('--read-timeout', type=float, default=HTTP_TIMEOUT[1],
+                        help=f"segundos sin recibir datos antes de reintentar una descarga (por defecto {HTTP_TIMEOUT[1]})")
+    parser.add_argument('--no-adaptive', dest='adaptive', action='store_false',
+                        help="usa siempre --workers descargas en lugar de ajustarlas según las respuestas del CDN")
+    parser.add_argument('--encoders', type=int, default=env_int('SQUARE_ENCODE_WORKERS', DEFAULT_ENCODERS),
+                        help="procesos de conversión a WebP")
+    parser.add_argument('--quality', type=int, default=WEBP_QUALITY, help="calidad de codificación (0-100)")
+    parser.add_argument('--max-size', type=int, default=None,
+                        help="lado máximo en píxeles; reduce la imagen al decodificarla (por defecto tamaño original)")
+    parser.add_argument('--sizes', type=parse_sizes, default=(None,),
+                        help="anchos a generar separados por comas, 'original' para el tamaño completo (ej. 200,600,1200,original)")
+    parser.add_argument('--formats', type=parse_formats, default=('webp',),
+                        help=f"formatos de salida separados por comas ({', '.join(OUTPUT_FORMATS)}); por defecto webp")
+    parser.add_argument('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help=f"MB de imágenes descargadas en memoria; el resto va a disco (por defecto {DEFAULT_MEMORY_BUDGET_MB})")
+    parser.add_argument('--metrics-json', type=Path, default=None,
+                        help=f"archivo JSON con las métricas por etapa (por defecto {METRICS_NAME} en el directorio de salida)")
+    parser.add_argument('--prometheus', type=Path, default=None,
+                        help="escribe también las métricas en formato Prometheus (textfile collector de node_exporter)")
+    parser.add_argument('--quiet', action='store_true', help="solo muestra errores y el resumen final")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    token = args.token
+    if token is None:
+        # Same lookup as the GUI: the .env file next to the square/ directory
+        env_file = Path(__file__).resolve().parent.parent / '.env'
+        if env_file.exists():
+            from dotenv import load_dotenv
+            load_dotenv(env_file)
+        token = os.getenv('SQUARE_ACCESS_TOKEN', '')
+    if not token:
+        print("Error: token no proporcionado (usa --token o SQUARE_ACCESS_TOKEN)", file=sys.stderr)
+        return 2
+
+    print_lock = threading.Lock()
+
+    def log(message, color="black"):
+        if args.quiet and color != "red":
+            return
+        with print_lock:
+            print(message, file=sys.stderr if color == "red" else sys.stdout, flush=True)
+
+    if args.engine == 'async':
+        import asyncio
+        from square_sync_async import DEFAULT_ASYNC_WORKERS, sync_images_async
+        default_workers = DEFAULT_ASYNC_WORKERS
+    else:
+        default_workers = DEFAULT_WORKERS
+    workers = args.workers or env_int('SQUARE_DOWNLOAD_WORKERS', default_workers)
+
+    config = SyncConfig(
+        token=token,
+        output_dir=args.output,
+        workers=max(1, workers),
+        encoders=max(1, args.encoders),
+        quality=args.quality,
+        max_size=args.max_size,
+        sizes=args.sizes,
+        formats=args.formats,
+        memory_budget_mb=max(1, args.memory_budget),
+        product_types=args.product_types,
+        category_ids=args.categories,
+        location_ids=args.locations,
+        updated_since=args.updated_since,
+        api_rate=args.api_rate,
+        image_rate=args.image_rate,
+        adaptive=args.adaptive,
+        metrics_path=args.metrics_json,
+        prometheus_path=args.prometheus,
+        pool_size=args.pool_size,
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout
+    )
+    try:
+        if args.engine == 'async':
+            # Ctrl+C cancels the run; finished images stay in the manifest
+            result = asyncio.run(sync_images_async(config, log=log))
+        else:
+            result = sync_images(config, log=log)
+    except KeyboardInterrupt:
+        log("Sincronización cancelada", "red")
+        return 130
+    except SquareAPIError as e:
+        log(str(e), "red")
+        return 1
+    except SyncConfigError as e:
+        log(f"Error: {e}", "red")
+        return 2
+
+    print(
+        f"Completado: {result.processed_items}/{result.total_items} productos, "
+        f"{result.saved_images} imágenes guardadas, {result.unchanged_images} sin cambios, "
+        f"{result.failed_images} errores. Archivos en {config.output_dir}"
+    )
+    if not args.quiet:
+        for stage, timing in result.metrics.get('stages', {}).items():
+            print(f"  {stage:<15} n={timing['count']:<6} p50={timing['p50'] * 1000:.1f}ms "
+                  f"p95={timing['p95'] * 1000:.1f}ms p99={timing['p99'] * 1000:.1f}ms")
+    return 1 if result.failed_images else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,384 @@
+"""asyncio engine for the Square catalog image sync.
+
+Produces the same files, manifest and content store as ImageSync, but the
+fetch side runs on a single event loop: catalog pages come from the blocking
+Square SDK through asyncio.to_thread, images stream through aiohttp with a
+semaphore bounding the requests in flight, and encodes hop to the process
+pool with run_in_executor. An in-flight request costs a coroutine and a
+socket instead of a thread, and cancelling the task stops the run cleanly.
+
+Progress is pushed as SyncEvent objects that a UI or CLI consumes:
+
+    async for event in AsyncImageSync(config).events():
+        if event.kind == 'log':
+            print(event.message)
+"""
+
+import asyncio
+import contextlib
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import aiohttp
+
+from rate_limit import AsyncAdaptiveLimiter, FairScheduler, TokenBucket
+from square_sync import (
+    DOWNLOAD_CHUNK_SIZE,
+    HTTP_RETRIES,
+    RETRY_STATUSES,
+    THROTTLE_STATUSES,
+    ImageSync,
+    MemoryBudget,
+    Spooler,
+    SyncResult,
+    create_client,
+    encode_variants,
+    paginate,
+    retry_delay,
+)
+
+# Concurrent image requests for the async engine when none are configured;
+# they are cheap here, so the default is well above the threaded engine's
+DEFAULT_ASYNC_WORKERS = 32
+
+
+@dataclass
+class SyncEvent:
+    """Something that happened during a sync: a log line, progress or the end of the run."""
+
+    kind: str  # 'log', 'progress' or 'done'
+    message: str = ''
+    color: str = 'black'
+    done: int = 0
+    total: int = 0
+    result: SyncResult = None
+
+
+@dataclass
+class SharedResources:
+    """Budgets shared by several AsyncImageSync runs in one process (see batch_sync.py).
+
+    The encoder pool and memory budget replace the per-run ones; every image
+    request also takes a slot from the fair scheduler, and its bytes are
+    paced by the bandwidth bucket.
+    """
+
+    encoder: ProcessPoolExecutor
+    memory_budget: MemoryBudget
+    scheduler: FairScheduler
+    bandwidth: TokenBucket
+
+
+async def apaginate(search, body, resource, metrics=None, bucket=None):
+    """Async version of paginate(); each blocking SDK call runs in a worker thread."""
+    pages = paginate(search, body, resource, metrics, bucket)
+    while True:
+        page = await asyncio.to_thread(next, pages, None)
+        if page is None:
+            return
+        yield page
+
+
+class AsyncImageSync(ImageSync):
+    """One sync run on an event loop; see the module docstring.
+
+    name identifies the run in the fair scheduler of shared resources.
+    """
+
+    def __init__(self, config, shared=None, name=None):
+        self._events = asyncio.Queue()
+        super().__init__(config, log=self._emit_log, progress=self._emit_progress)
+        self.shared = shared
+        self.name = name or str(config.output_dir)
+        self.http = None
+        self._encoder = None
+        self._bandwidth = shared.bandwidth if shared is not None else TokenBucket(None)
+
+    def _emit_log(self, message, color="black"):
+        self._events.put_nowait(SyncEvent('log', message=message, color=color))
+
+    def _emit_progress(self, done, total):
+        self._events.put_nowait(SyncEvent('progress', done=done, total=total))
+
+    async def events(self):
+        """Run the sync, yielding its events; the last one has kind 'done' and the result.
+
+        Errors of the run (e.g. SquareAPIError) are raised from here. Closing
+        the generator or cancelling its consumer cancels the run.
+        """
+        task = asyncio.create_task(self.run())
+        try:
+            while (event := await self._events.get()) is not None:
+                yield event
+            yield SyncEvent('done', result=await task)
+        finally:
+            if not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+    async def run(self):
+        try:
+            return await self._run()
+        finally:
+            # Ends the event stream, even when the run failed or was cancelled
+            self._events.put_nowait(None)
+
+    async def _run(self):
+        self._start()
+        if self.shared is not None:
+            self._encoder = self.shared.encoder
+            self.memory_budget = self.shared.memory_budget
+        else:
+            # Spawn avoids forking a process whose event loop already runs threads
+            self._encoder = ProcessPoolExecutor(
+                max_workers=self.config.encoders, mp_context=multiprocessing.get_context('spawn')
+            )
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as self.http:
+                client = create_client(self.config)
+                await self._process_items_async(client)
+            return self._finish()
+        finally:
+            # Queued encodes are dropped but running ones finish, so a
+            # cancelled run leaves no half-written file in the store. A
+            # shared pool belongs to whoever created it.
+            if self.shared is None:
+                await asyncio.to_thread(self._encoder.shutdown, True, cancel_futures=True)
+            self._close()
+
+    async def _process_items_async(self, client):
+        # Items are started as their catalog page arrives, once the images
+        # it references are looked up. The adaptive
+        # limiter bounds concurrent downloads, the encode semaphore the
+        # images waiting for the pool, and the item slots how many items are
+        # open at once, so memory does not grow with the catalog.
+        workers, encoders = self.config.workers, self.config.encoders
+        self.log(f"Buscando productos ({self._describe_filters()})...")
+        self.image_limiter = AsyncAdaptiveLimiter(self.image_limits, TokenBucket(self.config.image_rate))
+        self._encode_slots = asyncio.Semaphore(encoders * 2)
+        slots = asyncio.Semaphore(workers + encoders * 2)
+        tasks = set()
+
+        def item_done(task):
+            tasks.discard(task)
+            slots.release()
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                self.log(f"❌ Error inesperado: {task.exception()}", "red")
+            self._finish_item()
+
+        try:
+            async for items_page in apaginate(
+                client.catalog.search_catalog_items, self._items_query(), "productos", self.metrics, self.api_bucket
+            ):
+                items = self._add_items(items_page)
+                await asyncio.to_thread(self._lookup_images, client, items)
+                for item in items:
+                    names = self._claim_names(item)
+                    await slots.acquire()
+                    task = asyncio.create_task(self._process_item_async(item, names))
+                    tasks.add(task)
+                    task.add_done_callback(item_done)
+            while tasks:
+                await asyncio.wait(set(tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def _process_item_async(self, item, names):
+        item_name = item['item_data']['name']
+        image_ids = item['item_data'].get('image_ids', [])
+        encodes = []
+
+        if not image_ids:
+            self.log(f"El producto '{item_name}' no tiene imágenes asociadas", "orange")
+
+        for img_id, base_name in zip(image_ids, names):
+            if img_id not in self.image_map:
+                self.log(f"⚠️ ID de imagen {img_id} no encontrado para '{item_name}'", "orange")
+                continue
+
+            image = self.image_map[img_id]
+            output_paths = self._output_paths(base_name)
+
+            try:
+                if self._reuse(img_id, image, output_paths):
+                    continue
+
+                entry, headers = self._revalidation(img_id)
+                self.log(f"Descargando imagen para '{item_name}'...", "blue")
+                started = time.perf_counter()
+                status, response_headers, spooled = await self._download(image['url'], headers)
+
+                if status == 304:
+                    self.metrics.inc('cdn_not_modified')
+                    self._link(img_id, image, entry.get('sha256'), output_paths, entry, 'unchanged_images')
+                    continue
+
+                self.metrics.inc('bytes_downloaded', spooled.size)
+                validators = {
+                    'etag': response_headers.get('ETag'),
+                    'last_modified': response_headers.get('Last-Modified')
+                }
+                # Encodes run while the item moves on to its next image
+                encodes.append(asyncio.create_task(self._encode_and_link(
+                    img_id, item_name, image, spooled, output_paths, validators, started
+                )))
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._count('failed_images')
+                self.log(f"❌ Error al descargar imagen para '{item_name}': {e}", "red")
+            except Exception as e:
+                self._count('failed_images')
+                self.log(f"❌ Error al procesar imagen para '{item_name}': {e}", "red")
+
+        try:
+            await asyncio.gather(*encodes)
+        except BaseException:
+            for encode in encodes:
+                encode.cancel()
+            raise
+
+    async def _download(self, url, headers):
+        """GET an image with the retry policy of the threaded engine.
+
+        Each attempt holds a slot of the adaptive limiter; its time to the
+        response headers and any throttling feed the AIMD controller. The
+        wait for the limiter and shared slots is recorded as queue_wait,
+        separately from cdn_fetch.
+        Returns (status, headers, spooled); spooled is None for a 304.
+        """
+        for attempt in range(HTTP_RETRIES + 1):
+            retry_after = None
+            queued = time.perf_counter()
+            await self.image_limiter.acquire()
+            latency, throttled, started = None, False, None
+            try:
+                # Only the request itself is timed, not the wait for a shared slot
+                async with self._shared_slot():
+                    started = time.perf_counter()
+                    self.metrics.observe('queue_wait', started - queued)
+                    async with self.http.get(url, headers=headers) as response:
+                        latency = time.perf_counter() - started
+                        throttled = response.status in THROTTLE_STATUSES
+                        if response.status in RETRY_STATUSES and attempt < HTTP_RETRIES:
+                            retry_after = response.headers.get('Retry-After')
+                        else:
+                            response.raise_for_status()
+                            if response.status == 304:
+                                return response.status, response.headers, None
+                            spooler = Spooler(self.memory_budget, self.incoming_dir, response.content_length or 0)
+                            try:
+                                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                                    spooler.write(chunk)
+                                    await self._bandwidth.wait_async(len(chunk))
+                            except BaseException:
+                                spooler.abort()
+                                raise
+                            return response.status, response.headers, spooler.finish()
+            except asyncio.TimeoutError:
+                throttled = True
+                if attempt == HTTP_RETRIES:
+                    raise
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError):
+                if attempt == HTTP_RETRIES:
+                    raise
+            finally:
+                if started is not None:
+                    self.metrics.observe('cdn_fetch', time.perf_counter() - started)
+                if throttled:
+                    self.metrics.inc('throttled_responses')
+                await self.image_limiter.release(latency, throttled)
+            await asyncio.sleep(retry_delay(attempt, retry_after))
+
+    @contextlib.asynccontextmanager
+    async def _shared_slot(self):
+        """Hold a slot of the shared fair scheduler, if any, for one request."""
+        if self.shared is None:
+            yield
+            return
+        await self.shared.scheduler.acquire(self.name)
+        try:
+            yield
+        finally:
+            self.shared.scheduler.release()
+
+    async def _encode_and_link(self, img_id, item_name, image, spooled, output_paths, validators, started):
+        try:
+            owner = await self._encode_once_async(spooled)
+            self._link(
+                img_id, image, spooled.digest, output_paths, validators,
+                'saved_images' if owner else 'deduplicated_images'
+            )
+            # Download start to files in place, including the encoder queue
+            self.metrics.observe('image', time.perf_counter() - started)
+        except Exception as e:
+            self._count('failed_images')
+            self.log(f"❌ Error al procesar imagen para '{item_name}': {e}", "red")
+
+    async def _encode_once_async(self, spooled):
+        """Encode a download into the store unless its content is already there.
+
+        Returns True when this call did the encode, False when the store or
+        another download of the same bytes provided it.
+        """
+        digest = spooled.digest
+        shared = self._inflight.get(digest)
+        if shared is not None or self.store.has(digest):
+            spooled.discard(self.memory_budget)
+            if shared is not None:
+                await asyncio.shield(shared)
+            return False
+
+        loop = asyncio.get_running_loop()
+        shared = self._inflight[digest] = loop.create_future()
+        # Nobody may be waiting on it; mark an error as retrieved
+        shared.add_done_callback(lambda future: future.cancelled() or future.exception())
+        try:
+            async with self._encode_slots:
+                timings = await loop.run_in_executor(
+                    self._encoder,
+                    encode_variants,
+                    spooled.source,
+                    self._encode_jobs(digest),
+                    self.config.quality,
+                    self.config.max_size
+                )
+        except asyncio.CancelledError:
+            shared.cancel()
+            raise
+        except Exception as e:
+            self.metrics.inc('encode_errors')
+            shared.set_exception(e)
+            raise
+        finally:
+            del self._inflight[digest]
+            spooled.discard(self.memory_budget)
+        for stage, seconds in timings.items():
+            self.metrics.observe(stage, seconds)
+        shared.set_result(True)
+        return True
+
+
+async def sync_images_async(config, log=None, progress=None):
+    """Run the async engine, forwarding its events to log/progress callbacks.
+
+    Returns the SyncResult; cancelling the awaiting task cancels the sync.
+    """
+    async for event in AsyncImageSync(config).events():
+        if event.kind == 'log' and log is not None:
+            log(event.message, event.color)
+        elif event.kind == 'progress' and progress is not None:
+            progress(event.done, event.total)
+        elif event.kind == 'done':
+            return event.result
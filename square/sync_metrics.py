@@ -0,0 +1,154 @@
+"""Per-stage counters, histograms and timings for the Square image sync.
+
+The engine records how long each phase takes (catalog search, CDN fetch,
+Pillow decode, encode, disk write...) into a Metrics object. At the end of a
+run the numbers are exported as a JSON summary and, optionally, in the
+Prometheus text format for node_exporter's textfile collector.
+"""
+
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from atomic_files import write_atomic_bytes
+
+# Histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+# Prefix of every exported Prometheus metric
+PROMETHEUS_PREFIX = 'square_sync'
+
+
+class Histogram:
+    """Cumulative-bucket histogram that also keeps the exact count, sum, min and max."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation inside its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                upper = self.max if math.isinf(bound) else bound
+                estimate = lower + (upper - lower) * (rank - seen) / count
+                return min(max(estimate, self.min), self.max)
+            seen += count
+            lower = bound
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': round(self.total, 6),
+            'mean': round(self.total / self.count, 6) if self.count else 0.0,
+            'min': round(self.min, 6) if self.count else 0.0,
+            'max': round(self.max, 6),
+            'p50': round(self.quantile(0.50), 6),
+            'p95': round(self.quantile(0.95), 6),
+            'p99': round(self.quantile(0.99), 6),
+        }
+
+
+class Metrics:
+    """Thread-safe registry of counters and per-stage timing histograms."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.started = time.time()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def summary(self):
+        with self._lock:
+            return {
+                'started_at': self.started,
+                'wall_seconds': round(time.time() - self.started, 3),
+                'counters': dict(sorted(self._counters.items())),
+                'gauges': dict(sorted(self._gauges.items())),
+                'stages': {stage: histogram.summary() for stage, histogram in sorted(self._histograms.items())},
+            }
+
+    def to_prometheus(self):
+        """Render counters and histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                metric = f'{PROMETHEUS_PREFIX}_{name}_total'
+                lines.append(f'# TYPE {metric} counter')
+                lines.append(f'{metric} {value}')
+            for name, value in sorted(self._gauges.items()):
+                metric = f'{PROMETHEUS_PREFIX}_{name}'
+                lines.append(f'# TYPE {metric} gauge')
+                lines.append(f'{metric} {value}')
+            metric = f'{PROMETHEUS_PREFIX}_stage_seconds'
+            if self._histograms:
+                lines.append(f'# HELP {metric} Time spent per sync stage.')
+                lines.append(f'# TYPE {metric} histogram')
+            for stage, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if math.isinf(bound) else repr(float(bound))
+                    lines.append(f'{metric}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram.total:.6f}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {histogram.count}')
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge')
+            lines.append(f'{PROMETHEUS_PREFIX}_last_run_timestamp_seconds {time.time():.0f}')
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path, extra=None):
+        summary = self.summary()
+        if extra:
+            summary.update(extra)
+        write_atomic_bytes(Path(path), json.dumps(summary, indent=2, default=str).encode('utf-8'))
+
+    def write_prometheus(self, path):
+        write_atomic_bytes(Path(path), self.to_prometheus().encode('utf-8'))
@@ -0,0 +1,101 @@
+"""Tests of the multi-merchant sync: the fair scheduler, the merchants file
+and a run of two merchants against the mock Square + CDN of benchmark_sync.
+"""
+
+import argparse
+import asyncio
+import json
+
+import pytest
+
+from batch_sync import Merchant, load_merchants, parse_merchant, sync_merchants
+from rate_limit import FairScheduler
+from square_sync import SyncConfig, SyncResult
+
+
+def test_fair_scheduler_hands_slots_out_round_robin():
+    order = []
+
+    async def main():
+        scheduler = FairScheduler(1)
+        await scheduler.acquire('setup')
+
+        async def request(client):
+            await scheduler.acquire(client)
+            order.append(client)
+            scheduler.release()
+
+        # The big merchant queues all of its requests before the small one
+        tasks = [asyncio.create_task(request('big')) for _ in range(4)]
+        tasks += [asyncio.create_task(request('small')) for _ in range(2)]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        assert scheduler.in_flight == 0
+
+    asyncio.run(main())
+
+    assert order == ['big', 'small', 'big', 'small', 'big', 'big']
+
+
+def test_uneven_merchants_sync_into_their_own_directories(make_catalog, serve, tmp_path):
+    small, big = make_catalog(2), make_catalog(8)
+    base_url = serve(big, catalogs={'token-centro': small, 'token-norte': big})
+    config = SyncConfig(token='', output_dir=tmp_path, workers=4, encoders=1, base_url=base_url)
+    merchants = [Merchant('Centro', 'token-centro'), Merchant('Norte Sur', 'token-norte')]
+
+    results = asyncio.run(sync_merchants(merchants, config, workers=3))
+
+    assert all(isinstance(result, SyncResult) for result in results.values()), results
+    assert results['Centro'].saved_images == 2
+    assert results['Norte Sur'].saved_images == 8
+    assert len(list((tmp_path / 'Centro').glob('*.webp'))) == 2
+    assert len(list((tmp_path / 'Norte_Sur').glob('*.webp'))) == 8
+    # Nothing lands in the base directory itself
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['Centro', 'Norte_Sur']
+
+
+def write_merchants(tmp_path, data):
+    path = tmp_path / 'merchants.json'
+    path.write_text(json.dumps(data), encoding='utf-8')
+    return path
+
+
+def test_load_merchants(tmp_path, monkeypatch):
+    monkeypatch.setenv('SQUARE_TOKEN_NORTE', 'tok-norte')
+    path = write_merchants(tmp_path, {'merchants': [
+        {'name': 'centro', 'token': 'tok-centro'},
+        {'name': 'norte', 'token_env': 'SQUARE_TOKEN_NORTE'},
+    ]})
+
+    assert load_merchants(path) == [Merchant('centro', 'tok-centro'), Merchant('norte', 'tok-norte')]
+
+
+@pytest.mark.parametrize('entry, message', [
+    ('centro', 'debe ser un objeto'),
+    (['centro', 'tok'], 'debe ser un objeto'),
+    ({'name': 'centro'}, 'no tiene token'),
+    ({'name': '???', 'token': 'tok'}, 'no sirve como nombre de carpeta'),
+    ({'name': '..', 'token': 'tok'}, 'no sirve como nombre de carpeta'),
+])
+def test_load_merchants_rejects_bad_entries(entry, message, tmp_path):
+    path = write_merchants(tmp_path, [entry])
+
+    with pytest.raises(ValueError, match=message):
+        load_merchants(path)
+
+
+def test_parse_merchant_rejects_unusable_names():
+    assert parse_merchant(' centro = tok ') == Merchant('centro', 'tok')
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_merchant('???=tok')
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_merchant('centro')
+
+
+def test_sync_merchants_rejects_names_sharing_a_directory(tmp_path):
+    config = SyncConfig(token='', output_dir=tmp_path)
+    merchants = [Merchant('Norte Sur', 'a'), Merchant('Norte, Sur', 'b')]
+
+    with pytest.raises(ValueError, match='mismo nombre'):
+        asyncio.run(sync_merchants(merchants, config, workers=1))
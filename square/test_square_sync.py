@@ -0,0 +1,293 @@
+"""Tests of the image sync: encoding, and end-to-end runs against the mock
+Square + CDN of benchmark_sync.
+
+    python -m pytest square
+"""
+
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+from datetime import datetime, timezone
+
+import pytest
+from PIL import Image
+from urllib3 import HTTPResponse
+
+import square_sync
+from benchmark_sync import fetch_json
+from square_sync import (
+    HTTP_TIMEOUT,
+    INCOMING_DIR_NAME,
+    JOURNAL_NAME,
+    MANIFEST_NAME,
+    MAX_RETRY_DELAY,
+    ImageSync,
+    SyncConfig,
+    create_session,
+    encode_variants,
+    main,
+    sync_images,
+)
+from square_sync_async import sync_images_async
+
+ITEMS = 6
+
+
+@pytest.fixture
+def catalog(make_catalog):
+    return make_catalog(ITEMS)
+
+
+@pytest.fixture
+def base_url(serve, catalog):
+    return serve(catalog)
+
+
+@pytest.fixture(params=['threads', 'async'])
+def engine(request):
+    """Each end-to-end test runs once per engine."""
+    return request.param
+
+
+def make_config(base_url, output_dir, **overrides):
+    settings = dict(token='test', output_dir=output_dir, workers=2, encoders=1, base_url=base_url)
+    settings.update(overrides)
+    return SyncConfig(**settings)
+
+
+def run_sync(config, engine='threads'):
+    """Run a sync with the given engine and return its result plus every log line."""
+    messages = []
+
+    def log(message, color="black"):
+        messages.append(message)
+
+    if engine == 'async':
+        result = asyncio.run(sync_images_async(config, log=log))
+    else:
+        result = sync_images(config, log=log)
+    return result, messages
+
+
+def api_bodies(base_url, path):
+    """Bodies of the API calls to path since the last reset."""
+    return [call['body'] for call in fetch_json(f'{base_url}/__stats')['api_bodies'] if call['path'].startswith(path)]
+
+
+def image_requests(base_url):
+    """Images the CDN served since the last call."""
+    served = fetch_json(f'{base_url}/__stats')['image_requests']
+    fetch_json(f'{base_url}/__reset')
+    return served
+
+
+def sync_then_die(config, after, engine):
+    """Sync until `after` items are done, then die without any cleanup, like a kill -9."""
+    def progress(done, total):
+        if done >= after:
+            os._exit(1)
+
+    if engine == 'async':
+        asyncio.run(sync_images_async(config, progress=progress))
+    else:
+        sync_images(config, progress=progress)
+
+
+def png_bytes(img):
+    buffer = io.BytesIO()
+    img.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def transparent_palette():
+    img = Image.new('P', (8, 6), 0)
+    img.putpalette([0, 0, 0, 200, 30, 30])
+    img.putpixel((0, 0), 1)
+    img.info['transparency'] = 0
+    return img
+
+
+@pytest.mark.parametrize('source, background', [
+    (Image.new('RGBA', (8, 6), (200, 30, 30, 0)), (255, 255, 255)),
+    (Image.new('LA', (8, 6), (40, 0)), (255, 255, 255)),
+    (transparent_palette(), (255, 255, 255)),
+    (Image.new('I;16', (8, 6), 0), (0, 0, 0)),
+], ids=['RGBA', 'LA', 'P-transparency', 'I;16'])
+def test_jpeg_variants_are_flattened_onto_white(source, background, tmp_path):
+    jpg, webp = tmp_path / 'out.jpg', tmp_path / 'out.webp'
+
+    encode_variants(png_bytes(source), [(jpg, None, 'jpg'), (webp, None, 'webp')])
+
+    with Image.open(jpg) as img:
+        assert img.mode == 'RGB'
+        # JPEG is lossy: allow a little drift around the expected colour
+        assert all(abs(a - b) <= 3 for a, b in zip(img.getpixel((4, 4)), background))
+    with Image.open(webp) as img:
+        # Formats that can store alpha keep it
+        assert ('A' in img.mode) == ('A' in source.mode or 'transparency' in source.info)
+
+
+def test_session_caps_retry_after():
+    retry = create_session().get_adapter('https://cdn.example').max_retries
+
+    # The cap survives the copies urllib3 makes on every retry
+    retry = retry.new(total=retry.total - 1)
+    assert retry.get_retry_after(HTTPResponse(headers={'Retry-After': '3600'})) == MAX_RETRY_DELAY
+    assert retry.get_retry_after(HTTPResponse(headers={'Retry-After': '2'})) == 2
+    assert retry.get_retry_after(HTTPResponse()) is None
+
+
+@pytest.mark.parametrize('flags', [['--pool-size', '0'], ['--read-timeout', '0'], ['--formats', 'png', '--connect-timeout', '-1']])
+def test_main_rejects_bad_settings(flags, tmp_path):
+    assert main(['--token', 'test', '--output', str(tmp_path), *flags]) == 2
+    assert not list(tmp_path.iterdir())
+
+
+def test_main_does_not_hide_errors_of_the_run(monkeypatch, tmp_path):
+    def broken_sync(config, log=None):
+        raise ValueError("bug")
+
+    monkeypatch.setattr(square_sync, 'sync_images', broken_sync)
+
+    with pytest.raises(ValueError, match='bug'):
+        main(['--token', 'test', '--output', str(tmp_path)])
+
+
+def test_pool_size_and_timeouts(tmp_path):
+    sync = ImageSync(make_config(None, tmp_path, workers=5))
+    assert sync.pool_size == 5
+    assert sync.timeout == HTTP_TIMEOUT
+
+    sync = ImageSync(make_config(None, tmp_path, workers=5, pool_size=2, read_timeout=7))
+    assert sync.pool_size == 2
+    assert sync.timeout == (HTTP_TIMEOUT[0], 7)
+
+
+def test_interrupted_run_resumes(engine, base_url, tmp_path):
+    config = make_config(base_url, tmp_path)
+    context = multiprocessing.get_context('spawn')
+    crashed = context.Process(target=sync_then_die, args=(config, 2, engine))
+    crashed.start()
+    crashed.join(timeout=120)
+    assert crashed.exitcode == 1
+    # Whatever it finished is only in the journal
+    assert (tmp_path / JOURNAL_NAME).exists()
+    image_requests(base_url)
+
+    result, messages = run_sync(config, engine)
+
+    assert any('Reanudando' in message for message in messages)
+    assert result.failed_images == 0
+    assert result.unchanged_images >= 2
+    # Images encoded into the store but not yet linked when it died are
+    # downloaded again and linked to the existing encode
+    assert result.saved_images + result.deduplicated_images + result.unchanged_images == ITEMS
+    assert image_requests(base_url) == ITEMS - result.unchanged_images
+    assert len(result.files) == ITEMS
+    assert not list(tmp_path.glob('.*.tmp'))
+
+
+def test_incremental_rerun_reports_unchanged(engine, base_url, tmp_path):
+    config = make_config(base_url, tmp_path)
+    first, _ = run_sync(config, engine)
+    assert first.saved_images == ITEMS
+    image_requests(base_url)
+
+    second, _ = run_sync(config, engine)
+
+    assert second.unchanged_images == ITEMS
+    assert second.saved_images == 0
+    assert image_requests(base_url) == 0
+    assert second.files == first.files
+
+
+def test_quality_change_reencodes(engine, base_url, tmp_path):
+    run_sync(make_config(base_url, tmp_path, quality=90), engine)
+    before = (tmp_path / 'Producto_0.webp').stat().st_size
+
+    result, _ = run_sync(make_config(base_url, tmp_path, quality=20), engine)
+
+    assert result.saved_images == ITEMS
+    assert result.unchanged_images == 0
+    assert (tmp_path / 'Producto_0.webp').stat().st_size < before
+
+
+def test_colliding_names_get_distinct_files(engine, catalog, base_url, tmp_path):
+    catalog.items[0]['item_data']['name'] = 'Café, con leche'
+    catalog.items[1]['item_data']['name'] = 'Café con leche'
+    config = make_config(base_url, tmp_path)
+
+    first, _ = run_sync(config, engine)
+
+    assert first.saved_images == ITEMS
+    assert 'Café_con_leche.webp' in first.files
+    assert 'Café_con_leche-2.webp' in first.files
+    assert (tmp_path / 'Café_con_leche.webp').stat().st_ino != (tmp_path / 'Café_con_leche-2.webp').stat().st_ino
+
+    # Names stay with the item that got them first on later runs
+    second, _ = run_sync(config, engine)
+    assert second.unchanged_images == ITEMS
+    assert second.files == first.files
+
+
+def test_max_size_change_reencodes(engine, base_url, tmp_path):
+    run_sync(make_config(base_url, tmp_path), engine)
+
+    result, _ = run_sync(make_config(base_url, tmp_path, max_size=32), engine)
+
+    assert result.saved_images == ITEMS
+    assert result.unchanged_images == 0
+    with Image.open(tmp_path / 'Producto_0.webp') as img:
+        assert max(img.size) == 32
+
+
+def test_filters_reach_the_search_and_only_referenced_images_are_retrieved(engine, catalog, base_url, tmp_path):
+    catalog.items[1]['updated_at'] = '2025-03-01T00:00:00Z'
+    config = make_config(
+        base_url, tmp_path, product_types=['FOOD_AND_BEV'], category_ids=['CAT1', 'CAT2'], location_ids=['LOC1'],
+        updated_since=datetime(2025, 1, 1, tzinfo=timezone.utc)
+    )
+
+    result, _ = run_sync(config, engine)
+
+    (search,) = api_bodies(base_url, '/v2/catalog/search-catalog-items')
+    assert search['product_types'] == ['FOOD_AND_BEV']
+    assert search['category_ids'] == ['CAT1', 'CAT2']
+    assert search['enabled_location_ids'] == ['LOC1']
+    # updated_since is applied to the results, so only item 1 is left, and
+    # only its images are looked up
+    assert result.total_items == 1
+    retrieved = [image_id for body in api_bodies(base_url, '/v2/catalog/batch-retrieve') for image_id in body['object_ids']]
+    assert retrieved == catalog.items[1]['item_data']['image_ids']
+    assert result.files == ['Producto_1.webp']
+
+
+def test_async_cancel_saves_manifest_and_clears_incoming(catalog, base_url, tmp_path):
+    # Slow images, so items are still downloading when the run is cancelled
+    catalog.options.cdn_latency_ms = 200
+    config = make_config(base_url, tmp_path, workers=2)
+
+    async def cancel_after_first_item():
+        task = asyncio.current_task()
+
+        def progress(done, total):
+            if done >= 1:
+                task.cancel()
+
+        await sync_images_async(config, progress=progress)
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cancel_after_first_item())
+
+    manifest = json.loads((tmp_path / MANIFEST_NAME).read_text())
+    assert 1 <= len(manifest['images']) < ITEMS
+    assert not list((tmp_path / INCOMING_DIR_NAME).iterdir())
+    assert not list(tmp_path.glob('.*.tmp'))
+
+    # The next run keeps what the cancelled one finished
+    catalog.options.cdn_latency_ms = 0
+    result, _ = run_sync(config, 'async')
+    assert result.unchanged_images == len(manifest['images'])
+    assert result.saved_images + result.deduplicated_images + result.unchanged_images == ITEMS
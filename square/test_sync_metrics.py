@@ -0,0 +1,84 @@
+"""Unit tests of the per-stage histograms and their JSON and Prometheus exports."""
+
+import json
+
+import pytest
+
+from sync_metrics import Histogram, Metrics
+
+
+def test_histogram_buckets_and_summary():
+    histogram = Histogram(buckets=(0.1, 1, float('inf')))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    # Each value lands in the first bucket whose bound it does not exceed
+    assert histogram.counts == [2, 1, 1]
+    summary = histogram.summary()
+    assert summary['count'] == 4
+    assert summary['sum'] == pytest.approx(2.65)
+    assert summary['min'] == 0.05
+    assert summary['max'] == 2.0
+    assert 0.05 <= summary['p50'] <= 1
+    assert summary['p99'] <= 2.0
+
+
+def test_empty_histogram_summary():
+    assert Histogram().summary() == {
+        'count': 0, 'sum': 0.0, 'mean': 0.0, 'min': 0.0, 'max': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0
+    }
+
+
+def test_metrics_summary():
+    metrics = Metrics()
+    metrics.inc('saved_images')
+    metrics.inc('saved_images', 2)
+    metrics.set('image_concurrency_limit', 8)
+    with metrics.time('encode'):
+        pass
+    metrics.observe('cdn_fetch', 0.2)
+
+    summary = metrics.summary()
+
+    assert summary['counters'] == {'saved_images': 3}
+    assert summary['gauges'] == {'image_concurrency_limit': 8}
+    assert list(summary['stages']) == ['cdn_fetch', 'encode']
+    assert summary['stages']['cdn_fetch']['count'] == 1
+
+
+def test_prometheus_exposition_format():
+    metrics = Metrics(buckets=(0.1, 1, float('inf')))
+    metrics.inc('saved_images', 3)
+    metrics.set('image_concurrency_limit', 8)
+    for seconds in (0.05, 0.5, 0.7, 3.0):
+        metrics.observe('cdn_fetch', seconds)
+
+    lines = metrics.to_prometheus().splitlines()
+
+    assert '# TYPE square_sync_saved_images_total counter' in lines
+    assert 'square_sync_saved_images_total 3' in lines
+    assert '# TYPE square_sync_image_concurrency_limit gauge' in lines
+    assert 'square_sync_image_concurrency_limit 8' in lines
+    help_line = lines.index('# HELP square_sync_stage_seconds Time spent per sync stage.')
+    assert lines[help_line + 1] == '# TYPE square_sync_stage_seconds histogram'
+    # Buckets are cumulative and end with +Inf, which equals _count
+    assert [line for line in lines if line.startswith('square_sync_stage_seconds')] == [
+        'square_sync_stage_seconds_bucket{stage="cdn_fetch",le="0.1"} 1',
+        'square_sync_stage_seconds_bucket{stage="cdn_fetch",le="1.0"} 3',
+        'square_sync_stage_seconds_bucket{stage="cdn_fetch",le="+Inf"} 4',
+        'square_sync_stage_seconds_sum{stage="cdn_fetch"} 4.250000',
+        'square_sync_stage_seconds_count{stage="cdn_fetch"} 4',
+    ]
+    assert any(line.startswith('square_sync_last_run_timestamp_seconds ') for line in lines)
+
+
+def test_exports_are_written_in_place(tmp_path):
+    metrics = Metrics()
+    metrics.observe('encode', 0.01)
+
+    metrics.write_json(tmp_path / 'metrics.json', extra={'engine': 'threads'})
+    metrics.write_prometheus(tmp_path / 'sync.prom')
+
+    assert json.loads((tmp_path / 'metrics.json').read_text())['engine'] == 'threads'
+    assert (tmp_path / 'sync.prom').read_text().endswith('\n')
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['metrics.json', 'sync.prom']